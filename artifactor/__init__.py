@@ -125,6 +125,9 @@ import logging
 import os
 import re
 import sys
+from Queue import Empty, Full, Queue
+from threading import Event, Lock, Thread, current_thread
+from time import time
 
 from py.path import local
 from riggerlib import Rigger, RiggerBasePlugin, RiggerClient
@@ -176,7 +179,166 @@ class Artifactor(Rigger):
 
 
 class ArtifactorClient(RiggerClient):
-    pass
+    def flush(self, timeout=None):
+        """Waits for the fired hooks to be sent, they are sent as they are fired here."""
+        return True
+
+
+class QueuedHook(object):
+    """A hook fired by :py:class:`AsyncArtifactorClient`, waiting to be sent."""
+    __slots__ = ('hook_name', 'grab_result', 'wait_for_task', 'kwargs', 'done', 'result')
+
+    def __init__(self, hook_name, grab_result, wait_for_task, kwargs):
+        self.hook_name = hook_name
+        self.grab_result = grab_result
+        self.wait_for_task = wait_for_task
+        self.kwargs = kwargs
+        # Only the callers grabbing the result wait for it
+        self.done = Event() if grab_result else None
+        self.result = None
+
+
+class AsyncArtifactorClient(ArtifactorClient):
+    """Client firing the hooks from a background thread, so that the tests do not wait for them.
+
+    :py:meth:`fire_hook` puts the hook in a bounded queue and returns. A sender thread takes up to
+    ``batch_size`` hooks off the queue at once and fires them in the order they were fired. The
+    sender waits for the hooks fired with ``wait_for_task``, so the hooks after them still run
+    after them on the server. A ``build_report`` is left out of a batch that has another one
+    later, the later one builds the same report.
+
+    The callers of the hooks fired with ``grab_result`` wait for the result, after the hooks
+    queued before them.
+
+    When a request fails, the server is taken as gone and the sender stops sending, the hooks
+    still queued and those fired later are counted in :py:attr:`unsent` instead of waiting for a
+    request timeout each.
+
+    Args:
+        address: The address of the artifactor server
+        port: The port of the artifactor server
+        queue_size: Hooks waiting to be sent at most
+        batch_size: Hooks taken off the queue at once
+        full_policy: What :py:meth:`fire_hook` does when the queue is full, ``block`` until there
+            is room or ``drop`` the hook (counted in :py:attr:`dropped`). The hooks fired with
+            ``grab_result`` always block.
+        flush_timeout: Seconds :py:meth:`flush` and :py:meth:`terminate` wait for the queued
+            hooks at most
+    """
+    FULL_POLICIES = ('block', 'drop')
+    #: Hooks that are left out of a batch having another one later, they do the same every time
+    COALESCED_HOOKS = {'build_report'}
+
+    def __init__(self, address, port, queue_size=10000, batch_size=100, full_policy='block',
+                 flush_timeout=60):
+        if full_policy not in self.FULL_POLICIES:
+            raise ValueError('full_policy must be one of {}, not {!r}'.format(
+                ', '.join(self.FULL_POLICIES), full_policy))
+        super(AsyncArtifactorClient, self).__init__(address, port)
+        self.batch_size = batch_size
+        self.full_policy = full_policy
+        self.flush_timeout = flush_timeout
+        self.dropped = 0
+        self.coalesced = 0
+        self.server_gone = False
+        self._lost = 0
+        self._queue = Queue(queue_size)
+        self._sender = None
+        self._sender_lock = Lock()
+
+    @property
+    def unsent(self):
+        """Hooks that did not reach the server, as it was gone, or that are still queued."""
+        return self._lost + self._queue.unfinished_tasks
+
+    def fire_hook(self, hook_name, grab_result=False, wait_for_task=False, **kwargs):
+        if self.server_gone:
+            self._lost += 1
+            return None
+        if self._sender is None:
+            with self._sender_lock:
+                if self._sender is None:
+                    self._sender = Thread(target=self._send, name='artifactor-sender')
+                    self._sender.daemon = True
+                    self._sender.start()
+        hook = QueuedHook(hook_name, grab_result, wait_for_task, kwargs)
+        if grab_result or self.full_policy == 'block':
+            self._queue.put(hook)
+        else:
+            try:
+                self._queue.put_nowait(hook)
+            except Full:
+                self.dropped += 1
+                return None
+        if grab_result:
+            hook.done.wait()
+            return hook.result
+        return None
+
+    def _request(self, data):
+        # RiggerClient.fire_hook returns None whatever goes wrong, the sender has to know
+        try:
+            return super(AsyncArtifactorClient, self)._request(data)
+        except Exception:
+            if current_thread() is self._sender:
+                self.server_gone = True
+            raise
+
+    def _send(self):
+        fire_hook = super(AsyncArtifactorClient, self).fire_hook
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            last = {
+                hook.hook_name: n for n, hook in enumerate(batch)
+                if hook.hook_name in self.COALESCED_HOOKS and not hook.kwargs}
+            for n, hook in enumerate(batch):
+                try:
+                    # Keeps taking the hooks off the queue, so that nobody waits on a full one
+                    if self.server_gone:
+                        self._lost += 1
+                        continue
+                    superseded = not hook.kwargs and last.get(hook.hook_name, n) > n
+                    if superseded and hook.done is None:
+                        self.coalesced += 1
+                        continue
+                    hook.result = fire_hook(
+                        hook.hook_name, grab_result=hook.grab_result,
+                        wait_for_task=hook.wait_for_task, **hook.kwargs)
+                    if self.server_gone:
+                        self._lost += 1
+                except Exception:
+                    pass  # Like the hooks fired directly, a failed hook does not stop the others
+                finally:
+                    if hook.done is not None:
+                        hook.done.set()
+                    self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """Waits for the queued hooks to be sent.
+
+        Args:
+            timeout: Seconds to wait at most, :py:attr:`flush_timeout` if ``None``
+        Returns:
+            ``True`` if all the hooks were sent, ``False`` if the time ran out first or the
+            server is gone. The hooks that were not sent are counted in :py:attr:`unsent`.
+        """
+        end = time() + (self.flush_timeout if timeout is None else timeout)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = end - time()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return not self.server_gone
+
+    def terminate(self):
+        self.flush()
+        return super(AsyncArtifactorClient, self).terminate()
 
 
 class ArtifactorBasePlugin(RiggerBasePlugin):
@@ -11,16 +11,25 @@ artifactor:
             enabled: True
             plugin: reporter
             only_failed: False #Only show faled tests in the report
+
+The report is built again every time a test reports, so it is built incrementally. The report data
+of every finished test is made once, when it finishes or its artifacts change, and kept in
+``report_index.jsonl`` in the log dir. The tests are rendered into pages of their own in
+``report_pages/``, which are only rendered again when their tests change and are loaded by the
+report as they are scrolled to, and the tree of the tests is loaded as it is opened.
 """
 import csv
 import datetime
 import difflib
+import hashlib
+import json
 import math
 import os
 import re
 import shutil
 import time
-from copy import deepcopy
+from collections import OrderedDict
+from threading import RLock
 
 from jinja2 import Environment, FileSystemLoader
 from py.path import local
@@ -30,24 +39,33 @@ from utils.conf import cfme_data  # Only for the provider specific reports
 from utils.path import template_path
 from artifactor import ArtifactorBasePlugin
 
-_tests_tpl = {
-    '_sub': {},
-    '_stats': {
-        'passed': 0,
-        'failed': 0,
-        'skipped': 0,
-        'error': 0,
-        'xpassed': 0,
-        'xfailed': 0
-    },
-    '_duration': 0
-}
+#: Tests in one page of the report, the pages are loaded by the browser as they are needed
+PAGE_SIZE = 200
+#: Where the pages are written in the log dir
+PAGES_DIR = 'report_pages'
+#: Where :py:class:`ReportIndex` keeps the report data of the tests in the log dir
+INDEX_FILENAME = 'report_index.jsonl'
 
 # Regexp, that finds all URLs in a string
 # Does not cover all the cases, but rather only those we can
 URL = re.compile(r"https?://[^/\s]+(?:/[^/\s?]+)*/?(?:\?(?:[^&\s=]+(?:=[^&\s]+)?&?)*)?")
 
 
+def tree_node():
+    return {
+        '_sub': {},
+        '_stats': {
+            'passed': 0,
+            'failed': 0,
+            'skipped': 0,
+            'error': 0,
+            'xpassed': 0,
+            'xfailed': 0
+        },
+        '_duration': 0
+    }
+
+
 def overall_test_status(statuses):
     # Handle some logic for when to count certain tests as which state
     for when, status in statuses.iteritems():
@@ -64,29 +82,145 @@ def overall_test_status(statuses):
     return "passed"
 
 
+def sorted_items(value):
+    """Dicts made into sorted lists of items, so that they always dump the same."""
+    if isinstance(value, dict):
+        return sorted((k, sorted_items(v)) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        return [sorted_items(v) for v in value]
+    return value
+
+
+def test_key(test):
+    """Digest of the artifacts the report data of a finished test is made of.
+
+    Returns ``None`` for a test that did not finish yet, its data changes as it runs.
+    """
+    if not test.get('finish_time', None):
+        return None
+    files = [(f['os_filename'], f['file_type'], f['group_id']) for f in test.get('files', [])]
+    data = [
+        sorted(test['statuses'].items()), test.get('start_time'), test['finish_time'],
+        test.get('slaveid'), sorted_items(test.get('skipped')), test.get('old', False),
+        sorted_items(test.get('composite')), files]
+    return hashlib.sha1(json.dumps(data, default=repr)).hexdigest()
+
+
+def format_duration(seconds):
+    if not seconds:
+        return seconds
+    return str(datetime.timedelta(seconds=math.ceil(seconds)))
+
+
+class ReportIndex(object):
+    """Report data of the tests, made once for every finished test and kept in a file.
+
+    Every finished test is a JSON line appended to the file, the last line of a test wins, so
+    updating a test costs the same however many tests there are. The tests keep the order they
+    were first seen in, which keeps the tests of the report pages in place as new tests come.
+    When the file has lines that do not win, as it does when the log dir is reused, it is written
+    again with only the lines that do once it is loaded.
+
+    Args:
+        filename: The file to keep the data in, loaded if it exists
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = RLock()
+        # ident: (key, data)
+        self.entries = OrderedDict()
+        lines = 0
+        try:
+            with open(self.filename) as f:
+                for lines, line in enumerate(f, 1):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # The last line, cut short
+                    self.entries[entry['ident']] = (entry['key'], entry['data'])
+        except IOError:
+            pass
+        if lines > len(self.entries):
+            self.compact()
+
+    def get(self, ident, key):
+        """Returns the data of the test if it was made of the same artifacts, else ``None``."""
+        entry = self.entries.get(ident)
+        if key is None or entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def compact(self):
+        """Writes the file again with the last line of every finished test only."""
+        with self.lock:
+            temp_filename = '{}.tmp'.format(self.filename)
+            with open(temp_filename, 'w') as f:
+                for ident, (key, data) in self.entries.iteritems():
+                    if key is not None:
+                        f.write(json.dumps({'ident': ident, 'key': key, 'data': data}) + '\n')
+            os.rename(temp_filename, self.filename)
+
+    def set(self, ident, key, data):
+        """Stores the data of a test, in the file as well if the test finished."""
+        with self.lock:
+            self.entries[ident] = (key, data)
+            if key is not None:
+                with open(self.filename, 'a') as f:
+                    f.write(json.dumps({'ident': ident, 'key': key, 'data': data}) + '\n')
+
+
 class ReporterBase(object):
+    @property
+    def report_indexes(self):
+        if not hasattr(self, '_report_indexes'):
+            self._report_indexes = {}
+        return self._report_indexes
+
+    @property
+    def rendered_pages(self):
+        if not hasattr(self, '_rendered_pages'):
+            self._rendered_pages = {}
+        return self._rendered_pages
+
+    @property
+    def template_env(self):
+        if not hasattr(self, '_template_env'):
+            self._template_env = Environment(
+                loader=FileSystemLoader(template_path.strpath)
+            )
+            self._template_env.filters['duration'] = format_duration
+        return self._template_env
+
+    def report_index(self, log_dir):
+        if log_dir not in self.report_indexes:
+            self.report_indexes[log_dir] = ReportIndex(
+                os.path.join(local(log_dir).strpath, INDEX_FILENAME))
+        return self.report_indexes[log_dir]
+
     def _run_report(self, old_artifacts, artifact_dir, version=None):
         template_data = self.process_data(old_artifacts, artifact_dir, version)
+        tests = template_data['tests']
 
         if hasattr(self, 'only_failed') and self.only_failed:
-            template_data['tests'] = [x for x in template_data['tests']
-                                  if x['outcomes']['overall'] not in ['passed']]
+            tests = [x for x in tests if x['outcomes']['overall'] not in ['passed']]
 
+        test_pages = {test['name']: n // PAGE_SIZE + 1 for n, test in enumerate(tests)}
+        template_data['tree'] = self.tree_data(template_data['tests'], test_pages)
+        template_data['pages'] = self.render_pages(tests, artifact_dir)
+        template_data['pages_json'] = json.dumps(template_data['pages'])
         self.render_report(template_data, 'report', artifact_dir, 'test_report.html')
 
     def _run_provider_report(self, old_artifacts, artifact_dir, version=None):
         for mgmt in cfme_data['management_systems'].keys():
             template_data = self.process_data(old_artifacts, artifact_dir, version,
                 name_filter=mgmt)
+            template_data['tree'] = self.tree_data(template_data['tests'])
 
             self.render_report(template_data, "report_{}".format(mgmt), artifact_dir,
                 'test_report_provider.html')
 
     def render_report(self, report, filename, log_dir, template):
-        template_env = Environment(
-            loader=FileSystemLoader(template_path.strpath)
-        )
-        data = template_env.get_template(template).render(**report)
+        data = self.template_env.get_template(template).render(**report)
 
         with open(os.path.join(log_dir, '{}.html'.format(filename)), "w") as f:
             f.write(data)
@@ -95,13 +229,133 @@ class ReporterBase(object):
         except OSError:
             pass
 
+    def render_pages(self, tests, log_dir):
+        """Renders the tests into pages of :py:data:`PAGE_SIZE` tests, each in a script file.
+
+        Only the pages whose tests changed since they were rendered are written again.
+
+        Returns:
+            :py:class:`list` of the versions of the pages, that change whenever a page does.
+        """
+        pages_dir = os.path.join(log_dir, PAGES_DIR)
+        if not os.path.isdir(pages_dir):
+            os.makedirs(pages_dir)
+        versions = []
+        for number, start in enumerate(range(0, len(tests), PAGE_SIZE), 1):
+            page_tests = tests[start:start + PAGE_SIZE]
+            # Running tests have no key, but their duration changes with every render
+            version = hashlib.sha1(json.dumps(
+                [(test['name'], test['key'] or test.get('duration', None))
+                 for test in page_tests])).hexdigest()[:12]
+            filename = os.path.join(pages_dir, 'page-{}.js'.format(number))
+            if self.rendered_pages.get(filename) != version or not os.path.exists(filename):
+                data = self.template_env.get_template('test_report_page.html').render(
+                    tests=page_tests)
+                with open(filename, "w") as f:
+                    f.write('report_page_loaded({}, {});\n'.format(number, json.dumps(data)))
+                self.rendered_pages[filename] = version
+            versions.append(version)
+        return versions
+
+    def test_data(self, test_name, test, log_dir):
+        """Makes the report data of a test out of its artifacts."""
+        overall_status = test['statuses']['overall']
+        color = {
+            'passed': 'success',
+            'failed': 'warning',
+            'error': 'danger',
+            'xpassed': 'danger',
+            'xfailed': 'success',
+            'skipped': 'info'}[overall_status]
+        test_data = {'name': test_name, 'outcomes': dict(test['statuses']),
+                     'slaveid': test.get('slaveid', "Unknown"), 'color': color,
+                     'tree_path': process_pytest_path(test_name.replace('cfme/', ''))}
+        if 'composite' in test:
+            test_data['composite'] = test['composite']
+
+        if 'skipped' in test:
+            if test['skipped'].get('type', None) == 'provider':
+                test_data['skip_provider'] = test['skipped'].get('reason', None)
+            if test['skipped'].get('type', None) == 'blocker':
+                test_data['skip_blocker'] = test['skipped'].get('reason', None)
+
+        if 'skip_blocker' in test_data:
+            # Fix the inconveniently long list of repeated blockers until we sort out sets
+            # in riggerlib somehow.
+            test_data['skip_blocker'] = sorted(set(test_data['skip_blocker']))
+
+        if test.get('old', False):
+            test_data['old'] = True
+
+        if test.get('start_time', None):
+            if test.get('finish_time', None):
+                test_data['in_progress'] = False
+                test_data['duration'] = test['finish_time'] - test['start_time']
+            else:
+                test_data['duration'] = time.time() - test['start_time']
+                test_data['in_progress'] = True
+
+        # Set up destinations for the files
+        test_data["file_groups"] = []
+        test_data['qa_contact'] = []
+        processed_groups = {}
+        order = 0
+        for file_dict in test.get('files', []):
+            group = file_dict["group_id"]
+            if group not in processed_groups:
+                processed_groups[group] = (order, [])
+                order += 1
+            processed_groups[group][-1].append(file_dict)
+        # Current structure:
+        # {groupid: (group_order, [{filedict1}, {filedict2}])}
+        # Sorting by group_order
+        processed_groups = sorted(processed_groups.iteritems(), key=lambda kv: kv[1][0])
+        # And now make it [(groupid, [{filedict1}, {filedict2}, ...])]
+        processed_groups = [(group_name, files) for group_name, (_, files) in processed_groups]
+        for group_name, file_dicts in processed_groups:
+            group_file_list = []
+            for file_dict in file_dicts:
+                if file_dict["file_type"] == "qa_contact":
+                    with open(file_dict["os_filename"], 'rb') as qafile:
+                        qareader = csv.reader(qafile, delimiter=',', quotechar='"')
+                        for qacontact in qareader:
+                            test_data['qa_contact'].append(qacontact)
+                    continue  # Do not store, handled a different way :)
+                elif file_dict["file_type"] == "short_tb":
+                    with open(file_dict["os_filename"], 'r') as short_tb:
+                        test_data["short_tb"] = short_tb.read()
+                    continue
+                file_dict = dict(file_dict)
+                file_dict["filename"] = file_dict["os_filename"].replace(log_dir, "")
+                group_file_list.append(file_dict)
+
+            test_data["file_groups"].append((group_name, group_file_list))
+        # Snd remove groups that are left empty because of eg. traceback or qa contact
+        test_data["file_groups"] = filter(
+            lambda group: len(group[1]) > 0, test_data["file_groups"])
+        if "short_tb" in test_data and test_data["short_tb"]:
+            urls = [url for url in URL.findall(test_data["short_tb"])]
+            if urls:
+                test_data["urls"] = urls
+        return test_data
+
+    def index_test(self, test_name, test, log_dir):
+        """Returns the report data of a test, made again only if its artifacts changed."""
+        index = self.report_index(log_dir)
+        key = test_key(test)
+        test_data = index.get(test_name, key)
+        if test_data is None:
+            test_data = self.test_data(test_name, test, local(log_dir).strpath + "/")
+            test_data['key'] = key
+            index.set(test_name, key, test_data)
+        return test_data
+
     def process_data(self, artifacts, log_dir, version, name_filter=None):
         tb_errors = []
         blocker_skip_count = 0
         provider_skip_count = 0
         template_data = {'tests': [], 'qa': []}
         template_data['version'] = version
-        log_dir = local(log_dir).strpath + "/"
         counts = {
             'passed': 0,
             'failed': 0,
@@ -116,97 +370,30 @@ class ReporterBase(object):
             'error': 0,
             'xfailed': 0,
             'xpassed': 0}
-        colors = {
-            'passed': 'success',
-            'failed': 'warning',
-            'error': 'danger',
-            'xpassed': 'danger',
-            'xfailed': 'success',
-            'skipped': 'info'}
-        # Iterate through the tests and process the counts and durations
+        # Iterate through the tests and process the counts, only the changed tests are processed
         for test_name, test in artifacts.iteritems():
             if not test.get('statuses', None):
                 continue
-            overall_status = overall_test_status(test['statuses'])
-            counts[overall_status] += 1
-            if not test.get('old', False):
-                current_counts[overall_status] += 1
-            color = colors[overall_status]
             # This was removed previously but is needed as the overall is not generated
             # until the test finishes. So this is here as a shim.
-            test['statuses']['overall'] = overall_status
-            test_data = {'name': test_name, 'outcomes': test['statuses'],
-                         'slaveid': test.get('slaveid', "Unknown"), 'color': color}
-            if 'composite' in test:
-                test_data['composite'] = test['composite']
-
-            if 'skipped' in test:
-                if test['skipped'].get('type', None) == 'provider':
-                    provider_skip_count += 1
-                    test_data['skip_provider'] = test['skipped'].get('reason', None)
-                if test['skipped'].get('type', None) == 'blocker':
-                    blocker_skip_count += 1
-                    test_data['skip_blocker'] = test['skipped'].get('reason', None)
-
+            test['statuses']['overall'] = overall_test_status(test['statuses'])
+            self.index_test(test_name, test, log_dir)
+        # The tests in the order they were first seen in
+        for test_name, (_, test_data) in self.report_index(log_dir).entries.items():
+            test = artifacts.get(test_name, None)
+            if test is None or not test.get('statuses', None):
+                continue
+            overall_status = test_data['outcomes']['overall']
+            counts[overall_status] += 1
+            if not test_data.get('old', False):
+                current_counts[overall_status] += 1
+            if 'skip_provider' in test_data:
+                provider_skip_count += 1
             if 'skip_blocker' in test_data:
-                # Fix the inconveniently long list of repeated blockers until we sort out sets
-                # in riggerlib somehow.
-                test_data['skip_blocker'] = sorted(set(test_data['skip_blocker']))
-
-            if test.get('old', False):
-                test_data['old'] = True
-
-            if test.get('start_time', None):
-                if test.get('finish_time', None):
-                    test_data['in_progress'] = False
-                    test_data['duration'] = test['finish_time'] - test['start_time']
-                else:
-                    test_data['duration'] = time.time() - test['start_time']
-                    test_data['in_progress'] = True
-
-            # Set up destinations for the files
-            test_data["file_groups"] = []
-            test_data['qa_contact'] = []
-            processed_groups = {}
-            order = 0
-            for file_dict in test.get('files', []):
-                group = file_dict["group_id"]
-                if group not in processed_groups:
-                    processed_groups[group] = (order, [])
-                    order += 1
-                processed_groups[group][-1].append(file_dict)
-            # Current structure:
-            # {groupid: (group_order, [{filedict1}, {filedict2}])}
-            # Sorting by group_order
-            processed_groups = sorted(processed_groups.iteritems(), key=lambda kv: kv[1][0])
-            # And now make it [(groupid, [{filedict1}, {filedict2}, ...])]
-            processed_groups = [(group_name, files) for group_name, (_, files) in processed_groups]
-            for group_name, file_dicts in processed_groups:
-                group_file_list = []
-                for file_dict in file_dicts:
-                    if file_dict["file_type"] == "qa_contact":
-                        with open(file_dict["os_filename"], 'rb') as qafile:
-                            qareader = csv.reader(qafile, delimiter=',', quotechar='"')
-                            for qacontact in qareader:
-                                test_data['qa_contact'].append(qacontact)
-                                if qacontact[0] not in template_data['qa']:
-                                    template_data['qa'].append(qacontact[0])
-                        continue  # Do not store, handled a different way :)
-                    elif file_dict["file_type"] == "short_tb":
-                        with open(file_dict["os_filename"], 'r') as short_tb:
-                            test_data["short_tb"] = short_tb.read()
-                        continue
-                    file_dict["filename"] = file_dict["os_filename"].replace(log_dir, "")
-                    group_file_list.append(file_dict)
-
-                test_data["file_groups"].append((group_name, group_file_list))
-            # Snd remove groups that are left empty because of eg. traceback or qa contact
-            test_data["file_groups"] = filter(
-                lambda group: len(group[1]) > 0, test_data["file_groups"])
-            if "short_tb" in test_data and test_data["short_tb"]:
-                urls = [url for url in URL.findall(test_data["short_tb"])]
-                if urls:
-                    test_data["urls"] = urls
+                blocker_skip_count += 1
+            for qacontact in test_data['qa_contact']:
+                if qacontact[0] not in template_data['qa']:
+                    template_data['qa'].append(qacontact[0])
             template_data['tests'].append(test_data)
         template_data['top10'] = self.top10(tb_errors)
         template_data['counts'] = counts
@@ -218,22 +405,24 @@ class ReporterBase(object):
             template_data['tests'] = [x for x in template_data['tests']
                                       if re.findall('{}[-\]]+'.format(name_filter), x['name'])]
 
-        # Create the tree dict that is used for js tree
-        # Note template_data['tests'] != tests
-        tests = deepcopy(_tests_tpl)
-        tests['_sub']['tests'] = deepcopy(_tests_tpl)
+        return template_data
 
-        for test in template_data['tests']:
-            self.build_dict(test['name'].replace('cfme/', ''), tests, test)
+    def tree_data(self, tests, test_pages=None):
+        """Makes the JSON of the tree of the tests, loaded lazily by the report.
 
-        template_data['ndata'] = self.build_li(tests)
+        Args:
+            tests: Report data of the tests
+            test_pages: Mapping of test name to the number of the report page it is on
+        """
+        # Create the tree dict that is used for js tree
+        root = tree_node()
+        root['_sub']['tests'] = tree_node()
 
-        for test in template_data['tests']:
-            if test.get('duration', None):
-                test['duration'] = str(datetime.timedelta(
-                    seconds=math.ceil(test['duration'])))
+        for test in tests:
+            self.build_dict(test['tree_path'], root, test)
 
-        return template_data
+        # Safe to put in a <script>
+        return json.dumps(self.build_nodes(root, test_pages or {})).replace('</', '<\\/')
 
     def top10(self, tb_errors):
         sets = []
@@ -267,19 +456,20 @@ class ReporterBase(object):
         if not end:
             container['_sub'][head] = contents
             container['_stats'][contents['outcomes']['overall']] += 1
-            container['_duration'] += contents['duration']
+            container['_duration'] += contents.get('duration', 0)
         # If we are in a module.
         else:
             if head not in container['_sub']:
-                container['_sub'][head] = deepcopy(_tests_tpl)
+                container['_sub'][head] = tree_node()
             # Call again to recurse down the tree.
             self.build_dict(end, container['_sub'][head], contents)
             container['_stats'][contents['outcomes']['overall']] += 1
-            container['_duration'] += contents['duration']
+            container['_duration'] += contents.get('duration', 0)
 
-    def build_li(self, lev):
+    def build_nodes(self, lev, test_pages):
         """
-        Build up the actual HTML tree from the dict from build_dict
+        Build up the jstree nodes from the dict from build_dict, the children of a module are
+        in ``kids`` so that the tree loads them only when the module is opened.
         """
         bimdict = {'passed': 'success',
                    'failed': 'warning',
@@ -287,22 +477,22 @@ class ReporterBase(object):
                    'skipped': 'primary',
                    'xpassed': 'danger',
                    'xfailed': 'success'}
-        list_string = '<ul>\n'
+        nodes = []
         for k, v in lev['_sub'].iteritems():
 
             # If 'name' is an attribute then we are looking at a test (leaf).
             if 'name' in v:
-                pretty_time = str(datetime.timedelta(seconds=math.ceil(v['duration'])))
+                pretty_time = format_duration(v.get('duration', 0)) or '0:00:00'
                 teststring = '<span name="mod_lev" class="label label-primary">T</span>'
                 label = '<span class="label label-{}">{}</span>'.format(
                     bimdict[v['outcomes']['overall']], v['outcomes']['overall'].upper())
-                proc_name = process_pytest_path(v['name'])[-1]
-                link = (
-                    '<a href="#{}">{} {} {} <span style="color:#888888"><em>[{}]</em></span></a>'
-                    .format(v['name'], proc_name, teststring, label, pretty_time))
-                # Do we really need the os.path.split (now process_pytest_path) here?
-                # For me it seems the name is always the leaf
-                list_string += '<li>{}</li>\n'.format(link)
+                proc_name = v['tree_path'][-1]
+                nodes.append({
+                    'text': '{} {} {} <span style="color:#888888"><em>[{}]</em></span>'.format(
+                        proc_name, teststring, label, pretty_time),
+                    'name': v['name'],
+                    'page': test_pages.get(v['name'], None),
+                    'a_attr': {'href': '#{}'.format(v['name'])}})
 
             # If there is a '_sub' attribute then we know we have other modules to go.
             elif '_sub' in v:
@@ -324,16 +514,13 @@ class ReporterBase(object):
                     percenstring = '<span name="blab" class="label label-{}">{}%</span>'.format(
                         bimdict[level], percen)
                 modstring = '<span name="mod_lev" class="label label-primary">M</span>'
-                pretty_time = str(datetime.timedelta(seconds=math.ceil(v['_duration'])))
-                list_string += ('<li>{} {}<span>&nbsp;</span>'
-                                '{}{}<span style="color:#888888">&nbsp;<em>[{}]'
-                                '</em></span></li>\n').format(k,
-                                                              modstring,
-                                                              str(percenstring),
-                                                              self.build_li(v),
-                                                              pretty_time)
-        list_string += '</ul>\n'
-        return list_string
+                pretty_time = format_duration(v['_duration']) or '0:00:00'
+                nodes.append({
+                    'text': ('{} {}<span>&nbsp;</span>'
+                             '{}<span style="color:#888888">&nbsp;<em>[{}]'
+                             '</em></span>').format(k, modstring, str(percenstring), pretty_time),
+                    'kids': self.build_nodes(v, test_pages)})
+        return nodes
 
 
 class Reporter(ArtifactorBasePlugin, ReporterBase):
@@ -376,11 +563,17 @@ class Reporter(ArtifactorBasePlugin, ReporterBase):
         }
 
     @ArtifactorBasePlugin.check_configured
-    def finish_test(self, artifacts, test_location, test_name, slaveid):
+    def finish_test(self, artifacts, test_location, test_name, slaveid, artifact_dir):
         test_ident = "{}/{}".format(test_location, test_name)
         overall_status = overall_test_status(artifacts[test_ident]['statuses'])
+        finish_time = time.time()
+        # Index the test as it is going to be after this update, so the reports only have to
+        # process the tests that changed since
+        test = dict(artifacts[test_ident], finish_time=finish_time, slaveid=slaveid)
+        test['statuses'] = dict(test['statuses'], overall=overall_status)
+        self.index_test(test_ident, test, artifact_dir)
         return None, {'artifacts': {test_ident: {
-            'finish_time': time.time(), 'slaveid': slaveid,
+            'finish_time': finish_time, 'slaveid': slaveid,
             'statuses': {'overall': overall_status}
         }}}
 
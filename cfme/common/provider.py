@@ -18,6 +18,7 @@ from utils import ParamClassName, version, conf
 from utils.appliance import Navigatable
 from utils.appliance.implementations.ui import navigate_to
 from utils.blockers import BZ
+from utils.db import ems_count
 from utils.browser import ensure_browser_open
 from utils.log import logger
 from utils.stats import tol_check
@@ -51,10 +52,52 @@ def all_types():
     return all_types
 
 
+def stats_snapshot(providers, stats=None):
+    """ Counts the inventory of the providers in the appliance DB, many stats of many at once
+
+    Providers of the same kind on the same appliance are counted together, in a single query.
+
+    Args:
+        providers: Provider crud objects
+        stats: Names of the stats to count, e.g. ``['num_vm', 'num_host']``; each provider has to
+            have them in its ``STATS_SQL``. By default those of its ``STATS_TO_MATCH`` which it
+            counts in the DB anyway, see :py:meth:`BaseProvider.counts_in_db`.
+
+    Returns:
+        ``{provider: {stat: count}}``; providers that are not on the appliance are left out
+
+    Raises:
+        ProviderHasNoProperty: If a provider does not know how to count one of ``stats`` in the DB.
+    """
+    groups = {}
+    for provider in providers:
+        if stats is None:
+            names = [stat for stat in provider.STATS_TO_MATCH if provider.counts_in_db(stat)]
+        else:
+            names = stats
+        try:
+            counts = {stat: provider.STATS_SQL[stat] for stat in names}
+        except KeyError as e:
+            raise ProviderHasNoProperty(
+                "Provider does not know how to count '{}' in the DB".format(e.args[0]))
+        key = (id(provider.appliance), tuple(sorted(counts.items())))
+        groups.setdefault(key, (provider.appliance, counts, []))[2].append(provider)
+
+    snapshot = {}
+    for appliance, counts, group in groups.values():
+        found = appliance.db.count_by_ems([provider.name for provider in group], counts)
+        for provider in group:
+            if provider.name in found:
+                snapshot[provider] = found[provider.name]
+    return snapshot
+
+
 class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
     # List of constants that every non-abstract subclass must have defined
     _param_name = ParamClassName('name')
     STATS_TO_MATCH = []
+    # SQL counting the stats which can be counted in the DB, see stats_snapshot()
+    STATS_SQL = {}
     string_name = ""
     page_name = ""
     edit_page_suffix = ""
@@ -445,12 +488,37 @@ class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
         Args:
             table_str: Name of the table; e.g. 'vms' or 'hosts'
         """
-        res = self.appliance.db.engine.execute(
-            "SELECT count(*) "
-            "FROM ext_management_systems, {0} "
-            "WHERE {0}.ems_id=ext_management_systems.id "
-            "AND ext_management_systems.name='{1}'".format(table_str, self.name))
-        return int(res.first()[0])
+        return self.db_stats(counts={'count': ems_count(table_str)})['count']
+
+    @classmethod
+    def counts_in_db(cls, stat):
+        """ Whether the stat is counted in the DB when no variant of it is asked for
+
+        Only those stats are counted by ``STATS_SQL`` by default, the others are counted the way
+        their default variant does it, e.g. over REST.
+        """
+        return stat in cls.STATS_SQL and getattr(cls, stat).is_default('db')
+
+    def db_stats(self, stats=None, counts=None):
+        """ Counts stats of this provider in the DB, all of them in one query
+
+        Args:
+            stats: Names of the stats to count, see :py:func:`stats_snapshot`
+            counts: ``{key: sql}`` to count instead of the stats,
+                see :py:meth:`utils.db.Db.count_by_ems`
+
+        Returns:
+            ``{stat: count}``, zeros if the provider is not on the appliance
+        """
+        if counts is not None:
+            found = self.appliance.db.count_by_ems([self.name], counts).get(self.name)
+            return found if found is not None else {key: 0 for key in counts}
+        found = stats_snapshot([self], stats).get(self)
+        if found is None:
+            if stats is None:
+                stats = [stat for stat in self.STATS_TO_MATCH if self.counts_in_db(stat)]
+            found = {stat: 0 for stat in stats}
+        return found
 
     def _do_stats_match(self, client, stats_to_match=None, refresh_timer=None, ui=False):
         """ A private function to match a set of statistics, with a Provider.
@@ -480,9 +548,19 @@ class BaseProvider(Taggable, Updateable, SummaryMixin, Navigatable):
                 self.refresh_provider_relationships()
                 refresh_timer.reset()
 
+        # The stats which are counted in the DB anyway are all counted in one query
+        db_stats = {}
+        if not ui:
+            sql_stats = [stat for stat in stats_to_match if self.counts_in_db(stat)]
+            if sql_stats:
+                db_stats = self.db_stats(sql_stats)
+
         for stat in stats_to_match:
             try:
-                cfme_stat = getattr(self, stat)(method=method)
+                if stat in db_stats:
+                    cfme_stat = db_stats[stat]
+                else:
+                    cfme_stat = getattr(self, stat)(method=method)
                 success, value = tol_check(host_stats[stat],
                                            cfme_stat,
                                            min_error=0.05,
@@ -653,6 +731,10 @@ class CloudInfraProvider(BaseProvider, PolicyProfileAssignable):
     edit_page_suffix = 'provider_edit'
     refresh_text = "Refresh Relationships and Power States"
     db_types = ["CloudManager", "InfraManager"]
+    STATS_SQL = {
+        'num_template': ems_count('vms', 'vms.template = true'),
+        'num_vm': ems_count('vms', 'vms.template = false'),
+    }
 
     def wait_for_creds_ok(self):
         """Waits for provider's credentials to become O.K. (circumvents the summary rails exc.)"""
@@ -13,6 +13,7 @@ from utils import deferred_verpick, version
 from utils.appliance import Navigatable
 from utils.appliance.implementations.ui import navigator, CFMENavigateStep, navigate_to
 from utils.browser import ensure_browser_open
+from utils.db import ems_count
 from utils.pretty import Pretty
 from utils.varmeth import variable
 
@@ -100,6 +101,24 @@ class ContainersProvider(BaseProvider, Pretty):
         'num_image_registry',
         'num_container']
     # TODO add 'num_volume'
+    STATS_SQL = {
+        'num_project': ems_count('container_projects'),
+        'num_service': ems_count('container_services'),
+        'num_replication_controller': ems_count('container_replicators'),
+        'num_container_group': ems_count('container_groups'),
+        'num_pod': ems_count('container_groups'),
+        'num_node': ems_count('container_nodes'),
+        'num_image': ems_count('container_images'),
+        'num_image_registry': ems_count('container_image_registries'),
+        # Containers are linked to providers through container definitions and then through pods
+        'num_container': (
+            'SELECT count(*) FROM containers '
+            'JOIN container_definitions '
+            'ON container_definitions.id = containers.container_definition_id '
+            'JOIN container_groups '
+            'ON container_groups.id = container_definitions.container_group_id '
+            'WHERE container_groups.ems_id = ems.id'),
+    }
     string_name = "Containers"
     page_name = "containers"
     detail_page_suffix = 'provider_detail'
@@ -217,15 +236,7 @@ class ContainersProvider(BaseProvider, Pretty):
 
     @variable(alias='db')
     def num_container(self):
-        # Containers are linked to providers through container definitions and then through pods
-        res = self.appliance.db.engine.execute(
-            "SELECT count(*) "
-            "FROM ext_management_systems, container_groups, container_definitions, containers "
-            "WHERE containers.container_definition_id=container_definitions.id "
-            "AND container_definitions.container_group_id=container_groups.id "
-            "AND container_groups.ems_id=ext_management_systems.id "
-            "AND ext_management_systems.name='{}'".format(self.name))
-        return int(res.first()[0])
+        return self.db_stats(['num_container'])['num_container']
 
     @num_container.variant('ui')
     def num_container_ui(self):
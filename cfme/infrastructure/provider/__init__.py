@@ -24,6 +24,7 @@ from cfme.web_ui import Quadicon, match_location
 from utils import conf, version
 from utils.appliance import Navigatable
 from utils.appliance.implementations.ui import navigator, CFMENavigateStep, navigate_to
+from utils.db import ems_count
 from utils.log import logger
 from utils.net import resolve_hostname
 from utils.pretty import Pretty
@@ -59,6 +60,15 @@ class InfraProvider(Pretty, CloudInfraProvider, Fillable):
     category = "infra"
     pretty_attrs = ['name', 'key', 'zone']
     STATS_TO_MATCH = ['num_template', 'num_vm', 'num_datastore', 'num_host', 'num_cluster']
+    STATS_SQL = dict(
+        CloudInfraProvider.STATS_SQL,
+        num_datastore=(
+            'SELECT count(DISTINCT storages.name) FROM hosts '
+            'JOIN host_storages ON host_storages.host_id = hosts.id '
+            'JOIN storages ON storages.id = host_storages.storage_id '
+            'WHERE hosts.ems_id = ems.id'),
+        num_host=ems_count('hosts'),
+        num_cluster=ems_count('ems_clusters'))
     string_name = "Infrastructure"
     page_name = "infrastructure"
     templates_destination_name = "Templates"
@@ -137,15 +147,8 @@ class InfraProvider(Pretty, CloudInfraProvider, Fillable):
 
     @variable(alias='db')
     def num_datastore(self):
-        """ Returns the providers number of templates, as shown on the Details page."""
-        results = list(self.appliance.db.engine.execute(
-            'SELECT DISTINCT storages.name, hosts.ems_id '
-            'FROM ext_management_systems ems, hosts, storages st, host_storages hst'
-            'WHERE hosts.id=hst.host_id AND '
-            'st.id=hst.storage_id AND '
-            'hosts.ems_id=ems.id AND '
-            'ems.name=\'{}\''.format(self.name)))
-        return len(results)
+        """ Returns the providers number of datastores, as shown on the Details page."""
+        return self.db_stats(['num_datastore'])['num_datastore']
 
     @num_datastore.variant('ui')
     def num_datastore_ui(self):
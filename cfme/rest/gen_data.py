@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import time
+
 import fauxfactory
+from manageiq_client.filters import Q
 
 from cfme.automate.service_dialogs import ServiceDialog
 from cfme.exceptions import OptionNotAvailable
@@ -10,7 +13,7 @@ from cfme.services.catalogs.service_catalogs import ServiceCatalogs
 from cfme.services import requests
 from fixtures.provider import setup_one_by_class_or_skip
 from utils.virtual_machines import deploy_template
-from utils.wait import wait_for
+from utils.wait import wait_for, TimedOutError
 from utils.log import logger
 from utils import version
 
@@ -253,18 +256,13 @@ def service_templates(request, rest_api, service_dialog=None, service_catalog=No
         catalog_item.create()
 
     collection = rest_api.collections.service_templates
-
-    for new_name in new_names:
-        wait_for(lambda: collection.find_by(name=new_name) or False, num_sec=180, delay=10)
-
-    s_tpls = [ent for ent in collection if ent.name in new_names]
+    query = _any_of('name', new_names)
+    _wait_for_entities(collection, query, len(new_names))
+    s_tpls = _find_all(collection, query)
 
     @request.addfinalizer
     def _finished():
-        collection.reload()
-        to_delete = [ent for ent in collection if ent.name in new_names]
-        if len(to_delete) != 0:
-            collection.action.delete(*to_delete)
+        _delete_entities(collection, query)
 
     return s_tpls
 
@@ -380,30 +378,71 @@ def _creating_skeleton(request, rest_api, col_name, col_data, col_action='create
     entities = action(*col_data)
     action_status = rest_api.response.status_code
     search_str = '%{}%' if substr_search else '{}'
+    query = None
     for entity in col_data:
         if entity.get('name', None):
-            wait_for(lambda: collection.find_by(
-                name=search_str.format(entity.get('name'))) or False, num_sec=180, delay=10)
+            entity_query = Q('name', '=', search_str.format(entity.get('name')))
         elif entity.get('description', None):
-            wait_for(lambda: collection.find_by(
-                description=search_str.format(entity.get('description'))) or False,
-                num_sec=180, delay=10)
+            entity_query = Q('description', '=', search_str.format(entity.get('description')))
         else:
             raise NotImplementedError
+        query = entity_query if query is None else query | entity_query
+    _wait_for_entities(collection, query, len(col_data))
 
     @request.addfinalizer
     def _finished():
-        collection.reload()
         ids = [e.id for e in entities]
-        delete_entities = [e for e in collection if e.id in ids]
-        if len(delete_entities) != 0:
-            collection.action.delete(*delete_entities)
+        if ids:
+            _delete_entities(collection, _any_of('id', ids))
 
     # make sure action status code is preserved
     rest_api.response.status_code = action_status
     return entities
 
 
+def _any_of(field, values):
+    """Query for the entities whose ``field`` equals any of ``values``"""
+    query = None
+    for value in values:
+        query = Q(field, '=', value) if query is None else query | Q(field, '=', value)
+    return query
+
+
+def _find_all(collection, query):
+    """Returns the entities found by the query, all loaded by a single request"""
+    params = {'filter[]': query.as_filters, 'expand': 'resources'}
+    return collection.query_string(**params).resources
+
+
+def _wait_for_entities(collection, query, num, num_sec=180, max_delay=10):
+    """Waits until the query finds ``num`` entities, with a single request per try
+
+    The tries start a quarter of a second apart, as the entities are usually there right away,
+    and back off up to ``max_delay`` seconds apart.
+    """
+    delay = 0.25
+    timeout = time.time() + num_sec
+    while True:
+        found = collection.filter(query).subcount
+        if found >= num:
+            return
+        if time.time() + delay > timeout:
+            raise TimedOutError('Only {} of {} {} found after {} seconds'.format(
+                found, num, collection.name, num_sec))
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def _delete_entities(collection, query):
+    """Deletes those of the entities found by the query which are still there, in one request
+
+    Unlike iterating over the collection, this does not load the whole collection.
+    """
+    entities = collection.filter(query).resources
+    if entities:
+        collection.action.delete(*entities)
+
+
 def mark_vm_as_template(rest_api, provider, vm_name):
     """
         Function marks vm as template via mgmt and returns template Entity
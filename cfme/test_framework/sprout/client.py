@@ -36,34 +36,38 @@ class SproutClient(object):
         self._port = port
         self._entry = entry
         self._auth = auth
+        # Keeps the connection to Sprout alive between the calls
+        self._session = requests.Session()
 
     @property
     def api_entry(self):
         return "{}://{}:{}/{}".format(self._proto, self._host, self._port, self._entry)
 
-    def _post(self, **data):
-        return requests.post(self.api_entry, data=json.dumps(data))
+    def _post(self, data):
+        return self._session.post(self.api_entry, data=json.dumps(data))
 
-    def _call_post(self, **data):
+    def _call_post(self, data):
         """Protect from the Sprout being updated (error 502,503)"""
         result = wait_for(
-            lambda: self._post(**data),
+            lambda: self._post(data),
             num_sec=60,
             fail_condition=lambda r: r.status_code in {502, 503},
             delay=2,
         )
         return result.out.json()
 
-    def call_method(self, name, *args, **kwargs):
+    def _request_data(self, name, args, kwargs):
         req_data = {
             "method": name,
             "args": args,
             "kwargs": kwargs,
         }
-        logger.info("SPROUT: Called {} with {} {}".format(name, args, kwargs))
         if self._auth is not None:
             req_data["auth"] = self._auth
-        result = self._call_post(**req_data)
+        return req_data
+
+    @staticmethod
+    def _unpack_result(result):
         try:
             if result["status"] == "exception":
                 raise SproutException(
@@ -77,6 +81,24 @@ class SproutClient(object):
         except KeyError:
             raise Exception("Malformed response from Sprout!")
 
+    def call_method(self, name, *args, **kwargs):
+        logger.info("SPROUT: Called {} with {} {}".format(name, args, kwargs))
+        return self._unpack_result(self._call_post(self._request_data(name, args, kwargs)))
+
+    def call_methods(self, *calls):
+        """Calls several methods with one request.
+
+        Args:
+            *calls: ``(name, args, kwargs)`` tuples of the calls
+        Returns:
+            :py:class:`list` of the results of the calls, in the same order. If any of the calls
+            failed, the exception of the first one that did is raised instead.
+        """
+        logger.info("SPROUT: Called {}".format(", ".join(name for name, _, _ in calls)))
+        results = self._call_post([
+            self._request_data(name, args, kwargs) for name, args, kwargs in calls])
+        return [self._unpack_result(result) for result in results]
+
     def __getattr__(self, attr):
         return APIMethodCall(self, attr)
 
@@ -110,10 +132,11 @@ class SproutClient(object):
             'request_appliances', preconfigured=preconfigured, version=version,
             group=stream, provider=provider, lease_time=lease_time, ram=ram, cpu=cpu, count=count
         )
-        wait_for(
-            lambda: self.call_method('request_check', str(request_id))['finished'], num_sec=300,
-            message='provision {} appliance(s) from sprout'.format(count))
-        data = self.call_method('request_check', str(request_id))
+        # wait_for_pool returns as soon as the pool is finished, or within 20 seconds
+        data = wait_for(
+            lambda: self.call_method('wait_for_pool', str(request_id), finished=True),
+            fail_condition=lambda data: not data['finished'], num_sec=300,
+            message='provision {} appliance(s) from sprout'.format(count)).out
         logger.debug(data)
         appliances = []
         for appliance in data['appliances']:
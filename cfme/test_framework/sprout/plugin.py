@@ -191,7 +191,8 @@ class SproutManager(object):
 
     def check_fullfilled(self):
         try:
-            result = self.request_check()
+            # Returns as soon as the pool is fulfilled, or after 20 seconds
+            result = self.client.wait_for_pool(self.pool, timeout=20)
         except SproutException as e:
             # TODO: ensure we only exit this way on sprout usage
             self.destroy_pool()
@@ -38,6 +38,7 @@ pytest_plugins = (
     'markers.polarion',  # before artifactor
     'fixtures.artifactor_plugin',
     'fixtures.parallelizer',
+    'fixtures.collection_cache',
 
     'fixtures.prov_filter',
 
@@ -54,6 +55,7 @@ pytest_plugins = (
     'fixtures.log',
     'fixtures.maximized',
     'fixtures.merkyl',
+    'fixtures.metrics',
     'fixtures.nelson',
     'fixtures.node_annotate',
     'fixtures.page_screenshots',
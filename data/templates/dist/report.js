@@ -0,0 +1,183 @@
+/* Lazily loaded tree and pages of the test reports, made by artifactor/plugins/reporter.py */
+
+// Tree of the tests. The children of a module are in its "kids" and are only given to jstree
+// when the module is opened. Tests know the "page" they are on.
+function report_tree(container, roots, search_input) {
+  var parents = {}, tests = [], counter = 0;
+
+  function index(nodes, parent) {
+    $.each(nodes, function (i, node) {
+      node.id = 'report-node-' + (counter++);
+      parents[node.id] = parent;
+      if (node.kids) {
+        node.children = true;
+        index(node.kids, node.id);
+      } else {
+        tests.push(node);
+      }
+    });
+  }
+  index(roots, '#');
+
+  report_pages.tests = {};
+  $.each(tests, function (i, test) {
+    report_pages.tests[test.name] = test.page;
+  });
+
+  container.jstree({
+    "core": {
+      "data": function (node, callback) {
+        callback.call(this, node.id === '#' ? roots : node.original.kids);
+      }
+    },
+    "plugins" : [ "search" , "sort"],
+    "search" : {
+        "show_only_matches": true,
+        "search_leaves_only": true,
+    }
+  })
+  .bind("ready.jstree", function (event, data) {
+    $.each(roots, function (i, node) {
+      container.jstree("open_node", node.id, false);
+    });
+  }).bind('select_node.jstree', function(e,data) {
+    show_test(data.node.original.name || '', data.node.a_attr.href);
+  });
+
+  // jstree only searches the nodes it has, so the modules of the matching tests get loaded first,
+  // from the top of the tree down
+  function search(text) {
+    var tree = container.jstree(true), levels = [], seen = {};
+    if (text) {
+      $.each(tests, function (i, test) {
+        if (test.name.toLowerCase().indexOf(text.toLowerCase()) === -1) {
+          return;
+        }
+        var path = [], id = parents[test.id];
+        while (id !== '#') {
+          path.unshift(id);
+          id = parents[id];
+        }
+        $.each(path, function (depth, id) {
+          if (!seen[id]) {
+            seen[id] = true;
+            (levels[depth] = levels[depth] || []).push(id);
+          }
+        });
+      });
+    }
+    (function load_level() {
+      if (!levels.length) {
+        tree.search(text);
+        return;
+      }
+      var ids = $.grep(levels.shift(), function (id) { return !tree.is_loaded(id); });
+      var pending = ids.length;
+      if (!pending) {
+        load_level();
+        return;
+      }
+      $.each(ids, function (i, id) {
+        tree.load_node(id, function () {
+          if (--pending === 0) {
+            load_level();
+          }
+        });
+      });
+    })();
+  }
+
+  var to = false;
+  search_input.keyup(function () {
+    if(to) { clearTimeout(to); }
+    to = setTimeout(function () {
+      var v = search_input.val();
+      search(v);
+      if (v == ""){
+        $.each(document.getElementsByName('blab'), function(k,v){v.style.display='InlineBlock'})
+      }
+      else {
+        $.each(document.getElementsByName('blab'), function(k,v){v.style.display='None'})
+      }
+    }, 250);
+  });
+}
+
+// Pages of the tests, each a script calling report_page_loaded(). The pages are loaded as they get
+// close to the visible part of the window, or when a test on them is shown.
+var report_pages = {versions: [], tests: {}, loaded: {}, loading: {}, callbacks: {}};
+
+function load_report_page(page, callback) {
+  if (report_pages.loaded[page]) {
+    if (callback) {
+      callback();
+    }
+    return;
+  }
+  if (callback) {
+    (report_pages.callbacks[page] = report_pages.callbacks[page] || []).push(callback);
+  }
+  if (report_pages.loading[page]) {
+    return;
+  }
+  report_pages.loading[page] = true;
+  var script = document.createElement('script');
+  script.src = 'report_pages/page-' + page + '.js?' + report_pages.versions[page - 1];
+  document.body.appendChild(script);
+}
+
+function report_page_loaded(page, html) {
+  $('#report-page-' + page).html(html).removeClass('report-page-pending');
+  report_pages.loaded[page] = true;
+  $.each(report_pages.callbacks[page] || [], function (i, callback) {
+    callback();
+  });
+  delete report_pages.callbacks[page];
+  $(document).trigger('report-page-loaded', [page]);
+}
+
+function load_visible_pages() {
+  var top = $(window).scrollTop() - $(window).height();
+  var bottom = $(window).scrollTop() + 2 * $(window).height();
+  $('.report-page-pending').each(function () {
+    var offset = $(this).offset().top;
+    if (offset < bottom && offset + $(this).outerHeight() > top) {
+      // One at a time, the loaded page moves the ones after it
+      load_report_page($(this).data('report-page'));
+      return false;
+    }
+  });
+}
+
+function show_test(name, href) {
+  var page = report_pages.tests[name];
+  if (!page) {
+    window.location.href = href;
+    return;
+  }
+  load_report_page(page, function () {
+    var element = document.getElementById(name);
+    if (element) {
+      element.scrollIntoView();
+    }
+  });
+}
+
+function report_pages_init(versions) {
+  report_pages.versions = versions;
+  $(document).on('report-page-loaded', load_visible_pages);
+  var to = false;
+  $(window).scroll(function () {
+    if(to) { clearTimeout(to); }
+    to = setTimeout(load_visible_pages, 100);
+  });
+  // Links to the tests in the tables of the report
+  $(document).on('click', 'a[href^="#"]', function (event) {
+    var name = $(this).attr('href').substring(1);
+    if (report_pages.tests[name]) {
+      event.preventDefault();
+      show_test(name, this.href);
+    }
+  });
+  load_visible_pages();
+}
@@ -9,6 +9,10 @@
         server_address: 127.0.0.1
         server_port: 21212
         server_enabled: True
+        async_client: False
+        async_queue_size: 10000
+        async_queue_full: block
+        async_flush_timeout: 60
         plugins:
 
 ``log_dir`` is the destination for all artifacts
@@ -18,6 +22,16 @@
 ``reuse_dir`` if this is False and Artifactor comes across a dir that has
 already been used, it will die
 
+``async_client`` if this is True, the hooks are sent to the server from a background thread
+and the tests do not wait for them, see :py:class:`artifactor.AsyncArtifactorClient`. The hooks
+still queued are sent at the end of the session.
+
+``async_queue_size`` hooks waiting to be sent at most, when it is reached ``async_queue_full``
+decides whether the tests wait for room (``block``) or the hooks are dropped (``drop``)
+
+``async_flush_timeout`` seconds to wait at most for the hooks still queued at the end of the
+session, those not sent by then are reported
+
 
 """
 import atexit
@@ -27,7 +41,7 @@ from urlparse import urlparse
 import diaper
 import pytest
 
-from artifactor import ArtifactorClient
+from artifactor import ArtifactorClient, AsyncArtifactorClient
 from fixtures.pytest_store import write_line, store
 from markers.polarion import extract_polarion_ids
 from threading import RLock
@@ -73,6 +87,9 @@ class DummyClient(object):
     def task_status(self):
         return
 
+    def flush(self, timeout=None):
+        return True
+
     def __nonzero__(self):
         # DummyClient is always False,
         # so it's easy to see if we have an artiactor client
@@ -85,6 +102,12 @@ def get_client(art_config, pytest_config):
             art_config.get('server_port') or random_port()
         pytest_config.option.artifactor_port = port
         art_config['server_port'] = port
+        if art_config.get('async_client', False):
+            return AsyncArtifactorClient(
+                art_config['server_address'], art_config['server_port'],
+                queue_size=art_config.get('async_queue_size', 10000),
+                full_policy=art_config.get('async_queue_full', 'block'),
+                flush_timeout=art_config.get('async_flush_timeout', 60))
         return ArtifactorClient(
             art_config['server_address'], art_config['server_port'])
     else:
@@ -216,7 +239,7 @@ def pytest_runtest_teardown(item, nextitem):
     ip = urlparse(env['base_url']).netloc
     fire_art_test_hook(
         item, 'finish_test',
-        slaveid=store.slaveid, ip=ip, grab_result=True)
+        slaveid=store.slaveid, ip=ip, wait_for_task=True)
     fire_art_test_hook(item, 'sanitize', words=words)
     jenkins_data = {
         'build_url': os.environ.get('BUILD_URL', None),
@@ -278,3 +301,14 @@ def shutdown(config):
                 proc = config._art_proc
                 if proc:
                     proc.wait()
+        else:
+            # No server of our own, but the hooks still queued have to reach the one there is
+            config._art_client.flush(timeout=env.get('artifactor', {}).get(
+                'async_flush_timeout', 60))
+        dropped = getattr(config._art_client, 'dropped', 0)
+        if dropped:
+            write_line('artifactor queue was full, {} hooks were dropped'.format(dropped))
+        unsent = getattr(config._art_client, 'unsent', 0)
+        if unsent:
+            write_line('artifactor server is gone or too slow, {} hooks were not sent'.format(
+                unsent))
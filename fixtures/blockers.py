@@ -9,11 +9,19 @@ it accepts number argument and spits out the BUGZILLA BUG!
 The :py:func:`blockers` retrieves list of all blockers
 as specified in the meta marker.
 All of them are converted to the :py:class:`utils.blockers.Blocker` instances
+
+When the tests are collected, the Bugzilla bugs of all their blockers (with their copies and
+duplicates) are fetched in a few batched calls and stored in the Bugzilla cache shared by all the
+processes of the run, see :py:class:`utils.bz.BugCache`.
 """
+from time import time
+
 import pytest
 
 from fixtures.pytest_store import store
 from utils.blockers import Blocker, BZ, GH
+from utils.conf import cfme_data
+from utils.log import logger
 
 
 @pytest.fixture(scope="function")
@@ -61,11 +69,47 @@ def pytest_addoption(parser):
                     default=False,
                     dest='list_blockers',
                     help='Specify to list the blockers (takes some time though).')
+    group.addoption('--no-blockers-prefetch',
+                    action='store_false',
+                    default=True,
+                    dest='blockers_prefetch',
+                    help='Do not fetch the bugs of the blockers when the tests are collected.')
+
+
+def prefetch_bugs(items):
+    """Fetches the bugs of the Bugzilla blockers of the items at once."""
+    bug_ids = set([])
+    for item in items:
+        for blocker in getattr(item, "_metadata", {}).get("blockers", []):
+            if isinstance(blocker, int):
+                bug_ids.add(blocker)
+                continue
+            try:
+                blocker = Blocker.parse(blocker)
+            except ValueError:
+                continue
+            if isinstance(blocker, BZ):
+                bug_ids.add(blocker.bug_id)
+    if not bug_ids:
+        return
+    start = time()
+    try:
+        calls = BZ.bugzilla.prefetch(bug_ids)
+    except Exception as e:
+        logger.warning("Could not prefetch the blockers from Bugzilla: %s: %s",
+                       type(e).__name__, str(e))
+        return
+    logger.info("Prefetched the bugs of %d blockers from Bugzilla in %d calls, %.1f s",
+                len(bug_ids), calls, time() - start)
 
 
 @pytest.mark.trylast
 def pytest_collection_modifyitems(session, config, items):
-    if not config.getvalue("list_blockers"):
+    list_blockers = config.getvalue("list_blockers")
+    if (config.getvalue("blockers_prefetch") and cfme_data.get("bugzilla", {}).get("url") and
+            (list_blockers or not config.getvalue("collectonly"))):
+        prefetch_bugs(items)
+    if not list_blockers:
         return
     store.terminalreporter.write("Loading blockers ...\n", bold=True)
     blocking = set([])
@@ -0,0 +1,148 @@
+"""Collection cache, shared by all py.test processes of a test run
+
+Collecting the cfme tests is slow mostly because of the decisions made while collecting:
+provider parametrization in :py:mod:`utils.testgen` filters every provider in ``cfme_data`` for
+every test function, and :py:mod:`markers.uncollect` evaluates ``uncollectif`` conditions, many
+of which need the appliance version.
+
+With ``--collection-cache``, the outcome of those decisions is stored in the pytest cache:
+
+- the provider keys :py:func:`utils.testgen.providers` yielded for each test function
+- the node ids left in the session after collection finished
+
+The cache entry is keyed by a fingerprint of the mtimes of the project's python and yaml files,
+the command line args and options that affect collection, and the appliance version. A process
+whose fingerprint matches the stored one (e.g. every parallelizer slave, which starts after the
+master has finished collecting) reuses the stored decisions instead of making them again.
+
+"""
+import hashlib
+import json
+from time import time
+
+import pytest
+
+from fixtures.pytest_store import store
+from utils.log import logger
+from utils.path import conf_path, project_path
+
+#: pytest cache key of the stored collection
+CACHE_KEY = 'miq-collection/cache'
+
+#: options that change what is collected; anything else can differ between cache users
+COLLECTION_OPTIONS = (
+    'keyword', 'markexpr', 'use_provider', 'sauce', 'tier', 'requirement', 'check_stream',
+    'disable_metaplugins', 'long_running', 'perf', 'manual', 'rbac', 'collectonly',
+)
+
+#: project directories whose files are part of the fingerprint
+FINGERPRINT_DIRS = ('cfme', 'fixtures', 'markers', 'utils')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--collection-cache', dest='collection_cache', action='store_true',
+        default=False,
+        help='Reuse provider parametrization and uncollection results from a previous '
+             'collection with the same code, config and appliance version')
+
+
+@pytest.mark.trylast
+def pytest_configure(config):
+    if config.getoption('collection_cache'):
+        config.pluginmanager.register(CollectionCache(config), 'collection_cache')
+
+
+def fingerprint(config, appliance_version):
+    """Fingerprint of everything that affects the collection"""
+    fp = hashlib.sha1()
+    paths = [project_path.join('conftest.py')]
+    for dirname in FINGERPRINT_DIRS:
+        paths.extend(project_path.join(dirname).visit('*.py'))
+    paths.extend(conf_path.visit('*.*aml'))
+    for path in sorted(paths):
+        if path.check(file=1):
+            fp.update('{}:{}\n'.format(path.relto(project_path), path.mtime()))
+    options = {name: getattr(config.option, name, None) for name in COLLECTION_OPTIONS}
+    fp.update(json.dumps([config.args, options, str(appliance_version)], sort_keys=True))
+    return fp.hexdigest()
+
+
+class CollectionCache(object):
+    """Stored collection decisions, registered as the ``collection_cache`` plugin
+
+    Attributes:
+        hit: Whether the stored decisions were made for this collection
+        providers: Mapping of test function key to the provider keys it was parametrized with
+        node_ids: Node ids left after collection, if loaded from the cache
+        collection_time: Seconds spent collecting, once collection finished
+
+    """
+    def __init__(self, config):
+        self.config = config
+        self.fingerprint = None
+        self.hit = False
+        self.providers = {}
+        self.node_ids = None
+        self.collection_time = None
+        self._started = None
+        self._function_calls = {}
+
+    @pytest.mark.tryfirst
+    def pytest_collection(self, session):
+        self._started = time()
+        from utils.version import current_version
+        self.fingerprint = fingerprint(self.config, current_version())
+        stored = self.config.cache.get(CACHE_KEY, {})
+        if stored.get('fingerprint') == self.fingerprint:
+            self.hit = True
+            self.providers = stored['providers']
+            self.node_ids = set(stored['node_ids'])
+        logger.info('collection cache %s (%s)', 'hit' if self.hit else 'miss', self.fingerprint)
+
+    def function_key(self, metafunc):
+        """Key of a test function's provider parametrization
+
+        The same function can be parametrized by more than one generator, so the key counts the
+        calls made for the function during this collection.
+
+        """
+        key = '::'.join(filter(None, (
+            getattr(metafunc.module, '__name__', None),
+            getattr(metafunc.cls, '__name__', None),
+            metafunc.function.__name__)))
+        call = self._function_calls[key] = self._function_calls.get(key, -1) + 1
+        return '{}#{}'.format(key, call)
+
+    def invalidate(self, reason):
+        """Stops using the stored decisions for the rest of this collection
+
+        The decisions made from now on are stored again when the collection finishes, and nothing
+        is uncollected just for not being collected last time.
+
+        """
+        if self.hit:
+            logger.info('collection cache invalidated: %s', reason)
+        self.hit = False
+        self.node_ids = None
+
+    @pytest.mark.tryfirst
+    def pytest_collection_modifyitems(self, session, config, items):
+        if not self.hit:
+            return
+        # everything uncollected last time is uncollected again, without asking the markers
+        len_collected = len(items)
+        items[:] = [item for item in items if item.nodeid in self.node_ids]
+        store.uncollection_stats['collection cache'] = len_collected - len(items)
+
+    def pytest_collection_finish(self, session):
+        self.collection_time = time() - self._started
+        logger.info('collection took %.1f seconds (collection cache %s)',
+            self.collection_time, 'hit' if self.hit else 'miss')
+        if self.hit:
+            return
+        self.config.cache.set(CACHE_KEY, {
+            'fingerprint': self.fingerprint,
+            'providers': self.providers,
+            'node_ids': [item.nodeid for item in session.items],
+        })
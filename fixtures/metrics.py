@@ -0,0 +1,49 @@
+"""Exports the framework's own metrics (see :py:mod:`utils.metrics`) during the test run
+
+``--metrics-file`` appends the series to a file in the influx line format every
+``--metrics-interval`` seconds, ``--metrics-port`` serves them to Prometheus on
+``http://<host>:<port>/metrics``. On the parallelizer, every slave exports its own: the slaves
+write to the file with their slave id in its name, and serve on the ports after the master's.
+"""
+import pytest
+
+from utils import conf
+from utils.log import logger
+from utils.metrics import LineFileExporter, PrometheusExporter, metrics
+from utils.path import log_path
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--metrics-file', dest='metrics_file', default=None,
+        help='Append the framework metrics to this file (relative to the log directory)')
+    group.addoption('--metrics-interval', dest='metrics_interval', type=float, default=10,
+        help='Seconds between the writes of --metrics-file, default 10')
+    group.addoption('--metrics-port', dest='metrics_port', type=int, default=None,
+        help='Serve the framework metrics to Prometheus on this port')
+
+
+@pytest.mark.trylast
+def pytest_configure(config):
+    filename = config.getoption('metrics_file')
+    port = config.getoption('metrics_port')
+    slaveid = conf.runtime['env'].get('slaveid')
+    exporters = []
+    if filename:
+        if slaveid:
+            filename = '{}-{}'.format(filename, slaveid)
+        exporters.append(LineFileExporter(
+            metrics, log_path.join(filename), config.getoption('metrics_interval')))
+    if port is not None:
+        if slaveid:
+            port += int(slaveid[len('slave'):]) + 1
+        exporters.append(PrometheusExporter(metrics, port))
+        logger.info('Serving the metrics on port %d', exporters[-1].port)
+    for exporter in exporters:
+        exporter.start()
+    config._metrics_exporters = exporters
+
+
+def pytest_unconfigure(config):
+    for exporter in getattr(config, '_metrics_exporters', []):
+        exporter.stop()
@@ -21,10 +21,15 @@ The Workflow
 - For each phase of each test, the slave serializes test reports, which are then unserialized on
   the master and handed to the normal pytest reporting hooks, which is able to deal with test
   reports arriving out of order
-- Before running the last test in a group, the slave will request more tests from the master
+- When it starts running a group, the slave requests more tests from the master without waiting
+  for the answer, so it holds up to ``--parallel-prefetch`` groups ahead of the one it is running
 
   - If more tests are received, they are run
   - If no tests are received, the slave will shut down after running its final test
+  - If a slave dies or shuts down early, the tests it was sent but did not run are
+    redistributed to the other slaves
+  - If a group moves the slave to another provider, the slave asks the master to remove the
+    providers from its appliance when it starts the group, not when it fetches it
 
 - After all slaves are shut down, the master will do its end-of-session reporting as usual, and
   shut down
@@ -54,6 +59,7 @@ from _pytest import runner
 
 from fixtures import terminalreporter
 from fixtures.parallelizer import remote
+from fixtures.parallelizer.scheduler import DurationScheduler, DurationStore
 from fixtures.pytest_store import store
 from utils import at_exit, conf
 from utils.appliance import IPAppliance
@@ -74,6 +80,21 @@ def pytest_addhooks(pluginmanager):
     pluginmanager.add_hookspecs(hooks)
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup('cfme')
+    group.addoption('--parallel-scheduler', dest='parallel_scheduler', default='modscope',
+        choices=['modscope', 'duration'],
+        help='How tests are distributed to slaves: "modscope" sends test groups in collection '
+             'order, "duration" balances them by the durations recorded in previous runs')
+    group.addoption('--parallel-provider-cost', dest='parallel_provider_cost', type=float,
+        default=300.0, metavar='SECONDS',
+        help='Estimated cost of moving a slave to another provider, used by the duration '
+             'scheduler')
+    group.addoption('--parallel-prefetch', dest='parallel_prefetch', type=int, default=1,
+        metavar='GROUPS',
+        help='Number of test groups each slave fetches ahead of the group it is running')
+
+
 @pytest.mark.trylast
 def pytest_configure(config):
     # configures the parallel session, then fires pytest_parallel_configured
@@ -105,13 +126,19 @@ class SlaveDetail(object):
         lambda: next(SlaveDetail.slaveid_generator)))
     forbid_restart = attr.ib(default=False, init=False)
     tests = attr.ib(default=attr.Factory(set), repr=False)
+    sent_groups = attr.ib(default=attr.Factory(list), repr=False)
     process = attr.ib(default=None, repr=False)
 
     provider_allocation = attr.ib(default=attr.Factory(list), repr=False)
+    # the appliance has to be cleansed before the next group sent to the slave starts
+    cleanse_pending = attr.ib(default=False, init=False, repr=False)
+    batches_received = attr.ib(default=0, init=False, repr=False)
 
     def start(self):
         if self.forbid_restart:
             return
+        # a new slave process numbers its report batches from the start
+        self.batches_received = 0
         devnull = open(os.devnull, 'w')
         # worker output redirected to null; useful info comes via messages and logs
         self.process = subprocess.Popen(
@@ -132,6 +159,8 @@ class ParallelSession(object):
         self.session_finished = False
         self.countfailures = 0
         self.collection = []
+        self.collection_hash = None
+        self.collection_started = None
         self.sent_tests = 0
         self.log = create_sublogger('master')
         self.maxfail = config.getvalue("maxfail")
@@ -142,6 +171,8 @@ class ParallelSession(object):
         self.test_groups = self._test_item_generator()
 
         self._pool = []
+        self.scheduler = None
+        self.durations = DurationStore(config.cache)
         from utils.conf import cfme_data
         self.provs = sorted(set(cfme_data['management_systems'].keys()),
                             key=len, reverse=True)
@@ -159,6 +190,15 @@ class ParallelSession(object):
         self.sock = ctx.socket(zmq.ROUTER)
         self.sock.bind(zmq_endpoint)
 
+        # slaves push batches of reports and messages here without waiting for an ack
+        zmq_report_endpoint = '{}-reports'.format(zmq_endpoint)
+        self.report_sock = ctx.socket(zmq.PULL)
+        self.report_sock.bind(zmq_report_endpoint)
+
+        self.poller = zmq.Poller()
+        self.poller.register(self.sock, zmq.POLLIN)
+        self.poller.register(self.report_sock, zmq.POLLIN)
+
         # clean out old slave config if it exists
         slave_config = conf_path.join('slave_config.yaml')
         slave_config.check() and slave_config.remove()
@@ -168,6 +208,7 @@ class ParallelSession(object):
             'args': self.config.args,
             'options': self.config.option.__dict__,
             'zmq_endpoint': zmq_endpoint,
+            'zmq_report_endpoint': zmq_report_endpoint,
         }
         if hasattr(self, "slave_appliances_data"):
             conf.runtime['slave_config']["appliance_data"] = self.slave_appliances_data
@@ -197,12 +238,9 @@ class ParallelSession(object):
                 else:
                     msg = '{} terminated unexpectedly with status {}, respawning'.format(
                         slave.id, returncode)
-                if slave.tests:
-                    failed_tests, slave.tests = slave.tests, set()
-                    num_failed_tests = len(failed_tests)
-                    self.sent_tests -= num_failed_tests
+                num_failed_tests = self.return_tests(slave)
+                if num_failed_tests:
                     msg += ' and redistributing {} tests'.format(num_failed_tests)
-                    self.failed_slave_test_groups.append(failed_tests)
                 self.print_message(msg, purple=True)
 
         # If a slave was terminated for any reason, kill that slave
@@ -233,19 +271,76 @@ class ParallelSession(object):
         self.sock.send_multipart([slave.id, '', event_json])
 
     def recv(self):
-        # poll the zmq socket, populate the recv queue deque with responses
+        # poll the zmq sockets, report batches are handled right away and
+        # control events are returned to the runtest loop
 
-        events = zmq.zmq_poll([(self.sock, zmq.POLLIN)], 50)
-        if not events:
+        events = dict(self.poller.poll(50))
+        if self.report_sock in events:
+            self.recv_reports()
+        if self.sock not in events:
             return None, None, None
         slaveid, _, event_json = self.sock.recv_multipart(flags=zmq.NOBLOCK)
         event_data = json.loads(event_json)
         event_name = event_data.pop('_event_name')
+        batches_sent = event_data.pop('_batches_sent', 0)
         if slaveid not in self.slaves:
             self.log.error("message from terminated worker %s %s %s",
                            slaveid, event_name, event_data)
             return None, None, None
-        return self.slaves[slaveid], event_data, event_name
+        slave = self.slaves[slaveid]
+        # the slave's reports sent before this event have to be handled before it
+        self.recv_reports(slave, batches_sent)
+        return slave, event_data, event_name
+
+    def recv_reports(self, slave=None, batches_sent=0, timeout=10):
+        """Handle the report batches waiting on the report socket
+
+        If ``slave`` is given, keep waiting for its batches (for at most ``timeout`` seconds)
+        until ``batches_sent`` of them have been handled.
+
+        """
+        give_up = time() + timeout
+        while True:
+            try:
+                slaveid, encoding, payload = self.report_sock.recv_multipart(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                if slave is None or slave.batches_received >= batches_sent:
+                    return
+                if time() > give_up:
+                    self.log.error('%s: only %d of %d report batches received',
+                                   slave.id, slave.batches_received, batches_sent)
+                    return
+                self.report_sock.poll(50)
+                continue
+            events = remote.unpack_batch(encoding, payload)
+            if slaveid not in self.slaves:
+                self.log.error("%d reports from terminated worker %s", len(events), slaveid)
+                continue
+            reporting_slave = self.slaves[slaveid]
+            reporting_slave.batches_received += 1
+            for event_data in events:
+                event_name = event_data.pop('_event_name')
+                self.handle_report(reporting_slave, event_name, event_data)
+
+    def handle_report(self, slave, event_name, event_data):
+        """Handle an event from a slave's report batch"""
+        if event_name == 'message':
+            message = event_data.pop('message')
+            markup = event_data.pop('markup')
+            self.print_message(message, slave, **markup)
+        elif event_name == 'runtest_logstart':
+            self.trdist.runtest_logstart(
+                slave.id,
+                event_data['nodeid'],
+                event_data['location'])
+        elif event_name == 'runtest_logreport':
+            report = unserialize_report(event_data['report'])
+            self.durations.record(report)
+            if report.when in ('call', 'teardown'):
+                slave.tests.discard(report.nodeid)
+            self.trdist.runtest_logreport(slave.id, report)
+        else:
+            self.log.error('unexpected report event %s from %s', event_name, slave.id)
 
     def print_message(self, message, prefix='master', **markup):
         """Print a message from a node to the py.test console
@@ -340,8 +435,19 @@ class ParallelSession(object):
             tests = list(self.failed_slave_test_groups.popleft())
         except IndexError:
             tests = self.get(slave)
-        self.send(slave, tests)
+        if tests and slave.cleanse_pending:
+            # the slave may still be running the tests it was sent before, so it asks for the
+            # cleanse itself once it starts this group
+            self.send(slave, {'tests': tests, 'cleanse': True})
+            slave.cleanse_pending = False
+        else:
+            self.send(slave, tests)
         slave.tests.update(tests)
+        # forget the groups the slave has finished, keep the ones it has (pre)fetched
+        slave.sent_groups = [
+            group for group in slave.sent_groups if not slave.tests.isdisjoint(group)]
+        if tests:
+            slave.sent_groups.append(tests)
         collect_len = len(self.collection)
         tests_len = len(tests)
         self.sent_tests += tests_len
@@ -352,6 +458,25 @@ class ParallelSession(object):
             ))
         return tests
 
+    def return_tests(self, slave):
+        """Put the tests a slave was sent but did not run back in line for the other slaves
+
+        Unfinished tests are returned group by group, in the order they were sent, so tests
+        prefetched by the slave are redistributed with the groups they were planned in.
+
+        Returns the number of returned tests.
+
+        """
+        returned = 0
+        for group in slave.sent_groups:
+            unfinished = [nodeid for nodeid in group if nodeid in slave.tests]
+            if unfinished:
+                self.failed_slave_test_groups.append(unfinished)
+                returned += len(unfinished)
+        slave.sent_groups, slave.tests = [], set()
+        self.sent_tests -= returned
+        return returned
+
     def pytest_sessionstart(self, session):
         """pytest sessionstart hook
 
@@ -369,6 +494,9 @@ class ParallelSession(object):
         self.config.pluginmanager.register(self.trdist, "terminaldistreporter")
         self.session = session
 
+    def pytest_collection(self):
+        self.collection_started = time()
+
     def pytest_runtestloop(self):
         """pytest runtest loop
 
@@ -382,6 +510,11 @@ class ParallelSession(object):
         """
         # Build master collection for slave diffing and distribution
         self.collection = [item.nodeid for item in self.session.items]
+        self.collection_hash = remote.collection_hash(self.collection)
+        self.print_message('collected {} tests in {:.1f} seconds'.format(
+            len(self.collection), time() - self.collection_started))
+        # Plan the distribution now, not when the first slave asks for tests
+        self._build_pool()
 
         # Fire up the workers after master collection is complete
         # master and the first slave share an appliance, this is a workaround to prevent a slave
@@ -409,15 +542,19 @@ class ParallelSession(object):
                     break
 
                 slave, event_data, event_name = self.recv()
-                if event_name == 'message':
-                    message = event_data.pop('message')
-                    markup = event_data.pop('markup')
-                    # messages are special, handle them immediately
-                    self.print_message(message, slave, **markup)
-                    self.ack(slave, event_name)
+                if event_name == 'collectionfinish' and 'node_ids_hash' in event_data:
+                    self.print_message('collected in {:.1f} seconds{}'.format(
+                        event_data['collection_time'],
+                        ' (collection cache)' if event_data['collection_cache_hit'] else ''),
+                        slave)
+                    # compare slave collection to the master, all test ids must be the same
+                    if event_data['node_ids_hash'] == self.collection_hash:
+                        self.ack(slave, event_name)
+                    else:
+                        # ask for the full collection to find the differences
+                        self.send(slave, 'node_ids')
                 elif event_name == 'collectionfinish':
                     slave_collection = event_data['node_ids']
-                    # compare slave collection to the master, all test ids must be the same
                     self.log.debug('diffing {} collection'.format(slave.id))
                     diff_err = report_collection_diff(
                         slave.id, self.collection, slave_collection)
@@ -434,23 +571,19 @@ class ParallelSession(object):
                 elif event_name == 'need_tests':
                     self.send_tests(slave)
                     self.log.info('starting master test distribution')
-                elif event_name == 'runtest_logstart':
-                    self.ack(slave, event_name)
-                    self.trdist.runtest_logstart(
-                        slave.id,
-                        event_data['nodeid'],
-                        event_data['location'])
-                elif event_name == 'runtest_logreport':
+                elif event_name == 'cleanse':
+                    self._cleanse_slave_appliance(slave)
                     self.ack(slave, event_name)
-                    report = unserialize_report(event_data['report'])
-                    if report.when in ('call', 'teardown'):
-                        slave.tests.discard(report.nodeid)
-                    self.trdist.runtest_logreport(slave.id, report)
                 elif event_name == 'internalerror':
                     self.ack(slave, event_name)
                     self.print_message(event_data['message'], slave, purple=True)
                     self.kill(slave)
                 elif event_name == 'shutdown':
+                    num_returned = self.return_tests(slave)
+                    if num_returned:
+                        self.print_message(
+                            'returned {} unstarted tests'.format(num_returned), slave,
+                            purple=True)
                     self.config.hook.pytest_miq_node_shutdown(
                         config=self.config, nodeinfo=slave.url)
                     self.ack(slave, event_name)
@@ -475,6 +608,10 @@ class ParallelSession(object):
         # Suppress other runtestloop calls
         return True
 
+    def pytest_sessionfinish(self):
+        # keep the durations of this run for the duration scheduler
+        self.durations.save()
+
     def _test_item_generator(self):
         for tests in self._modscope_item_generator():
             yield tests
@@ -513,28 +650,61 @@ class ParallelSession(object):
                 self.log.info('sent tests with param {} {!r}'.format(id, tests))
                 yield tests
 
-    def get(self, slave):
+    def _provs_of_tests(self, test_group):
+        found = set()
+        for test in test_group:
+            found.update(pv for pv in self.provs
+                         if '[' in test and pv in test)
+        return sorted(found)
+
+    def _provider_of_group(self, test_group):
+        provs = self._provs_of_tests(test_group)
+        return provs[0] if provs else None
+
+    def _cleanse_slave_appliance(self, slave):
+        # remove the providers set up by previous test groups from the slave's appliance,
+        # called when the slave starts a group sent with cleanse_pending set
+        app_ip = urlparse(slave.url).netloc
+        app = IPAppliance(app_ip)
+        self.print_message(
+            'cleansing appliance', slave, purple=True)
+        try:
+            app.delete_all_providers()
+        except Exception as e:
+            self.print_message(
+                'cloud not cleanse', slave, red=True)
+            self.print_message('error:', e, red=True)
+
+    def _build_pool(self):
+        # group the collected tests for distribution
+        if self.config.option.parallel_scheduler == 'duration':
+            self.scheduler = DurationScheduler(
+                self.test_groups, sorted(self.slaves), self.durations.durations,
+                provider_of=self._provider_of_group,
+                default_duration=self.durations.default_duration(),
+                provider_cost=self.config.option.parallel_provider_cost)
+            for slave_id in sorted(self.slaves):
+                self.log.info('{} planned for {:.0f} seconds'.format(
+                    slave_id, self.scheduler.remaining(slave_id)))
+            return
 
-        def provs_of_tests(test_group):
-            found = set()
-            for test in test_group:
-                found.update(pv for pv in self.provs
-                             if '[' in test and pv in test)
-            return sorted(found)
+        for test_group in self.test_groups:
+            self._pool.append(test_group)
+            self.used_prov.update(self._provs_of_tests(test_group))
+        if self.used_prov:
+            self.ratio = float(len(self.slaves)) / len(self.used_prov)
+        else:
+            self.ratio = 0.0
+
+    def get(self, slave):
+        if self.scheduler is not None:
+            return self._get_scheduled(slave)
 
-        if not self._pool:
-            for test_group in self.test_groups:
-                self._pool.append(test_group)
-                self.used_prov.update(provs_of_tests(test_group))
-            if self.used_prov:
-                self.ratio = float(len(self.slaves)) / len(self.used_prov)
-            else:
-                self.ratio = 0.0
         if not self._pool:
             return []
         appliance_num_limit = 1
         for idx, test_group in enumerate(self._pool):
-            provs = provs_of_tests(test_group)
+            provs = self._provs_of_tests(test_group)
             if provs:
                 prov = provs[0]
                 if prov in slave.provider_allocation:
@@ -558,27 +728,26 @@ class ParallelSession(object):
         # Here means no tests were able to be sent
         for test_group in self._pool:
 
-            provs = provs_of_tests(test_group)
+            provs = self._provs_of_tests(test_group)
             if provs:
                 prov = provs[0]
                 # Already too many slaves with provider
-                app_url = slave.url
-                app_ip = urlparse(app_url).netloc
-                app = IPAppliance(app_ip)
-                self.print_message(
-                    'cleansing appliance', slave, purple=True)
-                try:
-                    app.delete_all_providers()
-                except Exception as e:
-                    self.print_message(
-                        'cloud not cleanse', slave, red=True)
-                    self.print_message('error:', e, red=True)
+                slave.cleanse_pending = True
             slave.provider_allocation = [prov]
             self._pool.remove(test_group)
             return test_group
         assert not self._pool, self._pool
         return []
 
+    def _get_scheduled(self, slave):
+        test_group = self.scheduler.get(slave.id, slave.provider_allocation)
+        prov = self._provider_of_group(test_group)
+        if prov is not None and prov not in slave.provider_allocation:
+            if slave.provider_allocation:
+                slave.cleanse_pending = True
+            slave.provider_allocation = [prov]
+        return test_group
+
 
 def report_collection_diff(slaveid, from_collection, to_collection):
     """Report differences, if any exist, between master and a slave collection
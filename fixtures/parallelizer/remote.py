@@ -1,4 +1,9 @@
+import hashlib
+import json
 import signal
+import zlib
+from collections import deque
+from time import time
 from urlparse import urlparse
 
 import zmq
@@ -6,10 +11,17 @@ from py.path import local
 
 SLAVEID = None
 
+#: maximum number of events sent to the master in one report batch
+REPORT_BATCH_SIZE = 50
+#: maximum time, in seconds, an event waits in the report buffer before the batch is sent
+REPORT_BATCH_INTERVAL = 1.0
+#: serialized batches larger than this many bytes are zlib-compressed before sending
+REPORT_COMPRESS_THRESHOLD = 4096
+
 
 class SlaveManager(object):
     """SlaveManager which coordinates with the master process for parallel testing"""
-    def __init__(self, config, slaveid, base_url, zmq_endpoint):
+    def __init__(self, config, slaveid, base_url, zmq_endpoint, zmq_report_endpoint):
         self.config = config
         self.session = None
         self.collection = None
@@ -25,14 +37,62 @@ class SlaveManager(object):
         self.sock.setsockopt_string(zmq.IDENTITY, u'{}'.format(self.slaveid))
         self.sock.connect(zmq_endpoint)
 
+        # reports and messages don't need an answer from the master, so they are batched up
+        # and pushed without waiting
+        self.report_sock = ctx.socket(zmq.PUSH)
+        self.report_sock.connect(zmq_report_endpoint)
+        self.report_buffer = []
+        self.report_buffer_since = None
+        self.batches_sent = 0
+
+        # test groups received from the master but not started yet
+        self.prefetched = deque()
+        self.pending_request = None
+        # first tests of the groups the master asked to cleanse the appliance for
+        self.cleanse_before = set()
+        self.tests_exhausted = False
+
         self.messages = {}
 
         self.quit_signaled = False
+        self.collection_started = None
+
+    def send_event(self, name, wait=True, **kwargs):
+        """Send a control event to the master and block until it answers
+
+        Pending report batches are sent first; the master handles all of them before the
+        control event itself.
 
-    def send_event(self, name, **kwargs):
+        If ``wait`` is False, the answer is not waited for; it is received by
+        :py:meth:`receive_pending` before the next control event is sent.
+
+        """
+        self.receive_pending()
+        self.flush_reports()
         kwargs['_event_name'] = name
+        kwargs['_batches_sent'] = self.batches_sent
         self.log.trace("sending {} {!r}".format(name, kwargs))
         self.sock.send_json(kwargs)
+        if wait:
+            return self._recv_answer()
+        self.pending_request = name
+
+    def receive_pending(self):
+        """Receive the answer to a control event sent with ``wait=False``, if any"""
+        if self.pending_request is None:
+            return
+        self.pending_request = None
+        node_ids = self._recv_answer()
+        if isinstance(node_ids, dict):
+            # a group for another provider, the tests of the previous group run until it starts
+            node_ids = node_ids['tests']
+            self.cleanse_before.add(node_ids[0])
+        if node_ids:
+            self.prefetched.append(node_ids)
+        else:
+            self.tests_exhausted = True
+
+    def _recv_answer(self):
         recv = self.sock.recv_json()
         if recv == 'die':
             self.log.info('Slave instructed to die by master; shutting down')
@@ -42,37 +102,75 @@ class SlaveManager(object):
             if recv != 'ack':
                 return recv
 
+    def report_event(self, name, flush=False, **kwargs):
+        """Queue an event for the master without waiting for an answer
+
+        Queued events are sent as one batch once the batch is full, the oldest queued event is
+        older than ``REPORT_BATCH_INTERVAL``, ``flush`` is set, or a control event is sent.
+
+        """
+        kwargs['_event_name'] = name
+        self.log.trace("queueing {} {!r}".format(name, kwargs))
+        if not self.report_buffer:
+            self.report_buffer_since = time()
+        self.report_buffer.append(kwargs)
+        batch_full = len(self.report_buffer) >= REPORT_BATCH_SIZE
+        batch_expired = time() - self.report_buffer_since >= REPORT_BATCH_INTERVAL
+        if flush or batch_full or batch_expired:
+            self.flush_reports()
+
+    def flush_reports(self):
+        """Send the queued events to the master as one batch"""
+        if not self.report_buffer:
+            return
+        encoding, payload = pack_batch(self.report_buffer)
+        self.report_sock.send_multipart([self.slaveid, encoding, payload])
+        self.batches_sent += 1
+        self.report_buffer = []
+
     def message(self, message, **kwargs):
         """Send a message to the master, which should get printed to the console"""
-        self.send_event('message', message=message, markup=kwargs)  # message!
+        self.report_event('message', flush=True, message=message, markup=kwargs)  # message!
+
+    def pytest_collection(self):
+        self.collection_started = time()
 
     def pytest_collection_finish(self, session):
         """pytest collection hook
 
-        - Sends collected tests to the master for comparison
+        - Sends a hash of the collected test ids to the master for comparison
+        - Sends all collected test ids if the master's hash is different
 
         """
         self.log.debug('collection finished')
         self.session = session
         self.collection = {item.nodeid: item for item in session.items}
         terminalreporter.disable()
-        self.send_event("collectionfinish", node_ids=self.collection.keys())
+        node_ids = self.collection.keys()
+        collection_cache = store.collection_cache
+        answer = self.send_event("collectionfinish",
+            node_ids_hash=collection_hash(node_ids),
+            collection_time=time() - self.collection_started,
+            collection_cache_hit=bool(collection_cache and collection_cache.hit))
+        if answer == 'node_ids':
+            # the collections differ, the master needs the ids to show how
+            self.send_event("collectionfinish", node_ids=node_ids)
 
     def pytest_runtest_logstart(self, nodeid, location):
         """pytest runtest logstart hook
 
-        - sends logstart notice to the master
+        - sends logstart notice to the master, along with the reports of the previous test
 
         """
-        self.send_event("runtest_logstart", nodeid=nodeid, location=location)
+        self.report_event("runtest_logstart", flush=True, nodeid=nodeid, location=location)
 
     def pytest_runtest_logreport(self, report):
         """pytest runtest logreport hook
 
-        - sends serialized log reports to the master
+        - queues serialized log reports for the master
 
         """
-        self.send_event("runtest_logreport", report=serialize_report(report))
+        self.report_event("runtest_logreport", report=serialize_report(report))
 
     def pytest_internalerror(self, excrepr):
         """pytest internal error hook
@@ -99,6 +197,10 @@ class SlaveManager(object):
                 self.message('{}'.format(item.nodeid))
                 pass
             else:
+                if item.nodeid in self.cleanse_before:
+                    # the previous group is done, the master can remove its providers now
+                    self.cleanse_before.discard(item.nodeid)
+                    self.send_event('cleanse')
                 self.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
             if self.quit_signaled:
                 break
@@ -125,12 +227,30 @@ class SlaveManager(object):
             run_node = next_node
         yield run_node, None
 
+    def _prefetch(self):
+        """Keep up to ``--parallel-prefetch`` test groups ready without blocking"""
+        depth = self.config.option.parallel_prefetch
+        if self.pending_request is not None:
+            if not self.sock.poll(0):
+                # the master is still answering
+                return
+            self.receive_pending()
+        if not self.tests_exhausted and len(self.prefetched) < depth:
+            self.send_event('need_tests', wait=False)
+
     def _iter_nodes(self):
         while True:
-            node_ids = self.send_event('need_tests')
-            if not node_ids:
-                break
-            for nodeid in node_ids:
+            self._prefetch()
+            if not self.prefetched:
+                if self.tests_exhausted:
+                    break
+                # nothing held locally, wait for the master
+                if self.pending_request is None:
+                    self.send_event('need_tests', wait=False)
+                self.receive_pending()
+                continue
+            for nodeid in self.prefetched.popleft():
+                self._prefetch()
                 # TODO: take non-unique node ids into account
                 yield self.collection[nodeid]
 
@@ -152,6 +272,31 @@ def serialize_report(rep):
     return d
 
 
+def collection_hash(node_ids):
+    """Hash of a collection's node ids, independent of their order"""
+    return hashlib.sha1('\n'.join(sorted(node_ids))).hexdigest()
+
+
+def pack_batch(events):
+    """Serialize a list of events for the report channel
+
+    Returns an ``(encoding, payload)`` tuple, the encoding is ``'z'`` for compressed payloads
+    and ``'j'`` for plain JSON.
+
+    """
+    payload = json.dumps(events)
+    if len(payload) > REPORT_COMPRESS_THRESHOLD:
+        return 'z', zlib.compress(payload, 1)
+    return 'j', payload
+
+
+def unpack_batch(encoding, payload):
+    """Unserialize a list of events packed with :py:func:`pack_batch`"""
+    if encoding == 'z':
+        payload = zlib.decompress(payload)
+    return json.loads(payload)
+
+
 def _init_config(slave_options, slave_args):
     # Create a pytest Config based on options/args parsed in the master
     # This is a slightly modified form of _pytest.config.Config.fromdictargs
@@ -205,7 +350,7 @@ if __name__ == '__main__':
         conf.runtime["cfme_data"]["basic_info"]["appliances_provider"] = provider_name
     config = _init_config(slave_options, slave_args)
     slave_manager = SlaveManager(config, args.slaveid, args.base_url,
-        conf.slave_config['zmq_endpoint'])
+        conf.slave_config['zmq_endpoint'], conf.slave_config['zmq_report_endpoint'])
     config.pluginmanager.register(slave_manager, 'slave_manager')
     config.hook.pytest_cmdline_main(config=config)
     signal.signal(signal.SIGQUIT, slave_manager.handle_quit)
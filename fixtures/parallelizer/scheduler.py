@@ -0,0 +1,162 @@
+"""Duration-aware test scheduling for the parallelizer
+
+The default parallelizer hands out test groups (tests from one module sharing a parametrized id)
+in collection order, which means one slave can be handed a very long group late in the run while
+the others run dry. The :py:class:`DurationScheduler` uses the durations recorded in previous runs
+to plan the whole run up front:
+
+- every group gets an estimated cost, the sum of its tests' historical durations (tests that have
+  never been timed are estimated with the median of the known durations)
+- groups are planned longest-first onto the slave with the lowest estimated load, where switching
+  a slave to a provider it is not already planned to use adds ``provider_cost`` seconds to the
+  load; provider affinity is a cost, not a hard rule
+- each slave's plan is kept in a queue on the master, and groups are only sent when the slave
+  asks for tests, so nothing in a queue has been started yet
+- a slave whose queue is empty steals a group from the queue with the highest remaining load,
+  preferring groups for a provider the thief is already using
+
+Durations are stored in the pytest cache (``parallelize/durations``) by :py:class:`DurationStore`.
+
+"""
+from collections import defaultdict, deque
+
+#: pytest cache key for the recorded durations
+DURATIONS_CACHE_KEY = 'parallelize/durations'
+
+#: estimated duration, in seconds, of a test when no durations at all have been recorded
+DEFAULT_TEST_DURATION = 30.0
+
+
+class DurationStore(object):
+    """Per-test durations recorded across runs
+
+    All phases (setup/call/teardown) of a test are added together. Only tests that ran in this
+    session are overwritten on :py:meth:`save`, durations from earlier runs are kept.
+
+    Args:
+        cache: The pytest ``config.cache`` object
+
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.durations = dict(cache.get(DURATIONS_CACHE_KEY, {}))
+        self._current = defaultdict(float)
+
+    def record(self, report):
+        """Add the duration of a test report phase to the current session's durations"""
+        self._current[report.nodeid] += getattr(report, 'duration', 0) or 0
+
+    def save(self):
+        if not self._current:
+            return
+        self.durations.update(self._current)
+        self.cache.set(DURATIONS_CACHE_KEY, self.durations)
+
+    def default_duration(self):
+        """Median of the known durations, used to estimate tests that were never timed"""
+        if not self.durations:
+            return DEFAULT_TEST_DURATION
+        known = sorted(self.durations.values())
+        return known[len(known) // 2]
+
+
+class DurationScheduler(object):
+    """Plans test groups onto slaves by estimated duration, with work stealing
+
+    Args:
+        groups: Iterable of test groups (lists of node ids), as built by the parallel session
+        slave_ids: The ids of the slaves to plan for
+        durations: Mapping of node id to estimated duration in seconds
+        provider_of: Callable returning the provider key a test group uses, or ``None``
+        default_duration: Estimate used for node ids missing from ``durations``
+        provider_cost: Estimated cost in seconds of switching a slave to another provider
+
+    """
+    def __init__(self, groups, slave_ids, durations, provider_of,
+                 default_duration=DEFAULT_TEST_DURATION, provider_cost=300.0):
+        self.durations = durations
+        self.provider_of = provider_of
+        self.default_duration = default_duration
+        self.provider_cost = provider_cost
+        self.queues = {slave_id: deque() for slave_id in slave_ids}
+        self.loads = {slave_id: 0.0 for slave_id in slave_ids}
+        self._plan([list(group) for group in groups if group])
+
+    def cost(self, group):
+        """Estimated duration of a test group, in seconds"""
+        return sum(self.durations.get(nodeid, self.default_duration) for nodeid in group)
+
+    def _plan(self, groups):
+        planned = defaultdict(list)
+        planned_provs = defaultdict(set)
+        if not self.queues:
+            return
+        # longest processing time first, onto the least loaded slave
+        for group in sorted(groups, key=self.cost, reverse=True):
+            group_cost = self.cost(group)
+            prov = self.provider_of(group)
+
+            def planned_cost(slave_id):
+                cost = self.loads[slave_id] + group_cost
+                if prov is not None and prov not in planned_provs[slave_id]:
+                    cost += self.provider_cost
+                return cost
+
+            slave_id = min(sorted(self.queues), key=planned_cost)
+            self.loads[slave_id] = planned_cost(slave_id)
+            planned[slave_id].append((prov, group_cost, group))
+            if prov is not None:
+                planned_provs[slave_id].add(prov)
+
+        for slave_id, entries in planned.items():
+            self.queues[slave_id].extend(self._order_queue(entries))
+
+    def _order_queue(self, entries):
+        # keep groups of the same provider together so a slave switches providers as little as
+        # possible, running the most expensive provider block (and group within it) first
+        blocks = defaultdict(list)
+        for prov, group_cost, group in entries:
+            blocks[prov].append((group_cost, group))
+        ordered = []
+        for prov, block in sorted(
+                blocks.items(), key=lambda item: sum(c for c, _ in item[1]), reverse=True):
+            for group_cost, group in sorted(block, key=lambda item: item[0], reverse=True):
+                ordered.append(group)
+        return ordered
+
+    def remaining(self, slave_id):
+        """Estimated cost of the groups still queued for a slave"""
+        return sum(self.cost(group) for group in self.queues.get(slave_id, ()))
+
+    def get(self, slave_id, providers=()):
+        """Get the next group of tests for a slave
+
+        Args:
+            slave_id: The id of the slave asking for tests
+            providers: Provider keys currently set up on the slave's appliance, used to pick a
+                group to steal
+
+        Returns an empty list when there is nothing left to run.
+
+        """
+        queue = self.queues.setdefault(slave_id, deque())
+        if queue:
+            return queue.popleft()
+        return self._steal(slave_id, providers)
+
+    def _steal(self, thief_id, providers):
+        victims = [
+            slave_id for slave_id, queue in self.queues.items()
+            if slave_id != thief_id and queue]
+        if not victims:
+            return []
+        victim_queue = self.queues[max(victims, key=self.remaining)]
+        # the tail of the queue would run last on the victim; take a group there, preferring one
+        # the thief can run without switching providers
+        for group in reversed(victim_queue):
+            if self.provider_of(group) in providers:
+                break
+        else:
+            group = victim_queue[-1]
+        victim_queue.remove(group)
+        return group
@@ -31,6 +31,8 @@ There are two ways to request a setup provider depending on what kind of test we
    These functions do exactly what their names suggest - they setup one of the providers fitting
    given parameters or skip the test. All of these fixtures are (and should be) function scoped.
    Please keep that in mind when creating your module-local substitutes.
+   When a test needs several providers at once, ``setup_all_or_skip`` sets all of them up
+   or skips the test.
 
 If setting up a provider fails, the issue is logged and an internal counter is incremented
 as a result. If this counter reaches a predefined number of failures (see ``SETUP_FAIL_LIMIT``),
@@ -48,6 +50,7 @@ from fixtures.pytest_store import store
 from fixtures.templateloader import TEMPLATES
 from utils.providers import ProviderFilter, list_providers
 from utils.log import logger
+from utils.wait import RefreshTimer, wait_for
 from collections import Mapping
 
 # List of problematic providers that will be ignored
@@ -76,48 +79,80 @@ def _artifactor_skip_providers(request, providers, skip_msg):
     pytest.skip(skip_msg)
 
 
+def _remove_extra_providers(request, providers, appliance):
+    """ Removes providers from the appliance so that ``providers`` fit in ``--provider-limit``
+
+    The extra providers are removed all at once and waited for in a single poll loop.
+    """
+    keys = {p.key for p in providers}
+    existing_providers = [
+        p for p in appliance.managed_known_providers if p.key not in keys]
+    random.shuffle(existing_providers)
+    maximum_current_providers = max(request.config.option.provider_limit - len(keys), 0)
+    if len(existing_providers) > maximum_current_providers:
+        providers_to_remove = existing_providers[maximum_current_providers:]
+        store.terminalreporter.write_line(
+            'Removing extra providers: {}'.format(', '.join(
+                [p.key for p in providers_to_remove])))
+        appliance.delete_providers(providers_to_remove)
+
+
+def _delete_failed_providers(providers, appliance):
+    """ Removes the providers which failed to set up, in order to not explode on next calls """
+    existing = appliance.existing_providers(providers)
+    if existing:
+        appliance.delete_providers(existing)
+        message = "Providers {} were deleted because they failed to set up.".format(
+            ', '.join(p.key for p in existing))
+        logger.warning(message)
+        store.terminalreporter.write_line(message + "\n", red=True)
+
+
+def _record_setup_failure(provider, e):
+    _setup_failures[provider] += 1
+    if _setup_failures[provider] >= SETUP_FAIL_LIMIT:
+        _problematic_providers.add(provider)
+        message = "Provider {} is now marked as problematic and won't be used again."\
+                  " {}: {}".format(provider.key, type(e).__name__, str(e))
+        logger.warning(message)
+        store.terminalreporter.write_line(message + "\n", red=True)
+
+
+def _wait_for_refresh(pending, num_sec=1000, delay=30):
+    """ Waits for all the providers to refresh, in one poll loop for all of them
+
+    Like :py:meth:`cfme.common.provider.BaseProvider.validate`, a provider that does not refresh
+    in time is refreshed again.
+
+    Args:
+        pending: List of the providers, those that refreshed are removed from it, so that only
+            those that did not are left in it when the time runs out
+    """
+    providers = list(pending)
+    refresh_timers = {p: RefreshTimer(time_for_refresh=300) for p in providers}
+
+    def _all_refreshed():
+        pending[:] = [p for p in pending if not p.is_refreshed(refresh_timers[p])]
+        return not pending
+
+    wait_for(_all_refreshed, num_sec=num_sec, delay=delay, handle_exception=True,
+             message="providers {} to refresh".format(', '.join(p.key for p in providers)))
+
+
 def _setup_provider_verbose(request, provider, appliance=None):
     if appliance is None:
         appliance = store.current_appliance
     try:
         if request.config.option.provider_limit > 0:
-            existing_providers = [
-                p for p in appliance.managed_known_providers if p.key != provider.key]
-            random.shuffle(existing_providers)
-            maximum_current_providers = request.config.option.provider_limit - 1
-            if len(existing_providers) > maximum_current_providers:
-                providers_to_remove = existing_providers[maximum_current_providers:]
-                store.terminalreporter.write_line(
-                    'Removing extra providers: {}'.format(', '.join(
-                        [p.key for p in providers_to_remove])))
-                for p in providers_to_remove:
-                    logger.info('removing provider %r', p.key)
-                    p.delete(cancel=False)
-                # Decoupled wait for better performance
-                for p in providers_to_remove:
-                    logger.info('waiting for provider %r to disappear', p.key)
-                    p.wait_for_delete()
+            _remove_extra_providers(request, [provider], appliance)
         store.terminalreporter.write_line(
             "Trying to set up provider {}\n".format(provider.key), green=True)
         provider.setup()
         return True
     except Exception as e:
         logger.exception(e)
-        _setup_failures[provider] += 1
-        if _setup_failures[provider] >= SETUP_FAIL_LIMIT:
-            _problematic_providers.add(provider)
-            message = "Provider {} is now marked as problematic and won't be used again."\
-                      " {}: {}".format(provider.key, type(e).__name__, str(e))
-            logger.warning(message)
-            store.terminalreporter.write_line(message + "\n", red=True)
-        if provider.exists:
-            # Remove it in order to not explode on next calls
-            provider.delete(cancel=False)
-            provider.wait_for_delete()
-            message = "Provider {} was deleted because it failed to set up.".format(
-                provider.key)
-            logger.warning(message)
-            store.terminalreporter.write_line(message + "\n", red=True)
+        _record_setup_failure(provider, e)
+        _delete_failed_providers([provider], appliance)
         return False
 
 
@@ -164,9 +199,9 @@ def setup_one_or_skip(request, filters=None, use_global_filters=True):
         _artifactor_skip_providers(request, providers, skip_msg)
 
     # If there is a provider already set up matching the user's requirements, reuse it
-    for provider in providers:
-        if provider.exists:
-            return provider
+    existing = store.current_appliance.existing_providers(providers)
+    if existing:
+        return existing[0]
 
     # If we have more than one provider, we create two separate groups of providers, preferred
     # and not preferred, that we shuffle separately and then join together
@@ -181,7 +216,7 @@ def setup_one_or_skip(request, filters=None, use_global_filters=True):
         providers = preferred_providers + not_preferred_providers
 
     # Try to set up one of matching providers
-    non_existing = [prov for prov in providers if not prov.exists]
+    non_existing = [prov for prov in providers if prov not in existing]
     for provider in non_existing:
         if _setup_provider_verbose(request, provider):
             return provider
@@ -190,6 +225,57 @@ def setup_one_or_skip(request, filters=None, use_global_filters=True):
     _artifactor_skip_providers(request, non_existing, skip_msg)
 
 
+def setup_all_or_skip(request, providers, appliance=None):
+    """ Sets up all of the given providers or skips the test
+
+    The providers which are not set up yet are added one after another and then all of them
+    are waited for to refresh together, rather than waiting for each before adding the next.
+
+    Args:
+        request: Needed for logging a potential skip correctly in artifactor
+        providers: List of provider crud objects
+        appliance: Appliance to set the providers up on, the current one by default
+    """
+    if appliance is None:
+        appliance = store.current_appliance
+    problematic = _problematic_providers.intersection(providers)
+    if problematic:
+        skip_msg = "Providers {} had been marked as problematic".format(
+            ', '.join(p.key for p in problematic))
+        _artifactor_skip_providers(request, problematic, skip_msg)
+    provider_limit = request.config.option.provider_limit
+    if 0 < provider_limit < len(providers):
+        pytest.skip("{} providers needed, only {} allowed by --provider-limit".format(
+            len(providers), provider_limit))
+
+    existing = appliance.existing_providers(providers)
+    non_existing = [prov for prov in providers if prov not in existing]
+    if not non_existing:
+        return providers
+    # The providers the failure is counted for, not those set up fine before it
+    failed = []
+    try:
+        if provider_limit > 0:
+            _remove_extra_providers(request, providers, appliance)
+        store.terminalreporter.write_line(
+            "Trying to set up providers {}\n".format(', '.join(p.key for p in non_existing)),
+            green=True)
+        for provider in non_existing:
+            failed = [provider]
+            provider.create(cancel=False, validate_credentials=True, validate_inventory=False)
+        failed = list(non_existing)
+        _wait_for_refresh(failed)
+        return providers
+    except Exception as e:
+        logger.exception(e)
+        for provider in failed:
+            _record_setup_failure(provider, e)
+        _delete_failed_providers(failed, appliance)
+    _artifactor_skip_providers(
+        request, non_existing,
+        "Unable to set up providers {}".format(', '.join(p.key for p in failed or non_existing)))
+
+
 def setup_one_by_class_or_skip(request, prov_class, use_global_filters=True):
     pf = ProviderFilter(classes=[prov_class])
     return setup_one_or_skip(request, filters=[pf], use_global_filters=use_global_filters)
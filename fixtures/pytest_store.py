@@ -139,6 +139,10 @@ class Store(object):
     def slave_manager(self):
         return self._maybe_get_plugin('slave_manager')
 
+    @property
+    def collection_cache(self):
+        return self._maybe_get_plugin('collection_cache')
+
     @property
     def slaveid(self):
         return getattr(self.slave_manager, 'slaveid', None)
@@ -111,6 +111,9 @@ def uncollectif(item):
 
 def pytest_collection_modifyitems(session, config, items):
     from fixtures.pytest_store import store
+    if store.collection_cache and store.collection_cache.hit:
+        # the collection cache already removed the items uncollected last time
+        return
     len_collected = len(items)
 
     new_items = []
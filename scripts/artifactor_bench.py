@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+"""Benchmark the overhead the artifactor hooks add to every test
+
+Starts an artifactor server like ``fixtures/artifactor_plugin.py`` does, and fires at it the hooks
+that plugin (and the cfme logger) fires for every test of a run of trivial tests: the start, the
+three reports each followed by a report build, the finish, sanitize and ostriz hooks, and
+``--log-messages`` log records. Two clients are compared:
+
+- ``sync``: :py:class:`artifactor.ArtifactorClient`, every hook waits for the server
+- ``async``: :py:class:`artifactor.AsyncArtifactorClient`, the hooks are queued and sent from a
+  background thread
+
+The overhead of a test is the time it spends firing its hooks. For ``async`` the time it takes to
+send what is left in the queue at the end of the session is reported as well. The server writes
+its artifacts where the artifactor is configured to.
+
+Usage: scripts/artifactor_bench.py [--tests 200] [--mode sync --mode async]
+
+"""
+import argparse
+import logging
+import subprocess
+from time import time
+
+from artifactor import ArtifactorClient, AsyncArtifactorClient
+from utils.net import net_check, random_port
+from utils.wait import wait_for
+
+CLIENTS = {'sync': ArtifactorClient, 'async': AsyncArtifactorClient}
+
+
+def log_record(test_name, n):
+    record = logging.LogRecord(
+        'cfme', logging.INFO, __file__, n, 'Step %d of %s', (n, test_name), None)
+    return record.__dict__
+
+
+def run_test(client, n, args):
+    test_location = 'cfme/tests/test_artifactor_bench.py'
+    test_name = 'test_trivial[{}]'.format(n)
+    test = {'test_location': test_location, 'test_name': test_name}
+    client.fire_hook('pre_start_test', slaveid=None, ip='127.0.0.1', **test)
+    client.fire_hook(
+        'start_test', slaveid=None, ip='127.0.0.1', tier=None, requirement=None, param_dict={},
+        issues=[], **test)
+    for when in ('setup', 'call'):
+        client.fire_hook(
+            'report_test', test_xfail=False, test_when=when, test_outcome='passed', **test)
+        client.fire_hook('build_report')
+        if when == 'setup':
+            for i in range(args.log_messages):
+                client.fire_hook('log_message', log_record=log_record(test_name, i), slaveid=None)
+    client.fire_hook('finish_test', slaveid=None, ip='127.0.0.1', wait_for_task=True, **test)
+    client.fire_hook('sanitize', words=[], **test)
+    client.fire_hook(
+        'ostriz_send', slaveid=None, polarion_ids=[], jenkins={}, **test)
+    client.fire_hook(
+        'report_test', test_xfail=False, test_when='teardown', test_outcome='passed', **test)
+    client.fire_hook('build_report')
+
+
+def bench(mode, args):
+    port = random_port()
+    proc = subprocess.Popen(
+        ['miq-artifactor-server', '--port', str(port), '--run-id', 'bench-{}'.format(mode)])
+    try:
+        wait_for(
+            net_check, func_args=[port, '127.0.0.1'], func_kwargs={'force': True},
+            num_sec=10, message="wait for artifactor to start")
+        client = CLIENTS[mode]('127.0.0.1', port)
+        client.ready = True
+        overheads = []
+        for n in range(args.tests):
+            start = time()
+            run_test(client, n, args)
+            overheads.append(time() - start)
+        start = time()
+        client.fire_hook('finish_session')
+        client.flush()
+        flushed = time() - start
+        client.terminate()
+        proc.wait()
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+    overheads.sort()
+    print('{:>5}: {:.1f} ms per test (mean), {:.1f} ms (p99), {:.2f} s to flush at the end'.format(
+        mode, 1000 * sum(overheads) / len(overheads),
+        1000 * overheads[min(int(len(overheads) * 0.99), len(overheads) - 1)], flushed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', type=int, default=200, help='trivial tests to run')
+    parser.add_argument('--log-messages', type=int, default=20,
+        help='records the cfme logger sends for every test')
+    parser.add_argument('--mode', action='append', choices=sorted(CLIENTS),
+        help='clients to compare, both by default')
+    args = parser.parse_args()
+    for mode in args.mode or ['sync', 'async']:
+        bench(mode, args)
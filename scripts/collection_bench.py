@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+"""Benchmark collecting the cfme tests against a stub appliance
+
+Collects the tests (``cfme/tests`` by default) with ``py.test --collect-only`` once per mode, each
+in a process of its own, with the providers of the configured yamls and a stub appliance of the
+given version that never connects anywhere. Two ways of listing the providers for the test
+functions are compared:
+
+- ``loop``: like :py:func:`utils.providers.list_providers` did before the provider index, a CRUD
+  object is built for every provider and every filter is run over all of them, for every call
+- ``indexed``: :py:func:`utils.providers.list_providers`
+
+Reported are the collection time, the time spent listing providers and the number of calls,
+and the number of tests collected, which has to be the same for both.
+
+Usage: scripts/collection_bench.py [--version 5.8.0.0] [--mode loop --mode indexed] [cfme/tests]
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import time
+
+import pytest
+
+MODES = ('loop', 'indexed')
+MODE_VARIABLE = 'COLLECTION_BENCH_MODE'
+VERSION_VARIABLE = 'COLLECTION_BENCH_VERSION'
+RESULT_VARIABLE = 'COLLECTION_BENCH_RESULT'
+
+stats = {'listing': 0.0, 'calls': 0}
+
+
+def list_providers_loop(filters=None, use_global_filters=True, appliance=None):
+    """ :py:func:`utils.providers.list_providers` as it was before the provider index """
+    from utils import providers
+    filters = filters or []
+    if use_global_filters:
+        filters = filters + providers.global_filters.values()
+    provs = [providers.get_crud(prov_key, appliance=appliance)
+             for prov_key in providers.providers_data]
+    for prov_filter in filters:
+        provs = filter(prov_filter, provs)
+    return provs
+
+
+def timed(fn):
+    def wrapper(*args, **kwargs):
+        start = time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats['listing'] += time() - start
+            stats['calls'] += 1
+    return wrapper
+
+
+def stub_appliance(version):
+    """ An appliance of the given version, which has everything collection asks of it """
+    from utils.appliance import IPAppliance
+    from utils.version import Version
+    appliance = IPAppliance('https://stub-appliance.example.com/')
+    appliance.version = Version(version)
+    appliance.build = 'stub'
+    appliance.is_downstream = True
+    appliance.build_datetime = appliance.build_date = None
+    return appliance
+
+
+# The plugin part, loaded in the py.test processes started below with -p
+
+
+@pytest.mark.tryfirst
+def pytest_configure(config):
+    mode = os.environ.get(MODE_VARIABLE)
+    if mode is None:
+        return
+    from utils import appliance, providers, testgen
+    appliance.stack.push(stub_appliance(os.environ[VERSION_VARIABLE]))
+    list_providers = list_providers_loop if mode == 'loop' else providers.list_providers
+    providers.list_providers = testgen.list_providers = timed(list_providers)
+    stats['start'] = time()
+
+
+def pytest_collection_finish(session):
+    if os.environ.get(MODE_VARIABLE) is None:
+        return
+    stats['collection'] = time() - stats.pop('start')
+    stats['tests'] = len(session.items)
+    with open(os.environ[RESULT_VARIABLE], 'w') as f:
+        json.dump(stats, f)
+
+
+def bench(mode, args):
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        env = dict(os.environ)
+        env.update({MODE_VARIABLE: mode, VERSION_VARIABLE: args.version,
+                    RESULT_VARIABLE: result.name})
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(
+                [sys.executable, '-m', 'pytest', '--collect-only', '-q', '-p',
+                 'scripts.collection_bench'] + args.paths,
+                env=env, stdout=devnull)
+        try:
+            results = json.load(result)
+        except ValueError:
+            print('{:>7}: collection failed, run it with -p scripts.collection_bench to see why'
+                  .format(mode))
+            return
+    print('{:>7}: {} tests collected in {:.1f} s, {:.1f} s of it listing providers '
+          '({} calls)'.format(
+              mode, results['tests'], results['collection'], results['listing'],
+              results['calls']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=['cfme/tests'], help='tests to collect')
+    parser.add_argument('--version', default='5.8.0.0', help='version of the stub appliance')
+    parser.add_argument('--mode', action='append', choices=MODES,
+        help='ways of listing providers to compare, both by default')
+    args = parser.parse_args()
+    for mode in args.mode or MODES:
+        bench(mode, args)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python2
+"""Benchmark the event processing of :py:class:`utils.events.EventListener`
+
+Fills an ``event_streams`` table in a local SQLite database (standing in for the appliance's
+postgres) with generated events, registers expected events and processes all of the events in
+two modes:
+
+- ``legacy``: full ``event_streams`` objects are loaded and every event is compared with every
+  expected event, like the listener used to
+- ``indexed``: :py:meth:`utils.events.EventListener.get_next_portion` loads only the columns the
+  expected events use and :py:meth:`utils.events.EventListener.process_event` compares each
+  event with the expected events of its event_type and target_type only
+
+Both modes have to find the same number of matches.
+
+Usage: scripts/events_bench.py [--events 100000] [--expected 50]
+
+"""
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+from time import time
+
+from sqlalchemy import (Boolean, Column, DateTime, Integer, MetaData, String, Table, Text,
+    create_engine)
+
+from utils.db import Db
+from utils.events import Event, EventListener
+
+EVENT_TYPES = ['event_type_{}'.format(n) for n in range(100)]
+TARGET_TYPES = ['VmOrTemplate', 'Host', 'ExtManagementSystem', 'Service', 'EmsCluster']
+FULL_DATA = '---\n' + ''.join(':key_{}: value {}\n'.format(n, 'x' * 40) for n in range(40))
+
+
+class BenchAppliance(object):
+    def __init__(self, db):
+        self.db = db
+
+
+def create_events(db_url, num_events):
+    engine = create_engine(db_url)
+    metadata = MetaData()
+    string_columns = [
+        'message', 'host_name', 'vm_name', 'vm_location', 'vm_ems_ref', 'dest_host_name',
+        'dest_vm_name', 'dest_vm_location', 'dest_vm_ems_ref', 'source', 'chain_id', 'username',
+        'ems_cluster_name', 'ems_cluster_uid', 'type', 'ems_ref', 'group', 'group_level']
+    id_columns = [
+        'host_id', 'vm_or_template_id', 'dest_host_id', 'dest_vm_or_template_id', 'ems_id',
+        'ems_cluster_id', 'availability_zone_id', 'container_node_id', 'container_group_id']
+    columns = [
+        Column('id', Integer, primary_key=True),
+        Column('event_type', String(255)), Column('target_type', String(255)),
+        Column('target_id', Integer), Column('timestamp', DateTime),
+        Column('created_on', DateTime), Column('is_task', Boolean), Column('full_data', Text)]
+    columns.extend(Column(name, String(255)) for name in string_columns)
+    columns.extend(Column(name, Integer) for name in id_columns)
+    table = Table('event_streams', metadata, *columns)
+    metadata.create_all(engine)
+    rand = random.Random(0)
+    start = datetime.utcnow()
+    rows = []
+    for n in range(1, num_events + 1):
+        row = {name: 'value {}'.format(n) for name in string_columns}
+        row.update({name: n for name in id_columns})
+        row.update({
+            'id': n, 'event_type': rand.choice(EVENT_TYPES),
+            'target_type': rand.choice(TARGET_TYPES), 'target_id': rand.randint(1, 100),
+            'timestamp': start + timedelta(seconds=n), 'created_on': start, 'is_task': False,
+            'full_data': FULL_DATA, 'type': 'MiqEvent'})
+        rows.append(row)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+
+
+def expected_events(listener, num_expected):
+    rand = random.Random(1)
+    for _ in range(num_expected):
+        listener.listen_to(listener.new_event(
+            event_type=rand.choice(EVENT_TYPES), target_type=rand.choice(TARGET_TYPES),
+            target_id=rand.randint(1, 100)))
+
+
+def bench_legacy(listener):
+    tool = listener._tool
+    raw_events = tool.query(tool.event_streams)\
+        .filter(tool.event_streams.id > listener._last_processed_id)\
+        .order_by(tool.event_streams.id).yield_per(100).all()
+    for raw_event in raw_events:
+        got_event = Event(event_tool=tool).build_from_raw_event(raw_event)
+        for exp_event in listener._events_to_listen:
+            if exp_event['event'].matches(got_event):
+                exp_event['matched_events'].append(got_event)
+        listener.set_last_record(got_event)
+
+
+def bench_indexed(listener):
+    for raw_event in listener.get_next_portion():
+        listener.process_event(raw_event)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000, help='number of events')
+    parser.add_argument('--expected', type=int, default=50, help='number of expected events')
+    args = parser.parse_args()
+
+    db_url = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'events.sqlite'))
+    create_events(db_url, args.events)
+    for mode, bench in (('legacy', bench_legacy), ('indexed', bench_indexed)):
+        db = Db(hostname='localhost', credentials={'username': None, 'password': None})
+        db.db_url = db_url
+        listener = EventListener(BenchAppliance(db))
+        expected_events(listener, args.expected)
+        listener._last_processed_id = 0
+        start = time()
+        bench(listener)
+        elapsed = time() - start
+        matches = sum(len(exp_event['matched_events']) for exp_event in listener.got_events)
+        print('{:>8}: {:.0f} events/sec, {} matches'.format(mode, args.events / elapsed, matches))
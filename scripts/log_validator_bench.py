@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+"""Benchmark the pattern matching of :py:class:`utils.log_validator.LogValidator`
+
+Runs a log sample through the skip, failure and matched patterns twice:
+
+- ``loop``: every pattern is matched with ``re.match`` on every line, one after another
+- ``combined``: the patterns are matched by :py:class:`utils.log_validator.PatternMatcher`
+
+and reports lines/sec and MB/sec for both, along with the number of matches, which has to be
+the same. Use a log recorded on an appliance (``/var/www/miq/vmdb/log/evm.log``) as the sample,
+or generate one with ``--generate``.
+
+Usage: scripts/log_validator_bench.py evm.log [--generate 1000000] [--patterns 30]
+
+"""
+import argparse
+import random
+import re
+from time import time
+
+from utils.log_validator import PatternMatcher
+
+LINE = ('[----] {level}, [2017-03-01T10:{minute:02d}:{second:02d}.{micro:06d} #{pid}:{tid}]'
+        '{padding} {level} -- : {message}\n')
+MESSAGES = [
+    'MIQ(MiqQueue.put) Message id: [{n}],  id: [], Zone: [default], Role: [ems_inventory], '
+    'Server: [], Ident: [ems_1], Target id: [], Instance id: [], Task id: [], Command: '
+    '[EmsRefresh.refresh], Timeout: [7200], Priority: [100], State: [ready], Deliver On: [], '
+    'Data: [], Args: [[["ManageIQ::Providers::Vmware::InfraManager", {n}]]]',
+    'MIQ(MiqGenericWorker::Runner#get_message_via_drb) Message id: [{n}], MiqWorker id: [5], '
+    'Zone: [default], Role: [], Server: [], Ident: [generic], Target id: [], Instance id: [], '
+    'Task id: [], Command: [MiqEvent.raise_evm_event], Timeout: [600], Priority: [100], '
+    'State: [dequeue], Deliver On: [], Data: [], Args: [["MiqServer", {n}], "evm_worker_start"]',
+    'MIQ(ManageIQ::Providers::Vmware::InfraManager::Refresher#refresh) EMS: [vsphere], id: '
+    '[{n}] Refreshing targets for EMS...Complete',
+    'MIQ(Api::ApiController.api_error) ActiveRecord::RecordNotFound: Couldn\'t find Vm with '
+    '\'id\'={n}',
+    'MIQ(MiqServer#monitor_workers) Worker [MiqEmsMetricsProcessorWorker] with ID: [{n}], PID: '
+    '[4123], GUID: [a2e1c2a6-1f2b-11e7-93ae-92361f002671] has not responded in 130 seconds',
+]
+
+
+def generate(filename, num_lines):
+    rand = random.Random(0)
+    with open(filename, 'w') as f:
+        for n in range(num_lines):
+            level = rand.choice(['INFO'] * 96 + ['WARN'] * 3 + ['ERROR'])
+            f.write(LINE.format(
+                level=level, minute=n // 60000 % 60, second=n // 1000 % 60, micro=n % 1000000,
+                pid=rand.randint(1000, 9999), tid=rand.randint(10 ** 12, 10 ** 13),
+                padding=' ' * (5 - len(level)),
+                message=rand.choice(MESSAGES).format(n=n)))
+
+
+def patterns(num_patterns):
+    """Skip, failure and matched patterns like the ones the tests use"""
+    skip = ['.*ERROR.*API.*MIQ\\(Api::ApiController.api_error\\).*']
+    failure = ['.*ERROR.*', '.*FATAL.*']
+    matched = ['.*Message id: \\[{}\\],.*'.format(n * 9973)
+               for n in range(max(num_patterns - len(skip) - len(failure), 0))]
+    return skip, failure, matched
+
+
+def bench_loop(filename, skip, failure, matched):
+    skip, failure, matched = [map(re.compile, patterns) for patterns in (skip, failure, matched)]
+    matches = 0
+    with open(filename) as f:
+        for line in f:
+            line = line.rstrip()
+            if any(regex.match(line) for regex in skip):
+                matches += 1
+                continue
+            for regex in failure + matched:
+                if regex.match(line):
+                    matches += 1
+    return matches
+
+
+def bench_combined(filename, skip, failure, matched):
+    matcher = PatternMatcher(
+        [('skip', skip), ('failure', failure), ('matched', matched)], stop_on='skip')
+    matches = 0
+    with open(filename) as f:
+        for line in f:
+            matches += len(matcher.match(line.rstrip()))
+    return matches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='log sample to match')
+    parser.add_argument('--generate', type=int, metavar='LINES',
+        help='write a generated evm.log-like sample with this many lines to the log file first')
+    parser.add_argument('--patterns', type=int, default=30, help='number of patterns to match')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.log, args.generate)
+    with open(args.log) as f:
+        num_lines = size = 0
+        for line in f:
+            num_lines += 1
+            size += len(line)
+    skip, failure, matched = patterns(args.patterns)
+    for mode, bench in (('loop', bench_loop), ('combined', bench_combined)):
+        start = time()
+        matches = bench(args.log, skip, failure, matched)
+        elapsed = time() - start
+        print('{:>9}: {:.0f} lines/sec, {:.1f} MB/sec, {} matches'.format(
+            mode, num_lines / elapsed, size / elapsed / 1024 / 1024, matches))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+"""Benchmark the parallelizer's slave to master report channel
+
+Simulates a parallel run of ``fixtures/parallelizer/parallelizer_tester.py`` without appliances:
+every slave process sends a logstart and three serialized reports for each of its tests, and the
+master process unserializes them. Two modes are compared:
+
+- ``req``: every event is a REQ/ROUTER round trip, acknowledged by the master
+- ``push``: events are batched with :py:func:`fixtures.parallelizer.remote.pack_batch` and pushed
+  without waiting, only a final control event is a round trip
+
+Usage: scripts/parallelizer_bench.py [--slaves 16] [--mode req --mode push]
+
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+from time import time
+
+import zmq
+
+from fixtures.parallelizer import parallelizer_tester
+from fixtures.parallelizer.remote import REPORT_BATCH_SIZE, pack_batch, unpack_batch
+
+LONGREPR = '\n'.join(
+    'tests/test_module.py:{}: in test_fails\n    raise Exception("I failed!")'.format(i)
+    for i in range(40))
+
+
+def tester_node_ids():
+    tests = sorted(name for name in dir(parallelizer_tester) if name.startswith('test_'))
+    params = range(10, 10 * parallelizer_tester.num_copies)
+    return ['fixtures/parallelizer/parallelizer_tester.py::{}[{}]'.format(test, param)
+            for param in params for test in tests]
+
+
+def tester_events(nodeid):
+    failed = 'fails' in nodeid
+    yield 'runtest_logstart', {'nodeid': nodeid, 'location': [nodeid, 1, nodeid]}
+    for when in ('setup', 'call', 'teardown'):
+        report = {
+            'nodeid': nodeid, 'location': [nodeid, 1, nodeid], 'keywords': {},
+            'outcome': 'failed' if failed and when == 'call' else 'passed',
+            'longrepr': LONGREPR if failed and when == 'call' else None,
+            'when': when, 'sections': [], 'duration': 0.001,
+        }
+        yield 'runtest_logreport', {'report': report}
+
+
+def slave(mode, slaveid, endpoint, report_endpoint, node_ids, results):
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.IDENTITY, slaveid)
+    sock.connect(endpoint)
+    push = ctx.socket(zmq.PUSH)
+    push.connect(report_endpoint)
+    sent = batches = 0
+    buff = []
+    start = time()
+    for nodeid in node_ids:
+        for name, event in tester_events(nodeid):
+            event['_event_name'] = name
+            sent += 1
+            if mode == 'req':
+                sock.send_json(event)
+                sock.recv_json()
+                continue
+            buff.append(event)
+            if name == 'runtest_logstart' or len(buff) >= REPORT_BATCH_SIZE:
+                push.send_multipart([slaveid] + list(pack_batch(buff)))
+                batches += 1
+                buff = []
+    if buff:
+        push.send_multipart([slaveid] + list(pack_batch(buff)))
+        batches += 1
+    sock.send_json({'_event_name': 'shutdown', '_batches_sent': batches})
+    sock.recv_json()
+    results.put((slaveid, sent, time() - start))
+    push.close()
+    sock.close()
+    ctx.term()
+
+
+def master(mode, num_slaves):
+    node_ids = tester_node_ids()
+    tmpdir = tempfile.mkdtemp()
+    endpoint = 'ipc://{}'.format(os.path.join(tmpdir, 'bench'))
+    report_endpoint = '{}-reports'.format(endpoint)
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.ROUTER)
+    sock.bind(endpoint)
+    pull = ctx.socket(zmq.PULL)
+    pull.bind(report_endpoint)
+    poller = zmq.Poller()
+    poller.register(sock, zmq.POLLIN)
+    poller.register(pull, zmq.POLLIN)
+
+    results = multiprocessing.Queue()
+    procs = []
+    for i in range(num_slaves):
+        slaveid = 'slave{:02d}'.format(i)
+        procs.append(multiprocessing.Process(target=slave, args=(
+            mode, slaveid, endpoint, report_endpoint, node_ids[i::num_slaves], results)))
+
+    received = 0
+    running = num_slaves
+    start = time()
+    for proc in procs:
+        proc.start()
+    while running:
+        events = dict(poller.poll(50))
+        if pull in events:
+            while True:
+                try:
+                    _, encoding, payload = pull.recv_multipart(flags=zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                received += len(unpack_batch(encoding, payload))
+        if sock in events:
+            slaveid, _, event_json = sock.recv_multipart()
+            event = json.loads(event_json)
+            if event['_event_name'] == 'shutdown':
+                running -= 1
+            else:
+                received += 1
+            sock.send_multipart([slaveid, '', json.dumps('ack')])
+    elapsed = time() - start
+    for proc in procs:
+        proc.join()
+
+    slave_rates = []
+    for proc in procs:
+        slaveid, sent, slave_elapsed = results.get()
+        slave_rates.append(sent / slave_elapsed)
+    print('{}: {} slaves, {} tests, {} events in {:.2f}s'.format(
+        mode, num_slaves, len(node_ids), received, elapsed))
+    print('  master: {:.0f} messages/sec'.format(received / elapsed))
+    print('  slave:  {:.0f} messages/sec (mean), {:.0f} messages/sec (slowest)'.format(
+        sum(slave_rates) / len(slave_rates), min(slave_rates)))
+    pull.close()
+    sock.close()
+    ctx.term()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slaves', type=int, default=16, help='number of slave processes')
+    parser.add_argument('--mode', action='append', choices=['req', 'push'],
+        help='report channel to benchmark, can be given more than once (default: both)')
+    args = parser.parse_args()
+    for mode in args.mode or ['req', 'push']:
+        master(mode, args.slaves)
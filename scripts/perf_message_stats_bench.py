@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+"""Benchmark the evm log parsing of :py:mod:`utils.perf_message_stats`
+
+Parses an evm log (a real one, or a synthetic one written with ``--generate``) for messages and
+workers with :py:func:`utils.perf_message_stats.evm_to_messages_and_workers`, once for every
+``--processes`` value, each run in its own process. Reports lines/sec, MB/sec and the peak
+memory of the process aggregating the messages.
+
+Usage: scripts/perf_message_stats_bench.py evm.log [--generate 2048] [--processes 1 --processes 4]
+
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+from datetime import datetime, timedelta
+from time import time
+
+from utils.perf_message_stats import evm_to_messages_and_workers
+
+STAMP = '[----] I, [{ts}.{micro:06d} #{pid}:{tid:x}]  INFO -- : '
+NOISE = [
+    'MIQ(ManageIQ::Providers::Vmware::InfraManager::Vm#perf_capture) [realtime] Capture for '
+    'ManageIQ::Providers::Vmware::InfraManager::Vm name: [vm-{n}], id: [{n}]...Complete - '
+    'Timings: {{:capture_state=>0.02, :vim_connect=>0.15, :capture_intervals=>0.01, '
+    ':capture_counters=>0.2, :total_time=>0.43}}',
+    'MIQ(MiqPerformance.process_perf_capture) Processing for ManageIQ::Providers::Vmware::'
+    'InfraManager::Vm name: [vm-{n}], id: [{n}], for range [2017-03-01T09:00:00Z - '
+    '2017-03-01T10:00:00Z]...Complete',
+    'Q-task_id([{n}]) MIQ(ManageIQ::Providers::Vmware::InfraManager::Refresher#refresh) EMS: '
+    '[vsphere], id: [1] Refreshing targets for EMS...Complete',
+]
+MESSAGE_LINES = [
+    'MIQ(MiqQueue.put) Message id: [{msg}],  id: [], Zone: [default], Role: '
+    '[ems_metrics_collector], Server: [], Ident: [vmware], Target id: [], Instance id: [{n}], '
+    'Task id: [], Command: [ManageIQ::Providers::Vmware::InfraManager::Vm.perf_capture_realtime]'
+    ', Timeout: [600], Priority: [100], State: [ready], Deliver On: [], Data: [], Args: '
+    '[["2017-03-01T09:00:00Z", "hourly"]]',
+    'MIQ(MiqQueue.get_via_drb) Message id: [{msg}], MiqWorker id: [{wkr}], Zone: [default], '
+    'Role: [ems_metrics_collector], Server: [], Ident: [vmware], Target id: [], Instance id: '
+    '[{n}], Task id: [], Command: [ManageIQ::Providers::Vmware::InfraManager::Vm.'
+    'perf_capture_realtime], Timeout: [600], Priority: [100], State: [dequeue], Deliver On: [], '
+    'Data: [], Args: [["2017-03-01T09:00:00Z", "hourly"]], Dequeued in: [{deq}] seconds',
+    'MIQ(MiqQueue.delivered) Message id: [{msg}], State: [ok], Delivered in [{dlv}] seconds',
+]
+WORKER_LINES = [
+    'MIQ(MiqGenericWorker) ID [{wkr}], PID [{pid}], GUID [8a8f5c5e-{wkr:04d}], Zone [default], '
+    'Active Roles [], Assigned Roles [], Configuration:',
+    'MIQ(MiqServer#validate_worker) Worker [MiqGenericWorker] with ID: [{wkr}], PID: [{pid}], '
+    'GUID: [8a8f5c5e-{wkr:04d}] uptime has reached the interval of 7200 seconds, requesting '
+    'worker to exit, raising "evm_worker_uptime_exceeded"',
+    'MIQ(MiqGenericWorker::Runner) ID [{wkr}] PID [{pid}] GUID [8a8f5c5e-{wkr:04d}] Worker '
+    'exiting.',
+]
+
+
+def generate(filename, size_mb):
+    """Writes an evm log with messages going through the queue and workers starting and exiting"""
+    rand = random.Random(0)
+    start = datetime(2017, 3, 1)
+    size = size_mb * 1024 * 1024
+    written = n = msg = 0
+    queued, dequeued = [], []
+    with open(filename, 'w') as f:
+        while written < size:
+            n += 1
+            stamp = STAMP.format(
+                ts=(start + timedelta(seconds=n // 100)).strftime('%Y-%m-%dT%H:%M:%S'),
+                micro=n % 1000000, pid=rand.randint(1000, 9999), tid=rand.getrandbits(40))
+            choice = rand.random()
+            if choice < 0.1:
+                msg += 1
+                queued.append(msg)
+                line = MESSAGE_LINES[0].format(msg=msg, n=n)
+            elif choice < 0.2 and queued:
+                dequeued.append(queued.pop(0))
+                line = MESSAGE_LINES[1].format(
+                    msg=dequeued[-1], n=n, wkr=msg % 50, deq=rand.random() * 10)
+            elif choice < 0.3 and dequeued:
+                line = MESSAGE_LINES[2].format(msg=dequeued.pop(0), dlv=rand.random() * 30)
+            elif choice < 0.301:
+                wkr = rand.randint(1, 50)
+                line = rand.choice(WORKER_LINES).format(wkr=wkr, pid=wkr + 5000)
+            else:
+                line = rand.choice(NOISE).format(n=n)
+            line = '{}{}\n'.format(stamp, line)
+            f.write(line)
+            written += len(line)
+
+
+def bench(evm_file, processes, results):
+    start = time()
+    msg_results, wkr_results = evm_to_messages_and_workers(evm_file, {}, processes)
+    elapsed = time() - start
+    results.put((elapsed, msg_results[4], len(msg_results[0]), len(wkr_results[0]),
+                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('evm_log', help='evm log to parse')
+    parser.add_argument('--generate', type=int, metavar='MB',
+        help='write a synthetic evm log of this size to the evm log file first')
+    parser.add_argument('--processes', type=int, action='append',
+        help='processes parsing the log, can be given more than once (default: 1 and all CPUs)')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.evm_log, args.generate)
+    size_mb = os.path.getsize(args.evm_log) / 1024.0 / 1024
+    for processes in args.processes or [1, multiprocessing.cpu_count()]:
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=bench, args=(args.evm_log, processes, results))
+        proc.start()
+        elapsed, line_count, num_messages, num_workers, maxrss = results.get()
+        proc.join()
+        print('{} processes: {:.0f} lines/sec, {:.1f} MB/sec, {} messages, {} workers, '
+              '{:.0f} MB peak memory'.format(processes, line_count / elapsed, size_mb / elapsed,
+                                             num_messages, num_workers, maxrss / 1024.0))
@@ -4,7 +4,7 @@ import json
 import os
 import sys
 from utils.conf import env
-from utils.sprout import SproutClient
+from cfme.test_framework.sprout.client import SproutClient
 
 
 def main():
@@ -0,0 +1,105 @@
+#!/usr/bin/env python2
+"""Micro-benchmark for :py:meth:`utils.ssh.SSHClient.run_command`
+
+Starts a local paramiko SSH server that accepts any password and runs exec requests with
+``/bin/sh``, then runs the same command over and over in three modes:
+
+- ``reconnect``: a new client and connection for every command, without transport sharing
+- ``single``: one client (and connection) for all the commands
+- ``pooled``: a new client for every command, all sharing one transport through the pool
+
+and reports commands/sec plus the CPU time the client process spent per command.
+
+Usage: scripts/ssh_bench.py [--commands 200] [--command 'echo Testing!']
+
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import threading
+from time import sleep, time
+
+import paramiko
+
+from utils import ports
+from utils.ssh import SSHClient
+
+
+class _StandInServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._run, args=(channel, command)).start()
+        return True
+
+    def _run(self, channel, command):
+        # let the transport thread acknowledge the exec request before anything is sent back
+        sleep(0.001)
+        proc = subprocess.Popen(
+            ['/bin/sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        channel.sendall(stdout)
+        channel.sendall_stderr(stderr)
+        channel.send_exit_status(proc.returncode)
+        channel.shutdown_write()
+        channel.close()
+
+
+def sshd_stand_in(listener):
+    """Serve SSH connections on ``listener`` until killed"""
+    host_key = paramiko.RSAKey.generate(1024)
+    while True:
+        conn, _ = listener.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=_StandInServer())
+
+
+def bench(mode, port, command, num_commands):
+    connect_kwargs = {
+        'hostname': '127.0.0.1', 'port': port, 'username': 'bench', 'password': 'bench',
+        'share_transport': mode == 'pooled'}
+    keepalive = SSHClient(**connect_kwargs)
+    keepalive.connect()
+    start, start_cpu = time(), sum(os.times()[:2])
+    for _ in range(num_commands):
+        client = keepalive if mode == 'single' else SSHClient(**connect_kwargs)
+        assert client.run_command(command, ensure_user=True).success
+        if client is not keepalive:
+            client.close()
+    elapsed, cpu = time() - start, sum(os.times()[:2]) - start_cpu
+    keepalive.close()
+    print('{:>9}: {:.1f} commands/sec, {:.2f} ms CPU per command'.format(
+        mode, num_commands / elapsed, cpu * 1000 / num_commands))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200, help='commands to run per mode')
+    parser.add_argument('--command', default='echo Testing!', help='command to run')
+    args = parser.parse_args()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(100)
+    port = listener.getsockname()[1]
+    # the server runs in its own process to keep its CPU time out of the measurements
+    server = multiprocessing.Process(target=sshd_stand_in, args=(listener,))
+    server.daemon = True
+    server.start()
+    ports.SSH = port
+    try:
+        for mode in ('reconnect', 'single', 'pooled'):
+            bench(mode, port, args.command, args.commands)
+    finally:
+        server.terminate()
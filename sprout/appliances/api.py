@@ -1,21 +1,27 @@
 # -*- coding: utf-8 -*-
 import inspect
 import json
+import os
 import re
 from celery import chain
 from celery.result import AsyncResult
+from contextlib import contextmanager
 from datetime import datetime
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 from django.http import HttpResponse
 from django.shortcuts import render
 from ipware.ip import get_ip
+from time import sleep, time
 
+from appliances import singleton
 from appliances.models import (
     Appliance, AppliancePool, Provider, Group, Template, User, GroupShepherd)
 from appliances.tasks import (
     appliance_power_on, appliance_power_off, appliance_suspend, appliance_rename,
     connect_direct_lun, disconnect_direct_lun, mark_appliance_ready, wait_appliance_ready)
+from sprout import settings
 from sprout.log import create_logger
 
 
@@ -23,30 +29,42 @@ def json_response(data):
     return HttpResponse(json.dumps(data), content_type="application/json")
 
 
-def json_exception(e):
-    return json_response({
+def exception_result(e):
+    return {
         "status": "exception",
         "result": {
             "class": type(e).__name__,
             "message": str(e)
         }
-    })
+    }
 
 
-def json_autherror(message):
-    return json_response({
+def autherror_result(message):
+    return {
         "status": "autherror",
         "result": {
             "message": str(message)
         }
-    })
+    }
 
 
-def json_success(result):
-    return json_response({
+def success_result(result):
+    return {
         "status": "success",
         "result": result
-    })
+    }
+
+
+def json_exception(e):
+    return json_response(exception_result(e))
+
+
+def json_autherror(message):
+    return json_response(autherror_result(message))
+
+
+def json_success(result):
+    return json_response(success_result(result))
 
 
 class JSONMethod(object):
@@ -109,6 +127,18 @@ class JSONApi(object):
             })
         try:
             data = json.loads(request.body)
+        except ValueError as e:
+            return json_exception(e)
+        ipaddr = get_ip(request)
+        if isinstance(data, list):
+            # A batch of calls, answered with the list of their results in the same order
+            return json_response([self.call(call, ipaddr) for call in data])
+        return json_response(self.call(data, ipaddr))
+
+    def call(self, data, ipaddr):
+        """Calls the method, returns the result to send back."""
+        method = None
+        try:
             method_name = data["method"]
             args = data["args"]
             kwargs = data["kwargs"]
@@ -116,7 +146,6 @@ class JSONApi(object):
                 method = self._methods[method_name]
             except KeyError:
                 raise NameError("Method {} not found!".format(method_name))
-            ipaddr = get_ip(request)
             create_logger(method).info(
                 "Calling with parameters {!r}{!r} from {!r}".format(tuple(args), kwargs, ipaddr))
             if method.auth:
@@ -125,22 +154,20 @@ class JSONApi(object):
                     try:
                         user = User.objects.get(username=username)
                     except ObjectDoesNotExist:
-                        return json_autherror("User {} does not exist!".format(username))
+                        return autherror_result("User {} does not exist!".format(username))
                     if not user.check_password(password):
-                        return json_autherror("Wrong password for user {}!".format(username))
+                        return autherror_result("Wrong password for user {}!".format(username))
                     create_logger(method).info(
                         "Called by user {}/{}".format(user.id, user.username))
-                    return json_success(method(user, *args, **kwargs))
+                    return success_result(method(user, *args, **kwargs))
                 else:
-                    return json_autherror("Method {} needs authentication!".format(method_name))
+                    return autherror_result("Method {} needs authentication!".format(method_name))
             else:
-                return json_success(method(*args, **kwargs))
+                return success_result(method(*args, **kwargs))
         except Exception as e:
-            create_logger(method).error(
+            create_logger(method or __name__).error(
                 "Exception raised during call: {}: {}".format(type(e).__name__, str(e)))
-            return json_exception(e)
-        else:
-            create_logger(method).info("Call finished")
+            return exception_result(e)
 
 
 jsonapi = JSONApi()
@@ -241,26 +268,74 @@ def request_appliances(
         container, ram, cpu).id
 
 
-@jsonapi.authenticated_method
-def request_check(user, request_id):
-    """Return status of the appliance pool"""
-    request = AppliancePool.objects.get(id=request_id)
-    if user != request.owner and not user.is_staff:
-        raise Exception("This pool belongs to a different user!")
+def pool_status(pool):
     return {
-        "fulfilled": request.fulfilled,
-        "finished": request.finished,
-        "preconfigured": request.preconfigured,
-        "yum_update": request.yum_update,
-        "progress": int(round(request.percent_finished * 100)),
+        "fulfilled": pool.fulfilled,
+        "finished": pool.finished,
+        "preconfigured": pool.preconfigured,
+        "yum_update": pool.yum_update,
+        "progress": int(round(pool.percent_finished * 100)),
         "appliances": [
             appliance.serialized
             for appliance
-            in request.appliances
+            in pool.appliances
         ],
     }
 
 
+def get_user_pool(user, request_id):
+    pool = AppliancePool.objects.get(id=request_id)
+    if user != pool.owner and not user.is_staff:
+        raise Exception("This pool belongs to a different user!")
+    return pool
+
+
+@jsonapi.authenticated_method
+def request_check(user, request_id):
+    """Return status of the appliance pool"""
+    return pool_status(get_user_pool(user, request_id))
+
+
+@contextmanager
+def long_poll_slot():
+    """Yields whether the call may wait, which at most ``LONG_POLL_LIMIT`` calls may at once.
+
+    Each slot is a cache key taken with an atomic add. The key expires a bit after the longest
+    wait, so a slot whose worker was killed before releasing it frees itself.
+    """
+    ttl = settings.LONG_POLL_MAX_TIMEOUT + 10
+    for slot in range(settings.LONG_POLL_LIMIT):
+        key = 'api-long-poll-{}'.format(slot)
+        if cache.add(key, os.getpid(), ttl):
+            break
+    else:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        cache.delete(key)
+
+
+@jsonapi.authenticated_method
+def wait_for_pool(user, request_id, timeout=20, finished=False):
+    """Waits for the appliance pool to be fulfilled, then returns its status like request_check.
+
+    Returns as soon as the pool is fulfilled (or finished if ``finished`` is true) or after
+    ``timeout`` seconds (20 at most), so check the status and call again if it is not done yet.
+    It does not wait at all when too many calls are already waiting.
+    """
+    pool = get_user_pool(user, request_id)
+    deadline = time() + min(timeout, settings.LONG_POLL_MAX_TIMEOUT)
+    with long_poll_slot() as may_wait:
+        while may_wait and time() < deadline:
+            if pool.not_needed_anymore or (pool.finished if finished else pool.fulfilled):
+                break
+            sleep(settings.LONG_POLL_INTERVAL)
+            pool.reload()
+    return pool_status(pool)
+
+
 @jsonapi.authenticated_method
 def prolong_appliance_lease(user, id, minutes=60):
     """Prolongs the appliance's lease time by specified amount of minutes from current time."""
@@ -339,6 +414,13 @@ def available_providers():
     return map(lambda group: group.id, Provider.objects.all())
 
 
+@jsonapi.method
+def singleton_task_stats():
+    """Returns how many calls of each singleton task were executed, dropped as duplicates,
+    coalesced onto an identical queued or running call and retried because of one."""
+    return singleton.singleton_task_stats()
+
+
 @jsonapi.authenticated_method
 def add_provider(user, provider_key):
     if not user.is_staff:
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import yaml
+from django.db import migrations, models
+
+METADATA_MODELS = [
+    'appliance', 'appliancepool', 'delayedprovisiontask', 'group', 'groupshepherd', 'provider',
+    'template']
+
+
+def convert_metadata(apps, schema_editor, convert):
+    alias = schema_editor.connection.alias
+    for model_name in METADATA_MODELS:
+        model = apps.get_model("appliances", model_name)
+        objects = model.objects.using(alias)
+        for pk, object_meta_data in objects.values_list('pk', 'object_meta_data'):
+            objects.filter(pk=pk).update(object_meta_data=convert(object_meta_data))
+
+
+def yaml_to_json(apps, schema_editor):
+    convert_metadata(
+        apps, schema_editor,
+        lambda data: json.dumps(yaml.load(data) or {}, default=str))
+
+
+def json_to_yaml(apps, schema_editor):
+    convert_metadata(apps, schema_editor, lambda data: yaml.dump(json.loads(data)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appliances', '0039_auto_20170403_0918'),
+    ]
+
+    operations = [
+        migrations.RunPython(yaml_to_json, json_to_yaml),
+    ] + [
+        migrations.AlterField(
+            model_name=model_name,
+            name='object_meta_data',
+            field=models.TextField(default='{}'),
+        )
+        for model_name in METADATA_MODELS
+    ]
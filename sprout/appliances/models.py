@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import base64
+import json
 import re
-import yaml
 
 try:
     import cPickle as pickle
@@ -17,7 +17,7 @@ from datetime import timedelta, date
 from django.contrib.auth.models import User, Group as DjangoGroup
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Case, Count, Q, Value, When
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.utils import timezone
@@ -60,7 +60,7 @@ def apply_if_not_none(o, meth, *args, **kwargs):
 class MetadataMixin(models.Model):
     class Meta:
         abstract = True
-    object_meta_data = models.TextField(default=yaml.dump({}))
+    object_meta_data = models.TextField(default=json.dumps({}))
     created_on = models.DateTimeField(default=timezone.now, editable=False)
     modified_on = models.DateTimeField(default=timezone.now)
 
@@ -71,6 +71,36 @@ class MetadataMixin(models.Model):
             self.modified_on = timezone.now()
         return super(MetadataMixin, self).save(*args, **kwargs)
 
+    @classmethod
+    def bulk_update(cls, changes, batch_size=100):
+        """Writes the changed fields of many objects, without loading or saving them one by one.
+
+        Objects changing the same fields are updated together, by one ``UPDATE`` per batch. Like
+        :py:meth:`save`, it bumps ``modified_on``, but only of the objects that changed.
+
+        Args:
+            changes: Mapping of primary key to a mapping of field name to the new value
+            batch_size: Maximum number of objects updated by one query
+        """
+        by_fields = {}
+        for pk, values in changes.iteritems():
+            if values:
+                by_fields.setdefault(tuple(sorted(values)), []).append(pk)
+        now = timezone.now()
+        for fields, pks in by_fields.iteritems():
+            for i in range(0, len(pks), batch_size):
+                batch = pks[i:i + batch_size]
+                update = {'modified_on': now}
+                for field in fields:
+                    values = [changes[pk][field] for pk in batch]
+                    if all(value == values[0] for value in values):
+                        update[field] = values[0]
+                    else:
+                        update[field] = Case(
+                            *[When(pk=pk, then=Value(value)) for pk, value in zip(batch, values)],
+                            output_field=cls._meta.get_field(field))
+                cls.objects.filter(pk__in=batch).update(**update)
+
     @property
     def age(self):
         return timezone.now() - self.created_on
@@ -79,33 +109,46 @@ class MetadataMixin(models.Model):
         new_self = type(self).objects.get(pk=self.pk)
         self.__dict__.update(new_self.__dict__)
 
-    @property
-    @contextmanager
-    def metadata_lock(self):
-        with critical_section("metadata-({})[{}]".format(type(self).__name__, str(self.pk))):
-            yield
-
     @property
     def metadata(self):
-        return yaml.load(self.object_meta_data)
+        """Metadata as a dict, parsed only once for the loaded object.
+
+        The dict is shared by all the readers, change the metadata with :py:meth:`update_metadata`
+        or :py:attr:`edit_metadata`.
+        """
+        raw = self.object_meta_data
+        cached = self.__dict__.get('_metadata_cache')
+        if cached is None or cached[0] is not raw:
+            cached = self._metadata_cache = (raw, json.loads(raw))
+        return cached[1]
 
     @metadata.setter
     def metadata(self, value):
         if not isinstance(value, dict):
             raise TypeError("You can store only dict in metadata!")
-        self.object_meta_data = yaml.dump(value)
+        self.object_meta_data = json.dumps(value)
 
     @property
     @contextmanager
     def edit_metadata(self):
+        """Edits the metadata stored in the database.
+
+        The row is locked while editing and only the metadata (and ``modified_on``) gets written,
+        the other fields are neither reloaded nor saved.
+        """
         with transaction.atomic():
-            with self.metadata_lock:
-                o = type(self).objects.get(pk=self.pk)
-                metadata = o.metadata
-                yield metadata
-                o.metadata = metadata
-                o.save()
-        self.reload()
+            objects = type(self).objects.filter(pk=self.pk)
+            metadata = json.loads(
+                objects.select_for_update().values_list('object_meta_data', flat=True).get())
+            yield metadata
+            self.metadata = metadata
+            self.modified_on = timezone.now()
+            objects.update(object_meta_data=self.object_meta_data, modified_on=self.modified_on)
+
+    def update_metadata(self, **values):
+        """Sets the given metadata keys, keeping the others as they are stored in the database."""
+        with self.edit_metadata as metadata:
+            metadata.update(values)
 
     @property
     def logger(self):
@@ -128,6 +171,116 @@ class DelayedProvisionTask(MetadataMixin):
             self.provider_to_avoid.id if self.provider_to_avoid is not None else "---")
 
 
+class ProviderCapacity(object):
+    """Snapshot of the provisioning and appliance capacity of a provider
+
+    The counts are taken by :py:meth:`of_providers` in one query for any number of providers, so
+    the code deciding where to provision can look at all providers without querying each of them
+    several times. The snapshot does not change by itself; :py:meth:`add_appliance` accounts for
+    the appliances created after it was taken.
+    """
+    def __init__(
+            self, id, num_simultaneous_provisioning, num_simultaneous_configuring,
+            appliance_limit, num_currently_provisioning=0, num_currently_managing=0,
+            num_templates_preparing=0):
+        self.id = id
+        self.num_simultaneous_provisioning = num_simultaneous_provisioning
+        self.num_simultaneous_configuring = num_simultaneous_configuring
+        self.appliance_limit = appliance_limit
+        self.num_currently_provisioning = num_currently_provisioning
+        self.num_currently_managing = num_currently_managing
+        self.num_templates_preparing = num_templates_preparing
+
+    def __repr__(self):
+        return '<{} provider={} provisioning={}/{} managing={}/{}>'.format(
+            type(self).__name__, self.id, self.num_currently_provisioning,
+            self.num_simultaneous_provisioning, self.num_currently_managing, self.appliance_limit)
+
+    @classmethod
+    def of_providers(cls, *filters, **kwfilters):
+        """Takes the capacity snapshots of the providers matching the filters.
+
+        Returns:
+            :py:class:`dict` of provider id to :py:class:`ProviderCapacity`
+        """
+        appliance = 'provider_templates__appliance'
+        rows = Provider.objects.filter(*filters, **kwfilters).order_by().values(
+            'id', 'num_simultaneous_provisioning', 'num_simultaneous_configuring',
+            'appliance_limit').annotate(
+                num_currently_managing=Count(appliance, distinct=True),
+                num_currently_provisioning=Count(
+                    Case(When(
+                        then=appliance + '__id',
+                        **{
+                            appliance + '__ready': False,
+                            appliance + '__marked_for_deletion': False,
+                            appliance + '__ip_address': None})),
+                    distinct=True),
+                num_templates_preparing=Count(
+                    Case(When(provider_templates__ready=False, then='provider_templates__id')),
+                    distinct=True))
+        return {row['id']: cls(**row) for row in rows}
+
+    def add_appliance(self):
+        """Accounts for an appliance that started provisioning after the snapshot was taken."""
+        self.num_currently_provisioning += 1
+        self.num_currently_managing += 1
+
+    @property
+    def remaining_configuring_slots(self):
+        result = self.num_simultaneous_configuring - self.num_templates_preparing
+        if result < 0:
+            return 0
+        return result
+
+    @property
+    def remaining_appliance_slots(self):
+        if self.appliance_limit is None:
+            return 1
+        result = self.appliance_limit - self.num_currently_managing
+        if result < 0:
+            return 0
+        return result
+
+    @property
+    def remaining_provisioning_slots(self):
+        result = self.num_simultaneous_provisioning - self.num_currently_provisioning
+        if result < 0:
+            return 0
+        # Take the appliance limit into account
+        if self.appliance_limit is None:
+            return result
+        else:
+            free_appl_slots = self.appliance_limit - self.num_currently_managing
+            if free_appl_slots < 0:
+                free_appl_slots = 0
+            return min(free_appl_slots, result)
+
+    @property
+    def free(self):
+        return self.remaining_provisioning_slots > 0
+
+    @property
+    def provisioning_load(self):
+        if self.num_simultaneous_provisioning == 0:
+            return 1.0  # prevent division by zero
+        return float(self.num_currently_provisioning) / float(self.num_simultaneous_provisioning)
+
+    @property
+    def appliance_load(self):
+        if self.appliance_limit is None or self.appliance_limit == 0:
+            return 0.0
+        return float(self.num_currently_managing) / float(self.appliance_limit)
+
+    @property
+    def load(self):
+        """Load for sorting"""
+        if self.appliance_limit is None:
+            return self.provisioning_load
+        else:
+            return self.appliance_load
+
+
 class Provider(MetadataMixin):
     id = models.CharField(max_length=32, primary_key=True, help_text="Provider's key in YAML.")
     working = models.BooleanField(default=False, help_text="Whether provider is available.")
@@ -194,35 +347,30 @@ class Provider(MetadataMixin):
         else:
             return get_mgmt(self.id)
 
+    @property
+    def capacity(self):
+        """Fresh :py:class:`ProviderCapacity` snapshot of this provider."""
+        return ProviderCapacity.of_providers(pk=self.pk)[self.pk]
+
     @property
     def num_currently_provisioning(self):
-        return len(
-            Appliance.objects.filter(
-                ready=False, marked_for_deletion=False, template__provider=self, ip_address=None))
+        return self.capacity.num_currently_provisioning
 
     @property
     def num_templates_preparing(self):
-        return len(Template.objects.filter(provider=self, ready=False))
+        return Template.objects.filter(provider=self, ready=False).count()
 
     @property
     def remaining_configuring_slots(self):
-        result = self.num_simultaneous_configuring - self.num_templates_preparing
-        if result < 0:
-            return 0
-        return result
+        return self.capacity.remaining_configuring_slots
 
     @property
     def remaining_appliance_slots(self):
-        if self.appliance_limit is None:
-            return 1
-        result = self.appliance_limit - self.num_currently_managing
-        if result < 0:
-            return 0
-        return result
+        return self.capacity.remaining_appliance_slots
 
     @property
     def num_currently_managing(self):
-        return len(Appliance.objects.filter(template__provider=self))
+        return self.currently_managed_appliances.count()
 
     @property
     def currently_managed_appliances(self):
@@ -230,41 +378,24 @@ class Provider(MetadataMixin):
 
     @property
     def remaining_provisioning_slots(self):
-        result = self.num_simultaneous_provisioning - self.num_currently_provisioning
-        if result < 0:
-            return 0
-        # Take the appliance limit into account
-        if self.appliance_limit is None:
-            return result
-        else:
-            free_appl_slots = self.appliance_limit - self.num_currently_managing
-            if free_appl_slots < 0:
-                free_appl_slots = 0
-            return min(free_appl_slots, result)
+        return self.capacity.remaining_provisioning_slots
 
     @property
     def free(self):
-        return self.remaining_provisioning_slots > 0
+        return self.capacity.free
 
     @property
     def provisioning_load(self):
-        if self.num_simultaneous_provisioning == 0:
-            return 1.0  # prevent division by zero
-        return float(self.num_currently_provisioning) / float(self.num_simultaneous_provisioning)
+        return self.capacity.provisioning_load
 
     @property
     def appliance_load(self):
-        if self.appliance_limit is None or self.appliance_limit == 0:
-            return 0.0
-        return float(self.num_currently_managing) / float(self.appliance_limit)
+        return self.capacity.appliance_load
 
     @property
     def load(self):
         """Load for sorting"""
-        if self.appliance_limit is None:
-            return self.provisioning_load
-        else:
-            return self.appliance_load
+        return self.capacity.load
 
     @classmethod
     def get_available_provider_keys(cls):
@@ -288,8 +419,7 @@ class Provider(MetadataMixin):
 
     @templates.setter
     def templates(self, value):
-        with self.edit_metadata as metadata:
-            metadata["templates"] = value
+        self.update_metadata(templates=value)
 
     @property
     def template_name_length(self):
@@ -297,8 +427,7 @@ class Provider(MetadataMixin):
 
     @template_name_length.setter
     def template_name_length(self, value):
-        with self.edit_metadata as metadata:
-            metadata["template_name_length"] = value
+        self.update_metadata(template_name_length=value)
 
     @property
     def appliances_manage_this_provider(self):
@@ -306,8 +435,7 @@ class Provider(MetadataMixin):
 
     @appliances_manage_this_provider.setter
     def appliances_manage_this_provider(self, value):
-        with self.edit_metadata as metadata:
-            metadata["appliances_manage_this_provider"] = value
+        self.update_metadata(appliances_manage_this_provider=value)
 
     @property
     def g_appliances_manage_this_provider(self):
@@ -603,8 +731,7 @@ class Template(MetadataMixin):
 
     @temporary_name.setter
     def temporary_name(self, name):
-        with self.edit_metadata as metadata:
-            metadata["temporary_name"] = name
+        self.update_metadata(temporary_name=name)
 
     @temporary_name.deleter
     def temporary_name(self):
@@ -1032,8 +1159,7 @@ class Appliance(MetadataMixin):
 
     @managed_providers.setter
     def managed_providers(self, value):
-        with self.edit_metadata as metadata:
-            metadata["managed_providers"] = value
+        self.update_metadata(managed_providers=value)
 
     @property
     def vnc_link(self):
@@ -1247,10 +1373,26 @@ class AppliancePool(MetadataMixin):
 
     @property
     def possible_provisioning_templates(self):
+        return self.provisioning_templates()
+
+    def provisioning_templates(self, templates=None, capacities=None):
+        """Templates on providers that can provision now, the best match first.
+
+        Args:
+            templates: Templates to choose from, :py:attr:`possible_templates` by default
+            capacities: :py:class:`ProviderCapacity` snapshots by provider id, taken for the
+                providers of the templates if not passed
+        """
+        if templates is None:
+            templates = list(self.possible_templates)
+        if capacities is None:
+            capacities = ProviderCapacity.of_providers(
+                id__in={tpl.provider_id for tpl in templates})
         return sorted(
-            filter(lambda tpl: tpl.provider.free, self.possible_templates),
+            [tpl for tpl in templates if capacities[tpl.provider_id].free],
             # Sort by date and load to pick the best match (least loaded provider)
-            key=lambda tpl: (tpl.date, 1.0 - tpl.provider.appliance_load), reverse=True)
+            key=lambda tpl: (tpl.date, 1.0 - capacities[tpl.provider_id].appliance_load),
+            reverse=True)
 
     @property
     def possible_providers(self):
@@ -1384,25 +1526,24 @@ class AppliancePool(MetadataMixin):
         latest_id = tasks[0].id
         return len(DelayedProvisionTask.objects.filter(id__lt=latest_id))
 
+    @property
+    def possible_capacities(self):
+        """:py:class:`ProviderCapacity` snapshots of the providers of :py:attr:`possible_templates`
+        """
+        return ProviderCapacity.of_providers(
+            id__in=self.possible_templates.values('provider_id'))
+
     @property
     def num_possible_provisioning_slots(self):
-        providers = set([])
-        for template in self.possible_provisioning_templates:
-            providers.add(template.provider)
-        slots = 0
-        for provider in providers:
-            slots += provider.remaining_provisioning_slots
-        return slots
+        return sum(
+            capacity.remaining_provisioning_slots
+            for capacity in self.possible_capacities.itervalues())
 
     @property
     def num_possible_appliance_slots(self):
-        providers = set([])
-        for template in self.possible_templates:
-            providers.add(template.provider)
-        slots = 0
-        for provider in providers:
-            slots += provider.remaining_appliance_slots
-        return slots
+        return sum(
+            capacity.remaining_appliance_slots
+            for capacity in self.possible_capacities.itervalues())
 
     @property
     def num_shepherd_appliances(self):
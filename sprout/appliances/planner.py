@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Planning of the shepherd provisioning.
+
+Kept free of Django so the planning can be simulated without a database, see
+``sprout/shepherd_sim.py``.
+"""
+from collections import namedtuple
+
+
+class Demand(namedtuple('Demand', ['key', 'count', 'templates'])):
+    """Appliances a shepherd group is missing.
+
+    Args:
+        key: Anything identifying the group, handed back in the plan
+        count: Number of missing appliances
+        templates: Templates the appliances can be provisioned from, each with a ``provider_id``
+    """
+    __slots__ = ()
+
+
+def plan_provisioning(demands, capacities):
+    """Spreads the provisioning of all the demands over the providers.
+
+    The demands take turns, one appliance each per round in the given order, so a group whose pool
+    is the emptiest should come first. Every appliance goes to the template whose provider has free
+    provisioning slots and the lowest appliance load (more free slots break the ties), then the
+    capacity of that provider is updated before the next appliance is placed. Demands that can no
+    longer be placed anywhere drop out, so the plan never exceeds the provider limits.
+
+    Args:
+        demands: Iterable of :py:class:`Demand`
+        capacities: Mapping of provider id to a capacity snapshot with
+            ``remaining_provisioning_slots``, ``appliance_load`` and ``add_appliance()``, like
+            :py:class:`appliances.models.ProviderCapacity`. Updated in place.
+    Returns:
+        :py:class:`list` of ``(key, template)`` tuples, one for each appliance to provision.
+    """
+    remaining = [[demand, demand.count] for demand in demands if demand.count > 0]
+    plan = []
+    while remaining:
+        still_remaining = []
+        for entry in remaining:
+            demand, count = entry
+            free = [
+                tpl for tpl in demand.templates
+                if capacities[tpl.provider_id].remaining_provisioning_slots > 0]
+            if not free:
+                continue
+            template = min(free, key=lambda tpl: (
+                capacities[tpl.provider_id].appliance_load,
+                -capacities[tpl.provider_id].remaining_provisioning_slots))
+            capacities[template.provider_id].add_appliance()
+            plan.append((demand.key, template))
+            entry[1] = count - 1
+            if entry[1] > 0:
+                still_remaining.append(entry)
+        remaining = still_remaining
+    return plan
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Deduplication of the tasks of which only one identical call may run at a time.
+
+Identical calls (same task, same arguments) are deduplicated twice:
+
+- when sent: a call identical to one that is queued or running is not sent, the caller gets the
+  result of the queued or running one instead (it is *coalesced* onto it)
+- when run: a call that finds an identical one running is *dropped*, or *retried* later if the
+  task waits for the running one
+
+The counters of what happened are kept in the cache, see :py:func:`singleton_task_stats`.
+"""
+import hashlib
+
+from celery import Task, current_app
+from celery.utils import uuid
+from django.core.cache import cache
+
+LOCK_EXPIRE = 60 * 15  # 15 minutes
+
+#: Counters kept for every singleton task
+COUNTERS = ('executed', 'dropped', 'coalesced', 'retried')
+
+
+def call_digest(args, kwargs):
+    """Digest identifying the call arguments"""
+    digest_base = "/".join(str(arg) for arg in args or ())
+    kwargs = kwargs or {}
+    keys = sorted(kwargs.keys())
+    digest_base += "//" + "/".join("{}={}".format(key, kwargs[key]) for key in keys)
+    return hashlib.sha256(digest_base).hexdigest()
+
+
+def counter_key(task_name, counter):
+    return 'singleton-{}-{}'.format(task_name, counter)
+
+
+def singleton_task_stats(task_names=None):
+    """Returns the counters of the tasks.
+
+    Args:
+        task_names: Names of the tasks, all the registered singleton tasks by default
+    Returns:
+        :py:class:`dict` of task name to a :py:class:`dict` of counter name to its value.
+    """
+    if task_names is None:
+        task_names = sorted(
+            name for name, task in current_app.tasks.items() if isinstance(task, SingletonTask))
+    keys = {
+        counter_key(name, counter): (name, counter)
+        for name in task_names for counter in COUNTERS}
+    values = cache.get_many(keys.keys())
+    stats = {name: {counter: 0 for counter in COUNTERS} for name in task_names}
+    for key, value in values.iteritems():
+        name, counter = keys[key]
+        stats[name][counter] = value
+    return stats
+
+
+class SingletonTask(Task):
+    """Base class of the tasks made by :py:func:`appliances.tasks.singleton_task`
+
+    Attributes:
+        wait: Whether to retry a call that finds an identical one running instead of dropping it.
+            Only the queued calls are coalesced then, so that the call runs after the running one.
+        wait_countdown: Seconds to retry a waiting call after
+        wait_retries: How many times a waiting call retries before it gives up
+        debounce: Seconds to hold a sent call back for, so that the identical calls sent in the
+            meantime are coalesced onto it instead of running one after another.
+    """
+    abstract = True
+    wait = False
+    wait_countdown = 10
+    wait_retries = 30
+    debounce = None
+
+    def lock_key(self, args, kwargs):
+        return '{0}-lock-{1}'.format(self.name, call_digest(args, kwargs))
+
+    def pending_key(self, args, kwargs):
+        return '{0}-pending-{1}'.format(self.name, call_digest(args, kwargs))
+
+    def count(self, counter):
+        key = counter_key(self.name, counter)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass  # Evicted in the meantime, not worth failing the task for
+
+    def apply_async(self, args=None, kwargs=None, task_id=None, link=None, link_error=None,
+                    **options):
+        if task_id is not None or link is not None or link_error is not None:
+            # Retries, chains and callbacks need a message of their own
+            return super(SingletonTask, self).apply_async(
+                args, kwargs, task_id=task_id, link=link, link_error=link_error, **options)
+        task_id = uuid()
+        pending_key = self.pending_key(args, kwargs)
+        if not cache.add(pending_key, task_id, LOCK_EXPIRE):
+            pending_id = cache.get(pending_key)
+            if pending_id is not None:
+                self.count('coalesced')
+                return self.AsyncResult(pending_id)
+            # The pending one started in the meantime
+            cache.set(pending_key, task_id, LOCK_EXPIRE)
+        if self.debounce:
+            options.setdefault('countdown', self.debounce)
+        return super(SingletonTask, self).apply_async(args, kwargs, task_id=task_id, **options)
+
+    def release_pending(self, args, kwargs):
+        """Lets the identical calls be sent again, unless another call took the pending key."""
+        pending_key = self.pending_key(args, kwargs)
+        if self.request.id is not None and cache.get(pending_key) == self.request.id:
+            cache.delete(pending_key)
+
+    def run_singleton(self, run, args, kwargs):
+        """Runs ``run()`` unless an identical call is running."""
+        if self.wait:
+            self.release_pending(args, kwargs)
+        lock_key = self.lock_key(args, kwargs)
+        try:
+            if cache.add(lock_key, 'true', LOCK_EXPIRE):
+                self.count('executed')
+                try:
+                    return run()
+                finally:
+                    cache.delete(lock_key)
+            elif self.wait:
+                self.logger.info("Waiting for another instance of the task to end.")
+                self.count('retried')
+                self.retry(
+                    args=args, kwargs=kwargs, countdown=self.wait_countdown,
+                    max_retries=self.wait_retries)
+            else:
+                self.count('dropped')
+        finally:
+            if not self.wait:
+                self.release_pending(args, kwargs)
@@ -3,20 +3,18 @@ from __future__ import absolute_import
 
 import diaper
 import fauxfactory
-import hashlib
 import iso8601
 import random
 import re
 import command
 import yaml
 from contextlib import closing
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import send_mail
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
-from celery import chain, chord, shared_task
+from celery import chain, chord, group as celery_group, shared_task
 from celery.exceptions import MaxRetriesExceededError
 from datetime import datetime, timedelta
 from functools import wraps
@@ -28,7 +26,9 @@ import socket
 
 from appliances.models import (
     Provider, Group, Template, Appliance, AppliancePool, DelayedProvisionTask,
-    MismatchVersionMailer, User, GroupShepherd)
+    MismatchVersionMailer, User, GroupShepherd, ProviderCapacity)
+from appliances.planner import Demand, plan_provisioning
+from appliances.singleton import SingletonTask
 from sprout import settings, redis
 from sprout.irc_bot import send_message
 from sprout.log import create_logger
@@ -42,7 +42,6 @@ from utils.version import Version
 from utils.wait import wait_for
 
 
-LOCK_EXPIRE = 60 * 15  # 15 minutes
 VERSION_REGEXPS = [
     r"^cfme-(\d)(\d)(\d)(\d)(\d{2})",  # 1.2.3.4.11
     # newer format
@@ -107,23 +106,20 @@ def logged_task(*args, **kwargs):
 
 
 def singleton_task(*args, **kwargs):
+    """Task of which only one identical call runs at a time, see :py:mod:`appliances.singleton`.
+
+    Takes the ``wait``, ``wait_countdown``, ``wait_retries`` and ``debounce`` options of
+    :py:class:`appliances.singleton.SingletonTask` along with the usual task options.
+    """
     kwargs["bind"] = True
-    wait = kwargs.pop('wait', False)
-    wait_countdown = kwargs.pop('wait_countdown', 10)
-    wait_retries = kwargs.pop('wait_retries', 30)
+    kwargs["base"] = SingletonTask
 
     def f(task):
         @wraps(task)
         def wrapped_task(self, *args, **kwargs):
             self.logger = create_logger(task)
-            # Create hash of all args
-            digest_base = "/".join(str(arg) for arg in args)
-            keys = sorted(kwargs.keys())
-            digest_base += "//" + "/".join("{}={}".format(key, kwargs[key]) for key in keys)
-            digest = hashlib.sha256(digest_base).hexdigest()
-            lock_id = '{0}-lock-{1}'.format(self.name, digest)
-
-            if cache.add(lock_id, 'true', LOCK_EXPIRE):
+
+            def run():
                 try:
                     return task(self, *args, **kwargs)
                 except Exception as e:
@@ -132,11 +128,7 @@ def singleton_task(*args, **kwargs):
                         args, kwargs)
                     self.logger.exception(e)
                     raise
-                finally:
-                    cache.delete(lock_id)
-            elif wait:
-                self.logger.info("Waiting for another instance of the task to end.")
-                self.retry(args=args, countdown=wait_countdown, max_retries=wait_retries)
+            return self.run_singleton(run, args, kwargs)
 
         return shared_task(*args, **kwargs)(wrapped_task)
     return f
@@ -416,7 +408,7 @@ def prepare_template_deploy(self, template_id):
         if not template.exists_in_provider:
             template.set_status("Deploying the template.")
             provider_data = template.provider.provider_data
-            kwargs = provider_data["sprout"]
+            kwargs = dict(provider_data["sprout"])  # The provider data is shared, not to be changed
             kwargs["power_on"] = True
             if "allowed_datastores" not in kwargs and "allowed_datastores" in provider_data:
                 kwargs["allowed_datastores"] = provider_data["allowed_datastores"]
@@ -597,11 +589,14 @@ def request_appliance_pool(self, appliance_pool_id, time_minutes):
         "Appliance pool {} requested for {} minutes.".format(appliance_pool_id, time_minutes))
     pool = AppliancePool.objects.get(id=appliance_pool_id)
     n = Appliance.give_to_pool(pool)
+    templates = list(pool.possible_templates)
+    capacities = ProviderCapacity.of_providers(id__in={tpl.provider_id for tpl in templates})
     for i in range(pool.total_count - n):
-        tpls = pool.possible_provisioning_templates
+        tpls = pool.provisioning_templates(templates, capacities)
         if tpls:
             template_id = tpls[0].id
             clone_template_to_pool(template_id, pool.id, time_minutes)
+            capacities[tpls[0].provider_id].add_appliance()
         else:
             with transaction.atomic():
                 task = DelayedProvisionTask(pool=pool, lease_time=time_minutes)
@@ -646,6 +641,7 @@ def process_delayed_provision_tasks(self):
     Goes one task by one and when some of them can be provisioned, it starts the provisioning and
     then deletes the task.
     """
+    capacities = ProviderCapacity.of_providers()
     for task in DelayedProvisionTask.objects.order_by("id"):
         if task.pool.not_needed_anymore:
             task.delete()
@@ -654,7 +650,7 @@ def process_delayed_provision_tasks(self):
         appliances_given = Appliance.give_to_pool(task.pool, 1)
         if appliances_given == 0:
             # No free appliance in shepherd, so do it on our own
-            tpls = task.pool.possible_provisioning_templates
+            tpls = task.pool.provisioning_templates(capacities=capacities)
             if task.provider_to_avoid is not None:
                 filtered_tpls = filter(lambda tpl: tpl.provider != task.provider_to_avoid, tpls)
                 if filtered_tpls:
@@ -664,6 +660,7 @@ def process_delayed_provision_tasks(self):
                 # This will cause additional rejects until the provider quota is met
             if tpls:
                 clone_template_to_pool(tpls[0].id, task.pool.id, task.lease_time)
+                capacities[tpls[0].provider_id].add_appliance()
                 task.delete()
             else:
                 # Try freeing up some space in provider
@@ -795,7 +792,7 @@ def clone_template_to_appliance__clone_template(self, appliance_id, lease_time_m
         if not appliance.provider_api.does_vm_exist(appliance.name):
             appliance.set_status("Beginning template clone.")
             provider_data = appliance.template.provider.provider_data
-            kwargs = provider_data["sprout"]
+            kwargs = dict(provider_data["sprout"])  # The provider data is shared, not to be changed
             kwargs["power_on"] = False
             if "allowed_datastores" not in kwargs and "allowed_datastores" in provider_data:
                 kwargs["allowed_datastores"] = provider_data["allowed_datastores"]
@@ -1056,32 +1053,38 @@ def retrieve_appliance_ip(self, appliance_id):
         appliance.set_status("IP address retrieved.")
 
 
-@singleton_task()
-def refresh_appliances(self):
-    """Dispatches the appliance refresh process among the providers"""
-    self.logger.info("Initiating regular appliance provider refresh")
-    for provider in Provider.objects.filter(working=True, disabled=False):
-        refresh_appliances_provider.delay(provider.id)
+#: Appliance fields the appliance refresh can change
+REFRESH_FIELDS = (
+    'name', 'uuid', 'ip_address', 'power_state', 'power_state_changed', 'swap', 'ssh_failed')
 
 
-@singleton_task(soft_time_limit=180)
-def refresh_appliances_provider(self, provider_id):
-    """Downloads the list of VMs from the provider, then matches them by name or UUID with
-    appliances stored in database.
+def list_provider_vms(provider):
+    """Lists the VMs of the provider.
+
+    Returns:
+        The list of VMs, or None if the provider can not list its VMs.
+    """
+    api = provider.api
+    if not hasattr(api, "all_vms"):
+        return None
+    return api.all_vms()
+
+
+def update_provider_appliances(logger, provider, vms):
+    """Matches the VMs by name or UUID with the provider's appliances stored in database and writes
+    what changed.
+
+    Only the changed appliances are written and only their changed fields, in batches.
     """
-    self.logger.info("Refreshing appliances in {}".format(provider_id))
-    provider = Provider.objects.get(id=provider_id, working=True, disabled=False)
-    if not hasattr(provider.api, "all_vms"):
-        # Ignore this provider
-        return
-    vms = provider.api.all_vms()
     dict_vms = {}
     uuid_vms = {}
     for vm in vms:
         dict_vms[vm.name] = vm
         if vm.uuid:
             uuid_vms[vm.uuid] = vm
+    changes = {}
     for appliance in Appliance.objects.filter(template__provider=provider):
+        before = {field: getattr(appliance, field) for field in REFRESH_FIELDS}
         if appliance.uuid is not None and appliance.uuid in uuid_vms:
             vm = uuid_vms[appliance.uuid]
             # Using the UUID and change the name if it changed
@@ -1089,7 +1092,6 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
         elif appliance.name in dict_vms:
             vm = dict_vms[appliance.name]
             # Using the name, and then retrieve uuid
@@ -1097,13 +1099,45 @@ def refresh_appliances_provider(self, provider_id):
             appliance.ip_address = vm.ip
             appliance.set_power_state(Appliance.POWER_STATES_MAPPING.get(
                 vm.power_state, Appliance.Power.UNKNOWN))
-            appliance.save()
-            self.logger.info("Retrieved UUID for appliance {}/{}: {}".format(
-                appliance.id, appliance.name, appliance.uuid))
+            if appliance.uuid != before['uuid']:
+                logger.info("Retrieved UUID for appliance {}/{}: {}".format(
+                    appliance.id, appliance.name, appliance.uuid))
         else:
             # Orphaned :(
             appliance.set_power_state(Appliance.Power.ORPHANED)
-            appliance.save()
+        changed = {
+            field: getattr(appliance, field) for field in REFRESH_FIELDS
+            if getattr(appliance, field) != before[field]}
+        if changed:
+            changes[appliance.pk] = changed
+    Appliance.bulk_update(changes)
+    logger.info("Refreshed appliances in {}, {} changed".format(provider.id, len(changes)))
+
+
+@singleton_task()
+def refresh_appliances(self):
+    """Refreshes the appliances of all the working providers.
+
+    Each provider is refreshed by a task of its own, so the providers are refreshed concurrently
+    by the workers and a slow provider only holds up (and times out) its own refresh.
+    """
+    self.logger.info("Initiating regular appliance provider refresh")
+    for provider in Provider.objects.filter(working=True, disabled=False):
+        refresh_appliances_provider.delay(provider.id)
+
+
+@singleton_task(soft_time_limit=180, debounce=10)
+def refresh_appliances_provider(self, provider_id):
+    """Downloads the list of VMs from the provider, then matches them by name or UUID with
+    appliances stored in database.
+    """
+    self.logger.info("Refreshing appliances in {}".format(provider_id))
+    provider = Provider.objects.get(id=provider_id, working=True, disabled=False)
+    vms = list_provider_vms(provider)
+    if vms is None:
+        # Ignore this provider
+        return
+    update_provider_appliances(self.logger, provider, vms)
 
 
 @singleton_task()
@@ -1126,8 +1160,7 @@ def check_templates_in_provider(self, provider_id):
     else:
         provider.working = True
         provider.save()
-        with provider.edit_metadata as metadata:
-            metadata["templates"] = templates
+        provider.update_metadata(templates=templates)
     if not provider.working:
         return
     # Check Sprout template existence
@@ -1190,7 +1223,11 @@ def generic_shepherd(self, preconfigured):
     """This task takes care of having the required templates spinned into required number of
     appliances. For each template group, it keeps the last template's appliances spinned up in
     required quantity. If new template comes out of the door, it automatically kills the older
-    running template's appliances and spins up new ones. Sorts the groups by the fulfillment."""
+    running template's appliances and spins up new ones. Sorts the groups by the fulfillment.
+
+    The missing appliances of all the groups are collected first and then provisioned in one batch,
+    spread over the providers by :py:func:`appliances.planner.plan_provisioning`."""
+    demands = []
     for gs in sorted(
             GroupShepherd.objects.all(), key=lambda g: g.get_fulfillment_percentage(preconfigured)):
         prov_filter = {'provider__user_groups': gs.user_group}
@@ -1237,37 +1274,17 @@ def generic_shepherd(self, preconfigured):
                 preconfigured=preconfigured, **filter_keep).all())
         # If it can be deployed, it must exist
         possible_templates_for_provision = filter(lambda tpl: tpl.exists, possible_templates)
-        appliances = []
-        for template in possible_templates:
-            appliances.extend(
-                Appliance.objects.filter(
-                    template=template, appliance_pool=None, marked_for_deletion=False))
+        appliances = list(
+            Appliance.objects.filter(
+                template__in=possible_templates, appliance_pool=None, marked_for_deletion=False))
         # If we then want to delete some templates, better kill the eldest. status_changed
         # says which one was provisioned when, because nothing else then touches that field.
         appliances.sort(key=lambda appliance: appliance.status_changed)
         pool_size = gs.template_pool_size if preconfigured else gs.unconfigured_template_pool_size
         if len(appliances) < pool_size and possible_templates_for_provision:
             # There must be some templates in order to run the provisioning
-            # Provision ONE appliance at time for each group, that way it is possible to maintain
-            # reasonable balancing
-            new_appliance_name = settings.APPLIANCE_FORMAT.format(
-                group=template.template_group.id,
-                date=template.date.strftime("%y%m%d"),
-                rnd=fauxfactory.gen_alphanumeric(8))
-            with transaction.atomic():
-                # Now look for templates that are on non-busy providers
-                tpl_free = filter(
-                    lambda t: t.provider.free,
-                    possible_templates_for_provision)
-                if tpl_free:
-                    appliance = Appliance(
-                        template=sorted(tpl_free, key=lambda t: t.provider.appliance_load)[0],
-                        name=new_appliance_name)
-                    appliance.save()
-            if tpl_free:
-                self.logger.info(
-                    "Adding an appliance to shepherd: {}/{}".format(appliance.id, appliance.name))
-                clone_template_to_appliance.delay(appliance.id, None)
+            demands.append(
+                Demand(gs, pool_size - len(appliances), possible_templates_for_provision))
         elif len(appliances) > pool_size:
             # Too many appliances, kill the surplus
             # Only kill those that are visible only for one group. This is necessary so the groups
@@ -1291,6 +1308,29 @@ def generic_shepherd(self, preconfigured):
                             a.id, a.name))
                     Appliance.kill(a)
 
+    if not demands:
+        return
+    plan = plan_provisioning(demands, ProviderCapacity.of_providers())
+    if not plan:
+        return
+    appliances = []
+    with transaction.atomic():
+        for gs, template in plan:
+            appliance = Appliance(
+                template=template,
+                name=settings.APPLIANCE_FORMAT.format(
+                    group=template.template_group_id,
+                    date=template.date.strftime("%y%m%d"),
+                    rnd=fauxfactory.gen_alphanumeric(8)))
+            appliance.save()
+            appliances.append(appliance)
+            self.logger.info("Adding an appliance to shepherd {}: {}/{}".format(
+                gs, appliance.id, appliance.name))
+    # Dispatch the whole batch at once
+    celery_group(
+        clone_template_to_appliance.s(appliance.id, None) for appliance in appliances
+    ).apply_async()
+
 
 @singleton_task()
 def free_appliance_shepherd(self):
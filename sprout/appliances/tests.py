@@ -1,4 +1,416 @@
 # -*- coding: utf-8 -*-
-# from django.test import TestCase
+import json
+import logging
+from collections import namedtuple
+from datetime import date
 
-# Create your tests here.
+import yaml
+from celery import Celery
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from appliances.models import Appliance, Group, Provider, ProviderCapacity, Template
+from appliances.planner import Demand, plan_provisioning
+from appliances.singleton import SingletonTask, singleton_task_stats
+from appliances.tasks import list_provider_vms, update_provider_appliances
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SingletonTaskTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.app = Celery('singleton-test', broker='memory://', set_as_current=False)
+        self.app.conf.CELERY_TASK_SERIALIZER = 'json'
+        self.executed = []
+        self.running = None
+
+        def make_task(name, **options):
+            @self.app.task(bind=True, base=SingletonTask, name=name, **options)
+            def task(self_, n):
+                def run():
+                    self.executed.append((name, n))
+                    if self.running is not None:
+                        # Another identical call arriving while this one runs, once
+                        running, self.running = self.running, None
+                        running()
+                self_.logger = logging.getLogger(name)
+                return self_.run_singleton(run, (n,), {})
+            return task
+
+        self.task = make_task('test.singleton')
+        self.waiting_task = make_task('test.waiting', wait=True)
+
+    def run_worker(self):
+        """Runs the queued tasks like a worker, returns the number of messages consumed."""
+        consumed = 0
+        with self.app.connection() as connection:
+            queue = connection.SimpleQueue('celery')
+            while True:
+                try:
+                    message = queue.get(block=False)
+                except queue.Empty:
+                    break
+                message.ack()
+                consumed += 1
+                body = message.payload
+                self.app.tasks[body['task']].apply(
+                    body['args'], body['kwargs'], task_id=body['id']).get()
+            queue.close()
+        return consumed
+
+    def test_burst_is_coalesced(self):
+        results = [self.task.delay(1) for _ in range(20)]
+        results.append(self.task.delay(2))
+        self.assertEqual(len({result.id for result in results}), 2)
+        self.assertEqual(self.run_worker(), 2)
+        self.assertEqual(self.executed, [('test.singleton', 1), ('test.singleton', 2)])
+        self.assertEqual(
+            singleton_task_stats([self.task.name])[self.task.name],
+            {'executed': 2, 'dropped': 0, 'coalesced': 19, 'retried': 0})
+
+    def test_sent_again_after_run(self):
+        self.task.delay(1)
+        self.run_worker()
+        self.task.delay(1)
+        self.assertEqual(self.run_worker(), 1)
+        self.assertEqual(len(self.executed), 2)
+
+    def test_coalesced_onto_running(self):
+        self.running = lambda: self.task.delay(1)
+        self.task.delay(1)
+        self.assertEqual(self.run_worker(), 1)
+        self.assertEqual(singleton_task_stats([self.task.name])[self.task.name]['coalesced'], 1)
+
+    def test_waiting_task_runs_after_running(self):
+        self.running = lambda: self.waiting_task.delay(1)
+        self.waiting_task.delay(1)
+        # the call sent while the first one ran got a message of its own
+        self.assertEqual(self.run_worker(), 2)
+        self.assertEqual(len(self.executed), 2)
+
+    def test_running_duplicate_dropped(self):
+        self.running = lambda: self.task.apply((1,), task_id='duplicate')
+        self.task.delay(1)
+        self.run_worker()
+        self.assertEqual(len(self.executed), 1)
+        self.assertEqual(singleton_task_stats([self.task.name])[self.task.name]['dropped'], 1)
+
+    def test_debounce(self):
+        task = self.app.task(
+            bind=True, base=SingletonTask, name='test.debounced', debounce=10)(lambda self_: None)
+        result = task.delay()
+        with self.app.connection() as connection:
+            queue = connection.SimpleQueue('celery')
+            message = queue.get(block=False)
+            queue.close()
+        self.assertEqual(message.payload['id'], result.id)
+        self.assertIsNotNone(message.payload['eta'])
+
+
+PlannedTemplate = namedtuple('PlannedTemplate', ['name', 'provider_id'])
+
+
+class PlanProvisioningTest(SimpleTestCase):
+    def capacities(self, **slots):
+        """Capacity of every provider, given as ``(provisioning slots, appliance limit)``"""
+        return {
+            provider_id: ProviderCapacity(provider_id, provisioning, 1, limit)
+            for provider_id, (provisioning, limit) in slots.iteritems()}
+
+    def test_demand_exceeds_capacity(self):
+        tpl = PlannedTemplate('tpl', 'a')
+        capacities = self.capacities(a=(2, None))
+        plan = plan_provisioning([Demand('group', 5, [tpl])], capacities)
+        self.assertEqual(plan, [('group', tpl), ('group', tpl)])
+        self.assertEqual(capacities['a'].remaining_provisioning_slots, 0)
+
+    def test_appliance_limit(self):
+        tpl = PlannedTemplate('tpl', 'a')
+        capacities = self.capacities(a=(5, 3))
+        capacities['a'].num_currently_managing = 2
+        self.assertEqual(len(plan_provisioning([Demand('group', 5, [tpl])], capacities)), 1)
+
+    def test_groups_share_provider(self):
+        first, second = PlannedTemplate('first', 'a'), PlannedTemplate('second', 'a')
+        plan = plan_provisioning(
+            [Demand('first', 3, [first]), Demand('second', 3, [second])],
+            self.capacities(a=(4, None)))
+        # The groups take turns, the first given goes first
+        self.assertEqual(
+            [key for key, tpl in plan], ['first', 'second', 'first', 'second'])
+
+    def test_template_by_provider_load(self):
+        tpl_a, tpl_b = PlannedTemplate('tpl', 'a'), PlannedTemplate('tpl', 'b')
+        capacities = self.capacities(a=(5, 10), b=(5, 10))
+        capacities['a'].num_currently_managing = 4
+        capacities['b'].num_currently_managing = 2
+        plan = plan_provisioning([Demand('group', 4, [tpl_a, tpl_b])], capacities)
+        # b is loaded less until it has as many appliances as a, then a wins the tie by more
+        # free provisioning slots
+        self.assertEqual(
+            [tpl.provider_id for key, tpl in plan], ['b', 'b', 'a', 'b'])
+
+    def test_template_by_free_slots(self):
+        tpl_a, tpl_b = PlannedTemplate('tpl', 'a'), PlannedTemplate('tpl', 'b')
+        plan = plan_provisioning(
+            [Demand('group', 1, [tpl_a, tpl_b])], self.capacities(a=(2, None), b=(3, None)))
+        self.assertEqual(plan, [('group', tpl_b)])
+
+    def test_zero_capacity(self):
+        tpl_a, tpl_b = PlannedTemplate('tpl', 'a'), PlannedTemplate('tpl', 'b')
+        capacities = self.capacities(a=(0, None), b=(5, 0))
+        self.assertEqual(plan_provisioning([Demand('group', 2, [tpl_a, tpl_b])], capacities), [])
+        self.assertEqual(
+            plan_provisioning([Demand('group', 0, [tpl_a])], self.capacities(a=(5, None))), [])
+
+
+VM = namedtuple('VM', ['name', 'uuid', 'ip', 'power_state'])
+
+
+def make_template(provider, name='template', **kwargs):
+    group, _ = Group.objects.get_or_create(id='downstream')
+    return Template.objects.create(
+        provider=provider, template_group=group, date=date(2017, 1, 1), original_name=name,
+        name=name, **kwargs)
+
+
+def make_appliance(template, name, **kwargs):
+    return Appliance.objects.create(template=template, name=name, **kwargs)
+
+
+class ProviderAppliancesRefreshTest(TestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(id='provider', working=True)
+        self.template = make_template(self.provider)
+        self.logger = logging.getLogger('test.refresh')
+
+    def test_list_provider_vms(self):
+        class Api(object):
+            def all_vms(self):
+                raise RuntimeError('provider is down')
+
+        class FakeProvider(object):
+            api = object()
+
+        provider = FakeProvider()
+        self.assertIsNone(list_provider_vms(provider))
+        provider.api = Api()
+        with self.assertRaises(RuntimeError):
+            list_provider_vms(provider)
+
+    def test_update(self):
+        by_uuid = make_appliance(self.template, 'old-name', uuid='uuid-1', power_state='on')
+        by_name = make_appliance(self.template, 'by-name', power_state='unknown')
+        orphan = make_appliance(self.template, 'orphan', power_state='on', swap=10)
+        unchanged = make_appliance(
+            self.template, 'unchanged', uuid='uuid-4', ip_address='10.0.0.4', power_state='on')
+        other = make_appliance(
+            make_template(Provider.objects.create(id='other')), 'orphan', power_state='on')
+        modified_on = {
+            appliance.pk: appliance.modified_on
+            for appliance in [by_uuid, by_name, orphan, unchanged]}
+
+        update_provider_appliances(self.logger, self.provider, [
+            VM('new-name', 'uuid-1', '10.0.0.1', 'poweredOn'),
+            VM('by-name', 'uuid-2', '10.0.0.2', 'poweredOff'),
+            VM('unchanged', 'uuid-4', '10.0.0.4', 'up'),
+        ])
+        for appliance in [by_uuid, by_name, orphan, unchanged, other]:
+            appliance.reload()
+        self.assertEqual(
+            (by_uuid.name, by_uuid.ip_address, by_uuid.power_state),
+            ('new-name', '10.0.0.1', Appliance.Power.ON))
+        self.assertEqual(
+            (by_name.uuid, by_name.ip_address, by_name.power_state),
+            ('uuid-2', '10.0.0.2', Appliance.Power.OFF))
+        self.assertEqual((orphan.power_state, orphan.swap), (Appliance.Power.ORPHANED, 0))
+        self.assertEqual(other.power_state, Appliance.Power.ON)
+        # Only the changed appliances are written
+        self.assertEqual(unchanged.modified_on, modified_on[unchanged.pk])
+        for appliance in [by_uuid, by_name, orphan]:
+            self.assertGreater(appliance.modified_on, modified_on[appliance.pk])
+
+    def test_bulk_update(self):
+        appliances = [
+            make_appliance(
+                self.template, 'appliance-{}'.format(n), ip_address='10.0.0.{}'.format(n))
+            for n in range(5)]
+        untouched = appliances[4]
+        Appliance.bulk_update({
+            # The same fields with different values, in two batches
+            appliances[0].pk: {'power_state': 'on', 'swap': 1},
+            appliances[1].pk: {'power_state': 'off', 'swap': 2},
+            appliances[2].pk: {'power_state': 'on', 'swap': 3},
+            # Other fields, the same value for all
+            appliances[3].pk: {'name': 'renamed'},
+            untouched.pk: {},
+        }, batch_size=2)
+        rows = dict(
+            (row[0], row[1:]) for row in Appliance.objects.values_list(
+                'pk', 'name', 'power_state', 'swap', 'ip_address', 'modified_on'))
+        self.assertEqual(rows[appliances[0].pk][:4], ('appliance-0', 'on', 1, '10.0.0.0'))
+        self.assertEqual(rows[appliances[1].pk][:4], ('appliance-1', 'off', 2, '10.0.0.1'))
+        self.assertEqual(rows[appliances[2].pk][:4], ('appliance-2', 'on', 3, '10.0.0.2'))
+        self.assertEqual(rows[appliances[3].pk][:4], ('renamed', 'unknown', None, '10.0.0.3'))
+        self.assertEqual(rows[untouched.pk][4], untouched.modified_on)
+        for appliance in appliances[:4]:
+            self.assertGreater(rows[appliance.pk][4], appliance.modified_on)
+
+
+class ProviderCapacityTest(TestCase):
+    def setUp(self):
+        busy = Provider.objects.create(
+            id='busy', num_simultaneous_provisioning=3, num_simultaneous_configuring=1,
+            appliance_limit=5)
+        first, second = make_template(busy, 'first', ready=True), make_template(busy, 'second')
+        make_template(busy, 'third')
+        for template in (first, second):
+            make_appliance(template, 'provisioning-{}'.format(template.name))
+            make_appliance(template, 'with-ip-{}'.format(template.name), ip_address='10.0.0.1')
+            make_appliance(template, 'ready-{}'.format(template.name), ready=True)
+            make_appliance(template, 'deleted-{}'.format(template.name), marked_for_deletion=True)
+        make_appliance(first, 'ready-with-ip', ready=True, ip_address='10.0.0.2')
+
+        unlimited = Provider.objects.create(id='unlimited', num_simultaneous_provisioning=2)
+        make_appliance(make_template(unlimited, 'template', ready=True), 'provisioning')
+        Provider.objects.create(id='empty', num_simultaneous_provisioning=0, appliance_limit=0)
+
+    def old_properties(self, provider):
+        """The counts as the provider properties queried them before the snapshots"""
+        appliances = Appliance.objects.filter(template__provider=provider)
+        provisioning = appliances.filter(
+            ready=False, marked_for_deletion=False, ip_address=None).count()
+        return {
+            'num_currently_provisioning': provisioning,
+            'num_currently_managing': appliances.count(),
+            'num_templates_preparing': Template.objects.filter(
+                provider=provider, ready=False).count(),
+        }
+
+    def test_of_providers(self):
+        capacities = ProviderCapacity.of_providers()
+        self.assertEqual(sorted(capacities), ['busy', 'empty', 'unlimited'])
+        for provider in Provider.objects.all():
+            capacity = capacities[provider.id]
+            for name, value in self.old_properties(provider).iteritems():
+                self.assertEqual(getattr(capacity, name), value, (provider.id, name))
+        busy = capacities['busy']
+        self.assertEqual(
+            (busy.num_currently_provisioning, busy.num_currently_managing,
+             busy.num_templates_preparing), (2, 9, 2))
+        self.assertEqual(busy.remaining_provisioning_slots, 0)
+        self.assertEqual(capacities['unlimited'].remaining_provisioning_slots, 1)
+
+    def test_filtered(self):
+        self.assertEqual(sorted(ProviderCapacity.of_providers(id__in=['busy', 'empty'])),
+                         ['busy', 'empty'])
+
+    def test_add_appliance(self):
+        capacity = ProviderCapacity.of_providers(pk='unlimited')['unlimited']
+        self.assertTrue(capacity.free)
+        capacity.add_appliance()
+        self.assertFalse(capacity.free)
+        self.assertEqual(capacity.provisioning_load, 1.0)
+
+
+class MetadataTest(TestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(id='provider')
+        self.provider.update_metadata(templates=['a'])
+
+    def test_parsed_once(self):
+        metadata = self.provider.metadata
+        self.assertEqual(metadata, {'templates': ['a']})
+        self.assertIs(self.provider.metadata, metadata)
+
+    def test_cache_invalidated(self):
+        metadata = self.provider.metadata
+        self.provider.metadata = {'templates': ['b']}
+        self.assertEqual(self.provider.metadata, {'templates': ['b']})
+        self.provider.object_meta_data = json.dumps({'templates': ['c']})
+        self.assertEqual(self.provider.metadata, {'templates': ['c']})
+        self.provider.reload()
+        self.assertEqual(self.provider.metadata, {'templates': ['a']})
+        self.assertEqual(metadata, {'templates': ['a']})
+        with self.assertRaises(TypeError):
+            self.provider.metadata = ['a']
+
+    def test_edit_metadata(self):
+        stale = Provider.objects.get(pk=self.provider.pk)
+        stale.metadata  # Parsed before the metadata changes
+        self.provider.update_metadata(template_name_length=10)
+        stale.working = True
+        locked = []
+        select_for_update = QuerySet.select_for_update
+
+        def record_select_for_update(queryset, *args, **kwargs):
+            # SQLite does not lock, so only the lock being asked for can be checked
+            locked.append(queryset.model)
+            return select_for_update(queryset, *args, **kwargs)
+        QuerySet.select_for_update = record_select_for_update
+        try:
+            with stale.edit_metadata as metadata:
+                # The stored metadata, not the stale one
+                self.assertEqual(metadata, {'templates': ['a'], 'template_name_length': 10})
+                metadata['templates'].append('b')
+        finally:
+            QuerySet.select_for_update = select_for_update
+        self.assertEqual(locked, [Provider])
+        expected = {'templates': ['a', 'b'], 'template_name_length': 10}
+        self.assertEqual(stale.metadata, expected)
+        self.provider.reload()
+        self.assertEqual(self.provider.metadata, expected)
+        self.assertEqual(self.provider.modified_on, stale.modified_on)
+        # Only the metadata was written
+        self.assertFalse(self.provider.working)
+
+    def test_edit_metadata_failed(self):
+        with self.assertRaises(RuntimeError):
+            with self.provider.edit_metadata as metadata:
+                metadata['templates'] = []
+                raise RuntimeError('not stored')
+        self.provider.reload()
+        self.assertEqual(self.provider.metadata, {'templates': ['a']})
+
+
+class MetadataMigrationTest(TransactionTestCase):
+    migrate_from = [('appliances', '0039_auto_20170403_0918')]
+    migrate_to = [('appliances', '0040_metadata_json')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_yaml_to_json(self):
+        apps = self.migrate(self.migrate_from)
+        OldProvider = apps.get_model('appliances', 'Provider')
+        legacy = {
+            'templates': ['cfme-58'],
+            'provider_data': {'ipaddress': '10.0.0.1', 'port': 443},
+            'last_update': date(2017, 4, 3),
+        }
+        OldProvider.objects.create(id='legacy', object_meta_data=yaml.dump(legacy))
+        OldProvider.objects.create(id='empty', object_meta_data='')
+
+        apps = self.migrate(self.migrate_to)
+        rows = dict(
+            apps.get_model('appliances', 'Provider').objects.values_list('id', 'object_meta_data'))
+        # Values JSON can not hold, like dates, are stored as strings
+        legacy['last_update'] = '2017-04-03'
+        self.assertEqual(json.loads(rows['legacy']), legacy)
+        self.assertEqual(json.loads(rows['empty']), {})
+
+        apps = self.migrate(self.migrate_from)
+        rows = dict(
+            apps.get_model('appliances', 'Provider').objects.values_list('id', 'object_meta_data'))
+        self.assertEqual(yaml.load(rows['legacy']), legacy)
@@ -18,7 +18,7 @@ from django.shortcuts import render, redirect
 from appliances.api import json_response
 from appliances.models import (
     Provider, AppliancePool, Appliance, Group, Template, MismatchVersionMailer, User, BugQuery,
-    GroupShepherd)
+    GroupShepherd, ProviderCapacity)
 from appliances.tasks import (appliance_power_on, appliance_power_off, appliance_suspend,
     anyvm_power_on, anyvm_power_off, anyvm_suspend, anyvm_delete, delete_template_from_provider,
     appliance_rename, wait_appliance_ready, mark_appliance_ready, appliance_reboot)
@@ -317,6 +317,7 @@ def providers_for_date_group_and_version(request):
                 container_q, **filters).values("provider").distinct()
             providers = sorted([p.values()[0] for p in providers])
             providers = [Provider.objects.get(id=provider) for provider in providers]
+            capacities = ProviderCapacity.of_providers(id__in=[p.id for p in providers])
             for provider in providers:
                 appl_filter = dict(
                     appliance_pool=None, ready=True, template__provider=provider,
@@ -330,13 +331,14 @@ def providers_for_date_group_and_version(request):
                 shepherd_appliances[provider.id] = len(
                     Appliance.objects.filter(appliance_container_q, **appl_filter))
                 total_shepherd_slots += shepherd_appliances[provider.id]
-                total_appliance_slots += provider.remaining_appliance_slots
-                total_provisioning_slots += provider.remaining_provisioning_slots
+                total_appliance_slots += capacities[provider.id].remaining_appliance_slots
+                total_provisioning_slots += capacities[provider.id].remaining_provisioning_slots
 
             render_providers = {}
             for provider in providers:
                 render_providers[provider.id] = {
-                    "shepherd_count": shepherd_appliances[provider.id], "object": provider}
+                    "shepherd_count": shepherd_appliances[provider.id], "object": provider,
+                    "capacity": capacities[provider.id]}
     return render(request, 'appliances/_providers.html', locals())
 
 
@@ -1,126 +1,228 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
-# Based on: https://docs.python.org/2.4/lib/network-logging.html
-import atexit
+"""Log server of Sprout
+
+Receives the log records of the Sprout processes over TCP and writes every logger into a file of
+its own under ``log/``, eg. ``appliances.tasks`` into ``log/appliances/tasks.log``.
+
+The connection threads only decode the records and put them in a queue. All the files are written
+by a single I/O thread (:py:class:`LogWriter`), which takes the records off the queue in batches,
+sorts them into a queue per file, and writes each file's records in one go. Only the most recently
+written files are kept open.
+
+Every record is a 4-byte big endian length followed by either:
+
+- the pickled record dict, as :py:class:`logging.handlers.SocketHandler` sends it
+- a JSON object, as :py:class:`sprout.log.JSONSocketHandler` sends it
+
+Based on: https://docs.python.org/2.4/lib/network-logging.html
+"""
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+import json
 import logging
 import logging.handlers
+import os
 import SocketServer
 import signal
 import struct
-from threading import Lock
-
-from sprout import sprout_path
-from utils.log import create_logger
-
+from collections import OrderedDict
+from Queue import Empty, Queue
+from threading import Thread
 
-logs_path = sprout_path.join("log")
 
-logger_cache = {}
-
-logger_cache_lock = Lock()
-
-global_fs_lock = Lock()
+logs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log")
 
 MAX_FILE_SIZE = 20 * 1024 * 1024
 MAX_BACKUPS = 10
+#: Log files kept open at once, the least recently written one is closed first
+MAX_OPEN_FILES = 256
+#: Records taken off the queue at once
+BATCH_SIZE = 1000
+#: Records waiting to be written at most, the connections block when it is full
+QUEUE_SIZE = 100000
+
+LOG_FORMAT = '%(asctime)-15s [%(levelname).1s] %(message)s (%(pathname)s:%(lineno)s)'
 
 
 def translate_sigterm_to_sigint(*args):
     raise KeyboardInterrupt
 
 
-signal.signal(signal.SIGTERM, translate_sigterm_to_sigint)
+def decode_record(payload):
+    """Makes a :py:class:`logging.LogRecord` of a received frame, either JSON or pickled."""
+    if payload[:1] == '{':
+        return logging.makeLogRecord(json.loads(payload))
+    return logging.makeLogRecord(pickle.loads(payload))
 
 
-@atexit.register
-def close_logs():
-    global logger_cache
-    with logger_cache_lock:
-        for filename, (logger, lock) in logger_cache.iteritems():
-            with lock:
-                for handler in logger.handlers:
-                    if hasattr(handler, "close"):
-                        try:
-                            handler.close()
-                        except Exception as e:
-                            print("Could not close handler:", type(e).__name__, str(e))
-        logger_cache = {}
+class LogWriter(Thread):
+    """Writes all the log files, alone, so the files need no locking.
 
+    Args:
+        logs_path: Directory the files are written in
+        max_open_files: See :py:data:`MAX_OPEN_FILES`
+        batch_size: See :py:data:`BATCH_SIZE`
+        queue_size: See :py:data:`QUEUE_SIZE`
+    """
+    def __init__(self, logs_path, max_open_files=MAX_OPEN_FILES, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE):
+        super(LogWriter, self).__init__(name="LogWriter")
+        self.daemon = True
+        self.logs_path = logs_path
+        self.max_open_files = max_open_files
+        self.batch_size = batch_size
+        self.queue = Queue(queue_size)
+        self.formatter = logging.Formatter(LOG_FORMAT)
+        self.filenames = {}
+        # filename: handler, the least recently written first
+        self.handlers = OrderedDict()
+        # filename: records
+        self.pending = OrderedDict()
 
-class LogRecordStreamHandler(SocketServer.StreamRequestHandler):
-    """Handler for a streaming logging request.
+    def put(self, name, record):
+        """Queues the record to be written into the file of the logger ``name``."""
+        self.queue.put((name, record))
 
-    This basically logs the record using whatever logging policy is
-    configured locally.
-    """
+    def stop(self):
+        """Writes what is queued, closes the files and ends the thread."""
+        self.queue.put(None)
+        self.join()
+
+    def filename(self, name):
+        try:
+            return self.filenames[name]
+        except KeyError:
+            pass
+        if not name:
+            filename = os.path.join(self.logs_path, "sprout.log")
+        else:
+            fields = name.split(".")
+            filename = os.path.join(self.logs_path, *fields) + ".log"
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.filenames[name] = filename
+        return filename
+
+    def handler(self, filename):
+        try:
+            handler = self.handlers.pop(filename)
+        except KeyError:
+            if len(self.handlers) >= self.max_open_files:
+                _, evicted = self.handlers.popitem(last=False)
+                evicted.close()
+            handler = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=MAX_FILE_SIZE, backupCount=MAX_BACKUPS)
+            handler.setFormatter(self.formatter)
+        self.handlers[filename] = handler
+        return handler
+
+    def write(self, filename, records):
+        handler = self.handler(filename)
+        handler.stream.seek(0, os.SEEK_END)
+        size = handler.stream.tell()
+        for record in records:
+            try:
+                line = handler.format(record)
+                if isinstance(line, unicode):
+                    line = line.encode("utf-8")
+                line += "\n"
+                if size and size + len(line) >= MAX_FILE_SIZE:
+                    handler.doRollover()
+                    size = 0
+                handler.stream.write(line)
+                size += len(line)
+            except Exception:
+                handler.handleError(record)
+        handler.flush()
+
+    def write_pending(self):
+        while self.pending:
+            filename, records = self.pending.popitem(last=False)
+            try:
+                self.write(filename, records)
+            except Exception as e:
+                print("Could not write {}: {} {}".format(filename, type(e).__name__, str(e)))
+
+    def close(self):
+        while self.handlers:
+            filename, handler = self.handlers.popitem()
+            try:
+                handler.close()
+            except Exception as e:
+                print("Could not close {}: {} {}".format(filename, type(e).__name__, str(e)))
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+                name, record = item
+                try:
+                    filename = self.filename(name)
+                except Exception as e:
+                    print("Could not log into {}: {} {}".format(name, type(e).__name__, str(e)))
+                    continue
+                self.pending.setdefault(filename, []).append(record)
+            self.write_pending()
+            for _ in batch:
+                self.queue.task_done()
+        self.close()
+
+
+class LogRecordStreamHandler(SocketServer.StreamRequestHandler):
+    """Handler for a streaming logging request, see the module docs for the framing."""
 
     def handle(self):
-        """
-        Handle multiple requests - each expected to be a 4-byte length,
-        followed by the LogRecord in pickle format. Logs the record
-        according to whatever policy is configured locally.
-        """
-        global logger_cache
         while True:
-            chunk = self.connection.recv(4)
+            chunk = self.rfile.read(4)
             if len(chunk) < 4:
                 break
             slen = struct.unpack(">L", chunk)[0]
-            chunk = self.connection.recv(slen)
-            while len(chunk) < slen:
-                chunk = chunk + self.connection.recv(slen - len(chunk))
-            obj = pickle.loads(chunk)
-            record = logging.makeLogRecord(obj)
+            chunk = self.rfile.read(slen)
+            if len(chunk) < slen:
+                break
+            try:
+                record = decode_record(chunk)
+            except Exception as e:
+                print("Could not decode a record from {}: {} {}".format(
+                    self.client_address, type(e).__name__, str(e)))
+                continue
             # if a name is specified, we use the named logger rather than the one
             # implied by the record.
             if self.server.logname is not None:
                 name = self.server.logname
             else:
                 name = record.name
-            if not name:
-                filename = logs_path.join("sprout.log")
-            else:
-                fields = name.split(".")
-                fields[-1] += ".log"
-                filename = logs_path
-                for field in fields:
-                    filename = filename.join(field)
-                    if not field.endswith(".log"):
-                        with global_fs_lock:
-                            if not filename.exists():
-                                filename.mkdir()
-            filename = filename.strpath
-            with logger_cache_lock:
-                if filename in logger_cache:
-                    logger, lock = logger_cache[filename]
-                else:
-                    logger = create_logger(
-                        name, filename=filename, max_file_size=MAX_FILE_SIZE,
-                        max_backups=MAX_BACKUPS)
-                    lock = Lock()
-                    logger_cache[filename] = (logger, lock)
-            # N.B. EVERY record gets logged. This is because Logger.handle
-            # is normally called AFTER logger-level filtering. If you want
-            # to do filtering, do it at the client end to save wasting
-            # cycles and network bandwidth!
-            with lock:
-                logger.handle(record)
+            # N.B. EVERY record gets logged. If you want to do filtering, do it at the client end
+            # to save wasting cycles and network bandwidth!
+            self.server.writer.put(name, record)
 
 
 class LogRecordSocketReceiver(SocketServer.ThreadingTCPServer):
     allow_reuse_address = 1
+    daemon_threads = True
 
     def __init__(self, host='localhost',
                  port=logging.handlers.DEFAULT_TCP_LOGGING_PORT,
-                 handler=LogRecordStreamHandler):
+                 handler=LogRecordStreamHandler, logs_path=logs_path):
         SocketServer.ThreadingTCPServer.__init__(self, (host, port), handler)
         self.abort = 0
         self.timeout = 1
         self.logname = None
+        self.writer = LogWriter(logs_path)
+        self.writer.start()
 
     def serve_until_stopped(self):
         import select
@@ -133,14 +235,22 @@ class LogRecordSocketReceiver(SocketServer.ThreadingTCPServer):
                 self.handle_request()
             abort = self.abort
 
+    def server_close(self):
+        SocketServer.ThreadingTCPServer.server_close(self)
+        self.writer.stop()
+
 
 def main():
+    signal.signal(signal.SIGTERM, translate_sigterm_to_sigint)
     tcpserver = LogRecordSocketReceiver()
     print("About to start TCP server...")
     try:
         tcpserver.serve_until_stopped()
     except KeyboardInterrupt:
         print("Quitting")
+    finally:
+        tcpserver.server_close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""Loads the log server with records from many processes at once
+
+Every sender process stands in for a Celery worker: it connects to the log server and logs
+``--records`` records, spread over ``--loggers`` loggers (so into as many log files), through the
+socket handler the Sprout processes use. Reported are:
+
+- records/sec: records sent by all the senders per second of the run. When the log server is
+  started here (no ``--port`` given), the run lasts until all the records are written.
+- p50/p99 enqueue: how long one logging call blocks the sender
+
+Usage (from the sprout directory): ./logserver_load.py [--senders 24] [--framing json pickle]
+
+"""
+import argparse
+import logging
+import logging.handlers
+import multiprocessing
+import shutil
+import tempfile
+from threading import Thread
+from time import time
+
+from logserver import LogRecordSocketReceiver
+from sprout.log import JSONSocketHandler
+
+HANDLERS = {'json': JSONSocketHandler, 'pickle': logging.handlers.SocketHandler}
+
+
+def send(options):
+    """Logs the records of one sender, returns the latencies of the logging calls"""
+    framing, host, port, sender, args = options
+    handler = HANDLERS[framing](host, port)
+    loggers = []
+    for n in range(args.loggers):
+        logger = logging.Logger('loadtest.logger{}'.format(n))
+        logger.addHandler(handler)
+        loggers.append(logger)
+    latencies = []
+    try:
+        for n in range(args.records):
+            logger = loggers[n % len(loggers)]
+            start = time()
+            logger.info('Appliance %s of pool %d changed its state to %s', 'sprout-vm', n, 'ready')
+            latencies.append(time() - start)
+    finally:
+        handler.close()
+    return latencies
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(framing, args):
+    # Forked before the server starts, the senders do not inherit its socket and threads
+    pool = multiprocessing.Pool(args.senders)
+    server = logs_path = None
+    host, port = args.host, args.port
+    if port is None:
+        logs_path = tempfile.mkdtemp(prefix='logserver-load-')
+        server = LogRecordSocketReceiver(host=host, port=0, logs_path=logs_path)
+        port = server.server_address[1]
+        serving = Thread(target=server.serve_until_stopped)
+        serving.start()
+    try:
+        start = time()
+        results = pool.map(send, [(framing, host, port, n, args) for n in range(args.senders)])
+        if server is not None:
+            server.writer.queue.join()
+        elapsed = time() - start
+    finally:
+        pool.close()
+        if server is not None:
+            server.abort = 1
+            serving.join()
+            server.server_close()
+            shutil.rmtree(logs_path)
+    latencies = sorted(latency for result in results for latency in result)
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--senders', type=int, default=24, help='sender processes')
+    parser.add_argument('--records', type=int, default=5000, help='records each sender logs')
+    parser.add_argument('--loggers', type=int, default=20, help='loggers each sender logs into')
+    parser.add_argument('--framing', nargs='+', choices=sorted(HANDLERS),
+        default=sorted(HANDLERS), help='how the records are sent')
+    parser.add_argument('--host', default='localhost', help='host of the log server')
+    parser.add_argument('--port', type=int, default=None,
+        help='port of a running log server, one is started here if not given')
+    args = parser.parse_args()
+
+    for framing in args.framing:
+        records_per_sec, p50, p99 = run(framing, args)
+        print('{:>6}: {:.0f} records/sec, p50 enqueue {:.3f} ms, p99 enqueue {:.3f} ms'.format(
+            framing, records_per_sec, p50 * 1000, p99 * 1000))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""Benchmarks reading the metadata of Sprout objects, as YAML and as JSON
+
+Listing appliances reads the metadata of their providers (the provider API is built from the
+``provider_data`` in it) a few times per appliance. This runs that access pattern over metadata
+shaped like a provider's (``provider_data`` and the list of templates) in three modes:
+
+- ``yaml``: parsed with ``yaml.load`` on every access, like the metadata used to be
+- ``json``: parsed with ``json.loads`` on every access
+- ``json-cached``: parsed with ``json.loads`` once per loaded object, like
+  :py:attr:`appliances.models.MetadataMixin.metadata` does now
+
+Usage: ./metadata_bench.py [--appliances 1000] [--templates 300] [--accesses 3]
+
+"""
+import argparse
+import json
+from time import time
+
+import yaml
+
+
+def provider_metadata(num_templates):
+    return {
+        'provider_data': {
+            'name': 'vsphere 6.5', 'type': 'virtualcenter', 'hostname': 'vsphere.example.com',
+            'ipaddress': '10.0.0.1', 'credentials': 'vsphere', 'datacenters': ['default'],
+            'sprout': {'datastore': 'datastore1', 'cluster': 'cluster1', 'host': 'host1'},
+            'use_for_sprout': True,
+        },
+        'templates': ['cfme-58{:04d}-{:04d}'.format(n, n * 7) for n in range(num_templates)],
+        'template_name_length': 40,
+    }
+
+
+class CachedMetadata(object):
+    """Stands in for a loaded model object, caching the parsed metadata like MetadataMixin"""
+    def __init__(self, object_meta_data):
+        self.object_meta_data = object_meta_data
+
+    @property
+    def metadata(self):
+        raw = self.object_meta_data
+        cached = self.__dict__.get('_metadata_cache')
+        if cached is None or cached[0] is not raw:
+            cached = self._metadata_cache = (raw, json.loads(raw))
+        return cached[1]
+
+
+def bench(mode, metadata, args):
+    if mode == 'yaml':
+        raw = yaml.dump(metadata)
+        read = yaml.load
+    else:
+        raw = json.dumps(metadata)
+        read = json.loads
+    start = time()
+    for _ in range(args.appliances):
+        # every appliance comes with its own template and provider objects from the database
+        loaded = CachedMetadata(raw)
+        for _ in range(args.accesses):
+            if mode == 'json-cached':
+                loaded.metadata.get('provider_data')
+            else:
+                read(loaded.object_meta_data).get('provider_data')
+    return time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appliances', type=int, default=1000, help='appliances listed')
+    parser.add_argument('--templates', type=int, default=300,
+        help='templates in the provider metadata')
+    parser.add_argument('--accesses', type=int, default=3,
+        help='metadata reads per listed appliance')
+    args = parser.parse_args()
+
+    metadata = provider_metadata(args.templates)
+    for mode in ('yaml', 'json', 'json-cached'):
+        elapsed = bench(mode, metadata, args)
+        print('{:>11}: {:.3f} s, {:.0f} appliances/sec'.format(
+            mode, elapsed, args.appliances / elapsed))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""Simulates how fast the shepherd fills the appliance pools after a new template lands
+
+Every group starts with an empty pool and a new template on a few providers. The shepherd runs
+every ``--interval`` seconds (like the ``free-appliance-shepherd`` beat task) and provisions on a
+fake provider API, whose clones take longer the more of them run on the provider at once. Two
+shepherds are compared:
+
+- ``single``: one appliance per group per run, on the least loaded free provider, like the
+  shepherd used to
+- ``batch``: all the missing appliances planned at once by
+  :py:func:`appliances.planner.plan_provisioning`
+
+and the time until each pool is full is reported.
+
+Usage (from the sprout directory): ./shepherd_sim.py [--groups 10] [--pool-size 8]
+
+"""
+import argparse
+import random
+from collections import namedtuple
+
+from appliances.planner import Demand, plan_provisioning
+
+SimTemplate = namedtuple('SimTemplate', ['group', 'provider_id'])
+
+
+class FakeProviderAPI(object):
+    """Provider cloning appliances, slower with every clone running on it at the same time"""
+    def __init__(self, name, clone_time, slowdown, rand):
+        self.name = name
+        self.clone_time = clone_time
+        self.slowdown = slowdown
+        self.rand = rand
+        self.clones = {}
+
+    def clone_template(self, vm_name, now):
+        duration = self.clone_time * (1 + self.slowdown * len(self.clones))
+        self.clones[vm_name] = now + duration * self.rand.uniform(0.8, 1.2)
+
+    def finished_clones(self, now):
+        finished = [name for name, done in self.clones.items() if done <= now]
+        for name in finished:
+            del self.clones[name]
+        return finished
+
+
+class SimCapacity(object):
+    """Capacity of a simulated provider, the same way :py:class:`ProviderCapacity` counts it"""
+    def __init__(self, num_simultaneous_provisioning, appliance_limit):
+        self.num_simultaneous_provisioning = num_simultaneous_provisioning
+        self.appliance_limit = appliance_limit
+        self.num_currently_provisioning = 0
+        self.num_currently_managing = 0
+
+    def add_appliance(self):
+        self.num_currently_provisioning += 1
+        self.num_currently_managing += 1
+
+    @property
+    def remaining_provisioning_slots(self):
+        result = max(self.num_simultaneous_provisioning - self.num_currently_provisioning, 0)
+        if self.appliance_limit is None:
+            return result
+        return min(max(self.appliance_limit - self.num_currently_managing, 0), result)
+
+    @property
+    def appliance_load(self):
+        if not self.appliance_limit:
+            return 0.0
+        return float(self.num_currently_managing) / float(self.appliance_limit)
+
+
+def plan_single(demands, capacities):
+    """One appliance per group, on the free provider with the lowest appliance load"""
+    plan = []
+    for demand in demands:
+        free = [
+            tpl for tpl in demand.templates
+            if capacities[tpl.provider_id].remaining_provisioning_slots > 0]
+        if free:
+            template = min(free, key=lambda tpl: capacities[tpl.provider_id].appliance_load)
+            capacities[template.provider_id].add_appliance()
+            plan.append((demand.key, template))
+    return plan
+
+
+def simulate(planner, args):
+    """Runs the shepherd until all pools are full or the time is up
+
+    Returns:
+        :py:class:`dict` of group to the time its pool got full
+    """
+    rand = random.Random(args.seed)
+    apis, capacities = {}, {}
+    for n in range(args.providers):
+        name = 'provider{}'.format(n)
+        apis[name] = FakeProviderAPI(
+            name, rand.uniform(*args.clone_time), args.slowdown, random.Random(rand.random()))
+        capacities[name] = SimCapacity(
+            rand.choice(args.provisioning_slots), rand.choice([None, args.appliance_limit]))
+    templates = {
+        group: [SimTemplate(group, provider) for provider in rand.sample(
+            sorted(apis), min(args.templates_per_group, args.providers))]
+        for group in range(args.groups)}
+    pools = {group: 0 for group in range(args.groups)}
+    provisioning = {}  # vm name: (group, provider)
+    full_at = {}
+    now = vm_counter = 0
+    while len(full_at) < args.groups and now < args.max_hours * 3600:
+        for name, api in apis.items():
+            for vm_name in api.finished_clones(now):
+                group, _ = provisioning.pop(vm_name)
+                capacities[name].num_currently_provisioning -= 1
+                pools[group] += 1
+        for group, size in pools.items():
+            if size >= args.pool_size and group not in full_at:
+                full_at[group] = now
+        in_flight = {}
+        for group, _ in provisioning.values():
+            in_flight[group] = in_flight.get(group, 0) + 1
+        # Emptiest pools first, like the shepherd sorts the groups by fulfillment
+        demands = [
+            Demand(group, args.pool_size - pools[group] - in_flight.get(group, 0), templates[group])
+            for group in sorted(pools, key=lambda group: pools[group])]
+        for group, template in planner(demands, capacities):
+            vm_counter += 1
+            vm_name = 'vm{}'.format(vm_counter)
+            apis[template.provider_id].clone_template(vm_name, now)
+            provisioning[vm_name] = (group, template.provider_id)
+        now += args.interval
+    return full_at
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, default=10, help='number of shepherd groups')
+    parser.add_argument('--pool-size', type=int, default=8, help='appliances per group pool')
+    parser.add_argument('--providers', type=int, default=8, help='number of providers')
+    parser.add_argument('--templates-per-group', type=int, default=4,
+        help='number of providers having the template of a group')
+    parser.add_argument('--provisioning-slots', type=int, nargs='+', default=[2, 4, 8],
+        help='num_simultaneous_provisioning values the providers get')
+    parser.add_argument('--appliance-limit', type=int, default=40,
+        help='appliance_limit of the providers that have one')
+    parser.add_argument('--clone-time', type=float, nargs=2, default=[300, 900], metavar='SEC',
+        help='range of the time one clone takes on a provider')
+    parser.add_argument('--slowdown', type=float, default=0.1,
+        help='relative slowdown of a clone for each clone running on the provider')
+    parser.add_argument('--interval', type=int, default=30, help='seconds between shepherd runs')
+    parser.add_argument('--max-hours', type=int, default=24, help='time to simulate at most')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the simulated setup')
+    args = parser.parse_args()
+
+    for mode, planner in (('single', plan_single), ('batch', plan_provisioning)):
+        full_at = simulate(planner, args)
+        times = sorted(full_at.values())
+        if len(times) < args.groups:
+            print('{:>6}: {} of {} pools full after {} hours'.format(
+                mode, len(times), args.groups, args.max_hours))
+            continue
+        print('{:>6}: all pools full after {:.0f} min, median pool full after {:.0f} min'.format(
+            mode, times[-1] / 60.0, times[len(times) // 2] / 60.0))
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import atexit
+import json
 import logging
 import logging.handlers
+import struct
 from threading import Lock
 
 import inspect
@@ -15,6 +17,28 @@ logger_cache_lock = Lock()
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+#: Fields of the records sent to the logserver by :py:class:`JSONSocketHandler`
+RECORD_FIELDS = ['name', 'levelno', 'levelname', 'pathname', 'lineno', 'created', 'msecs']
+
+
+class JSONSocketHandler(logging.handlers.SocketHandler):
+    """Sends the records to the logserver as JSON instead of pickles.
+
+    The frame is the same 4-byte length prefix followed by a JSON object, which carries only the
+    fields the log files use. The message is formatted here, with the traceback appended to it.
+    """
+    def makePickle(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+        if record.exc_text:
+            message = message + "\n" + record.exc_text
+        data = {field: getattr(record, field) for field in RECORD_FIELDS}
+        data['msg'] = message
+        payload = json.dumps(data, separators=(',', ':'))
+        return struct.pack(">L", len(payload)) + payload
+
 
 class LogWrapperForObject(object):
     """This class masks the logger in order to print out the id of the object to identify it.
@@ -82,7 +106,7 @@ def create_logger(o, additional_id=None):
         if None not in logger_cache:
             logger = logging.getLogger()
             logger.setLevel(logging.INFO)
-            socket_handler = logging.handlers.SocketHandler(
+            socket_handler = JSONSocketHandler(
                 "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT)
             atexit.register(socket_handler.close)
             logger.addHandler(socket_handler)
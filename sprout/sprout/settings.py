@@ -164,6 +164,12 @@ ORPHANED_APPLIANCE_GRACE_TIME = dict(
     minutes=45,
 )
 
+# Long-polling API calls (wait_for_pool) hold a web worker each, so only a few may wait at once.
+# They must return well within gunicorn's worker timeout (30s by default) or the worker is killed.
+LONG_POLL_LIMIT = int(os.environ.get("LONG_POLL_LIMIT", 2))
+LONG_POLL_MAX_TIMEOUT = 20
+LONG_POLL_INTERVAL = 2
+
 # Celery beat
 CELERYBEAT_SCHEDULE = {
     'check-templates': {
@@ -25,6 +25,7 @@ from utils import conf, datafile, db, ssh, ports
 from utils.datafile import load_data_file
 from utils.events import EventListener
 from utils.log import logger, create_sublogger, logger_wrap
+from utils.metrics import record_rest_response
 from utils.net import net_check, resolve_hostname
 from utils.path import data_path, patches_path, scripts_path, conf_path
 from utils.version import Version, get_stream, pick, LATEST
@@ -571,6 +572,39 @@ class IPAppliance(object):
         """
         return [ems.name for ems in self._list_ems()]
 
+    def existing_providers(self, providers):
+        """Returns those of the given provider crud objects which are set up on the appliance
+
+        All of them are looked up in one DB query, instead of one per provider as with
+        ``provider.exists``. The order of ``providers`` is kept.
+
+        Note:
+            Recognized by name only, like ``provider.exists``.
+        """
+        names = set(self.managed_provider_names)
+        return [provider for provider in providers if provider.name in names]
+
+    def delete_providers(self, providers, num_sec=1000, delay=5):
+        """Deletes the given providers in one REST request and waits for all of them to disappear
+
+        Providers that are not set up on the appliance are ignored.
+
+        Args:
+            providers: Provider crud objects
+            num_sec: How long to wait for all of them to be gone
+            delay: Delay between the checks, each of them one DB query for all the providers
+        """
+        names = {provider.name for provider in providers}
+        collection = self.rest_api.collections.providers
+        collection.reload()
+        to_delete = [prov for prov in collection.all if prov.name in names]
+        if not to_delete:
+            return
+        self.log.info('Deleting providers: %s', ', '.join(prov.name for prov in to_delete))
+        collection.action.delete(*to_delete)
+        wait_for(lambda: not self.existing_providers(providers), num_sec=num_sec, delay=delay,
+                 message='providers {} to disappear'.format(', '.join(sorted(names))))
+
     def check_no_conflicting_providers(self):
         """ Checks that there are no conflicting providers set up on the appliance
 
@@ -656,11 +690,13 @@ class IPAppliance(object):
 
     @cached_property
     def rest_api(self):
-        return MiqApi(
+        api = MiqApi(
             "{}://{}:{}/api".format(self.scheme, self.address, self.ui_port),
             (conf.credentials['default']['username'], conf.credentials['default']['password']),
             logger=self.rest_logger,
             verify_ssl=False)
+        api._session.hooks['response'].append(record_rest_response)
+        return api
 
     @cached_property
     def miqqe_version(self):
@@ -5,6 +5,7 @@ from jsmin import jsmin
 from inspect import isclass
 
 from utils.log import logger, create_sublogger
+from utils.metrics import metrics
 from cfme import exceptions
 from cfme.fixtures.pytest_selenium import get_rails_error
 from time import sleep
@@ -402,7 +403,12 @@ class CFMENavigateStep(NavigateStep):
             self.check_for_badness(self.resetter, _tries, nav_args, *args, **kwargs)
         self.check_for_badness(self.post_navigate, _tries, nav_args, *args, **kwargs)
         view = self.view if self.VIEW is not None else None
-        duration = int((time.time() - start_time) * 1000)
+        elapsed = time.time() - start_time
+        metrics.histogram(
+            'cfme_navigation_seconds', help='Time taken by navigate_to, by destination',
+            obj=self.obj.__name__ if isclass(self.obj) else self.obj.__class__.__name__,
+            destination=self._name, here=bool(here)).observe(elapsed)
+        duration = int(elapsed * 1000)
         self.log_message(self.construst_message(here, resetter_used, view, duration), level="info")
         return view
 
@@ -1,16 +1,181 @@
 # -*- coding: utf-8 -*-
+import json
+import os
 import re
+import tempfile
 from bugzilla import Bugzilla as _Bugzilla
 from collections import Sequence
+from contextlib import contextmanager
+from time import time
 
 from cached_property import cached_property
+from utils import at_exit
 from utils.conf import cfme_data, credentials
 from utils.log import logger
+from utils.path import log_path, project_path
 from utils.version import (
     LATEST, Version, current_version, appliance_build_datetime, appliance_is_downstream)
 
 NONE_FIELDS = {"---", "undefined", "unspecified"}
 
+#: Fields of the bugs kept in the :py:class:`BugCache`, along with the loose ones and the first
+#: comment. Other fields are fetched when asked for, see :py:class:`CachedBug`.
+CACHED_FIELDS = (
+    "id", "status", "resolution", "dupe_of", "blocks", "depends_on", "version",
+    "target_release", "fixed_in", "flags", "product", "component", "summary", "qa_whiteboard",
+    "keywords", "assigned_to")
+#: Bugs fetched by one ``Bug.get`` call
+FETCH_BATCH_SIZE = 200
+#: Seconds the cached bugs are used for, unless ``bugzilla/cache_ttl`` says otherwise
+DEFAULT_CACHE_TTL = 3600
+#: Seconds the entries of single misses wait for before :py:class:`BugCache` writes them
+CACHE_SAVE_INTERVAL = 60
+DEFAULT_CACHE_FILE = log_path.join("bugzilla_cache.json").strpath
+
+
+def bug_data(bug, fields):
+    """The fields of a python-bugzilla ``Bug`` that the :py:class:`BugCache` keeps"""
+    data = {}
+    for field in fields:
+        value = getattr(bug, field, None)
+        if field == "flags":
+            value = [{"name": flag["name"], "status": flag.get("status")} for flag in value or []]
+        data[field] = value
+    comments = getattr(bug, "comments", None) or []
+    data["comments"] = [{"text": comments[0]["text"]}] if comments else []
+    return data
+
+
+class CachedBug(object):
+    """Stands in for the python-bugzilla ``Bug`` of the data in the :py:class:`BugCache`
+
+    Fields that are not kept in the cache are taken from the full bug, which is fetched the first
+    time one of them is asked for.
+    """
+    def __init__(self, bugzilla, data):
+        self._bugzilla = bugzilla
+        self._full_bug = None
+        self.__dict__.update(data)
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if self._full_bug is None:
+            self._full_bug = self._bugzilla.bugzilla.getbug(self.id)
+        return getattr(self._full_bug, attr)
+
+    def __repr__(self):
+        return "<CachedBug #{} - {}>".format(self.id, self.status)
+
+    def __str__(self):
+        return "#{} {:<14} - {} - {}".format(self.id, self.status, self.assigned_to, self.summary)
+
+
+class BugCache(object):
+    """Bugs and products fetched from Bugzilla, kept in a JSON file for ``ttl`` seconds
+
+    All the processes of a test run share the file: everything one of them fetches is merged into
+    it, so the slaves of a parallel run use the bugs the master fetched when it collected the tests.
+
+    The file is written once per :py:meth:`batch`. Entries updated outside of a batch are written
+    with the next batch, ``save_interval`` seconds after the last write at the latest, or when the
+    process exits.
+
+    Args:
+        path: The file, nothing is kept on disk if ``None``
+        ttl: Seconds an entry is used for after it was fetched
+        save_interval: Seconds the entries updated outside of a batch may wait to be written
+    """
+    SECTIONS = ("bugs", "products")
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL, save_interval=CACHE_SAVE_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.save_interval = save_interval
+        self.entries = {section: {} for section in self.SECTIONS}
+        self.dirty = False
+        self._batches = 0
+        self._saved = time()
+        self._merge(self._read())
+        if path:
+            at_exit(self.flush)
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning("Could not read the Bugzilla cache %s: %s", self.path, e)
+            return {}
+
+    def _merge(self, content):
+        """Takes the entries of ``content`` which are fresher than ours"""
+        for section in self.SECTIONS:
+            entries = self.entries[section]
+            for key, entry in content.get(section, {}).items():
+                if key not in entries or entries[key]["fetched"] < entry["fetched"]:
+                    entries[key] = entry
+
+    def get(self, section, key):
+        """The data of the entry, ``None`` if there is no fresh one"""
+        entry = self.entries[section].get(str(key))
+        if entry is None or time() - entry["fetched"] >= self.ttl:
+            return None
+        return entry["data"]
+
+    def update(self, section, data):
+        """Stores ``{key: data}``, the file is written at the end of the batch or deferred"""
+        now = time()
+        for key, value in data.items():
+            self.entries[section][str(key)] = {"fetched": now, "data": value}
+        self.dirty = True
+        if not self._batches and now - self._saved >= self.save_interval:
+            self.save()
+
+    @contextmanager
+    def batch(self):
+        """Writes the file once, when the outermost batch ends, if anything was updated"""
+        self._batches += 1
+        try:
+            yield self
+        finally:
+            self._batches -= 1
+            if not self._batches:
+                self.flush()
+
+    def flush(self):
+        """Writes the file if there are entries it does not have yet"""
+        if self.dirty:
+            self.save()
+
+    def save(self):
+        self.dirty = False
+        self._saved = time()
+        if not self.path:
+            return
+        self._merge(self._read())
+        now = time()
+        content = {
+            section: {
+                key: entry for key, entry in self.entries[section].items()
+                if now - entry["fetched"] < self.ttl}
+            for section in self.SECTIONS}
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Written aside and renamed, so the other processes never read a partial file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".bugzilla_cache")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(content, f, default=str)
+            os.rename(temp_path, self.path)
+        except Exception:
+            logger.exception("Could not write the Bugzilla cache %s", self.path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
 
 class Product(object):
     def __init__(self, data):
@@ -48,6 +213,8 @@ class Product(object):
 class Bugzilla(object):
     def __init__(self, **kwargs):
         self.__product = kwargs.pop("product", None)
+        self.__cache_file = kwargs.pop("cache_file", None)
+        self.__cache_ttl = kwargs.pop("cache_ttl", DEFAULT_CACHE_TTL)
         self.__kwargs = kwargs
         self.__bug_cache = {}
         self.__product_cache = {}
@@ -66,7 +233,11 @@ class Bugzilla(object):
 
     def product(self, product):
         if product not in self.__product_cache:
-            self.__product_cache[product] = self.products(product)[0]
+            data = self.cache.get("products", product)
+            if data is None:
+                data = self.products(product)[0]._data
+                self.cache.update("products", {product: data})
+            self.__product_cache[product] = Product(data)
         return self.__product_cache[product]
 
     @property
@@ -84,14 +255,26 @@ class Bugzilla(object):
         cr_root = cfme_data.get("bugzilla", {}).get("credentials", None)
         username = credentials.get(cr_root, {}).get("username", None)
         password = credentials.get(cr_root, {}).get("password", None)
+        cache_file = cfme_data.get("bugzilla", {}).get("cache_file", None)
         return cls(
             url=url, user=username, password=password, cookiefile=None,
-            tokenfile=None, product=product)
+            tokenfile=None, product=product,
+            cache_file=os.path.join(project_path.strpath, cache_file) if cache_file
+            else DEFAULT_CACHE_FILE,
+            cache_ttl=cfme_data.get("bugzilla", {}).get("cache_ttl", DEFAULT_CACHE_TTL))
 
     @cached_property
     def bugzilla(self):
         return _Bugzilla(**self.__kwargs)
 
+    @cached_property
+    def cache(self):
+        return BugCache(self.__cache_file, self.__cache_ttl)
+
+    @cached_property
+    def cached_fields(self):
+        return CACHED_FIELDS + tuple(field for field in self.loose if field not in CACHED_FIELDS)
+
     @cached_property
     def loose(self):
         return cfme_data.get("bugzilla", {}).get("loose", [])
@@ -110,9 +293,84 @@ class Bugzilla(object):
     def get_bug(self, id):
         id = int(id)
         if id not in self.__bug_cache:
-            self.__bug_cache[id] = BugWrapper(self, self.bugzilla.getbug(id))
+            data = self.cache.get("bugs", id)
+            if data is None:
+                data = bug_data(self.bugzilla.getbug(id), self.cached_fields)
+                self.cache.update("bugs", {id: data})
+            self.__bug_cache[id] = BugWrapper(self, CachedBug(self, data))
         return self.__bug_cache[id]
 
+    def fetch_bugs(self, ids):
+        """Gets the bugs that are not cached yet, in as few ``Bug.get`` calls as possible
+
+        Bugs that can't be fetched are left out, :py:meth:`get_bug` raises for them.
+
+        Returns:
+            The number of ``Bug.get`` calls made
+        """
+        with self.cache.batch():
+            return self._fetch_bugs(ids)
+
+    def _fetch_bugs(self, ids):
+        missing = []
+        for id in set(map(int, ids)):
+            if id in self.__bug_cache:
+                continue
+            data = self.cache.get("bugs", id)
+            if data is None:
+                missing.append(id)
+            else:
+                self.__bug_cache[id] = BugWrapper(self, CachedBug(self, data))
+        fetched = {}
+        for start in range(0, len(missing), FETCH_BATCH_SIZE):
+            for bug in self.bugzilla.getbugs(missing[start:start + FETCH_BATCH_SIZE]):
+                if bug is not None:
+                    fetched[bug.id] = bug_data(bug, self.cached_fields)
+        if fetched:
+            self.cache.update("bugs", fetched)
+        for id, data in fetched.items():
+            self.__bug_cache[id] = BugWrapper(self, CachedBug(self, data))
+        return (len(missing) + FETCH_BATCH_SIZE - 1) // FETCH_BATCH_SIZE
+
+    def prefetch(self, ids):
+        """Fetches the bugs and all the bugs :py:meth:`get_bug_variants` gets to from them
+
+        The graph of copies and duplicates is fetched a level at a time, each level in batches.
+
+        Returns:
+            The number of ``Bug.get`` calls made
+        """
+        with self.cache.batch():
+            return self._prefetch(ids)
+
+    def _prefetch(self, ids):
+        calls = 0
+        expanded = set([])
+        level = set(map(int, ids))
+        while level:
+            calls += self._fetch_bugs(level)
+            expanded.update(level)
+            next_level = set([])
+            copy_candidates = set([])
+            for id in level:
+                bug = self.__bug_cache.get(id)
+                if bug is None:
+                    continue
+                if bug.status == "CLOSED" and bug.resolution == "DUPLICATE":
+                    if bug.dupe_of:
+                        next_level.add(int(bug.dupe_of))
+                    continue
+                if bug.copy_of:
+                    next_level.add(bug.copy_of)
+                copy_candidates.update((id, int(blocked)) for blocked in bug._bug.blocks)
+            calls += self._fetch_bugs(blocked for _, blocked in copy_candidates)
+            for id, blocked in copy_candidates:
+                bug = self.__bug_cache.get(blocked)
+                if bug is not None and bug.copy_of == id:
+                    next_level.add(blocked)
+            level = next_level - expanded
+        return calls
+
     def get_bug_variants(self, id):
         if isinstance(id, BugWrapper):
             bug = id
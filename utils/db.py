@@ -3,7 +3,7 @@ from contextlib import contextmanager
 from itertools import izip
 
 from cached_property import cached_property
-from sqlalchemy import MetaData, create_engine, event, inspect
+from sqlalchemy import MetaData, create_engine, event, inspect, text
 from sqlalchemy.exc import ArgumentError, DisconnectionError, InvalidRequestError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -250,6 +250,38 @@ class Db(Mapping):
         """
         self.metadata.reflect(only=[table_name])
 
+    def count_by_ems(self, names, counts):
+        """Makes counts related to each of the named providers, all of them in one query
+
+        Args:
+            names: Names of the providers (``ext_management_systems.name``)
+            counts: ``{key: sql}`` of the counts to make; each is a ``SELECT count(...)`` of the
+                rows of one provider, which is the ``ems`` row of ``ext_management_systems``.
+                :py:func:`ems_count` makes the usual ones.
+
+        Returns: ``{name: {key: count}}``; providers that are not in the DB are left out
+
+        Usage:
+
+            db.count_by_ems(['vSphere 6', 'RHEV 4'], {
+                'num_host': ems_count('hosts'),
+                'num_template': ems_count('vms', 'vms.template = true')})
+
+        """
+        names, keys = list(names), list(counts)
+        if not names:
+            return {}
+        columns = ''.join(
+            ', ({}) AS count_{}'.format(counts[key], i) for i, key in enumerate(keys))
+        params = {'name_{}'.format(i): name for i, name in enumerate(names)}
+        query = text(
+            'SELECT ems.name AS name{} FROM ext_management_systems ems '
+            'WHERE ems.name IN ({})'.format(
+                columns, ', '.join(':{}'.format(param) for param in sorted(params))))
+        return {
+            row['name']: {key: int(row['count_{}'.format(i)]) for i, key in enumerate(keys)}
+            for row in self.engine.execute(query, **params)}
+
     def _table(self, table_name):
         """Retrieves, reflects, and caches table objects
 
@@ -275,6 +307,19 @@ class Db(Mapping):
                 return None
 
 
+def ems_count(table, condition=None):
+    """SQL counting the rows of ``table`` of a provider, for :py:meth:`Db.count_by_ems`
+
+    Args:
+        table: Name of a table with an ``ems_id`` column; e.g. 'vms' or 'hosts'
+        condition: SQL condition the counted rows have to meet as well
+    """
+    sql = 'SELECT count(*) FROM {0} WHERE {0}.ems_id = ems.id'.format(table)
+    if condition is not None:
+        sql += ' AND {}'.format(condition)
+    return sql
+
+
 @contextmanager
 def database_on_server(hostname, **kwargs):
     db_obj = Db(hostname=hostname, **kwargs)
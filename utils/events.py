@@ -6,11 +6,11 @@
 
 from cached_property import cached_property
 from contextlib import contextmanager
-from collections import Iterable
+from collections import Iterable, defaultdict
 from datetime import datetime
 from numbers import Number
+from select import select
 from sqlalchemy.sql.expression import func
-from time import sleep
 from threading import Thread, Event as ThreadEvent
 
 from utils.log import create_sublogger
@@ -51,6 +51,12 @@ class EventTool(object):
                        if tbl.name == 'event_streams'][-1]
         return [(cl.name, cl.type.python_type) for cl in event_table.c.values()]
 
+    @cached_property
+    def default_event_attrs(self):
+        """Empty :py:class:`EventAttr` of every ``event_streams`` column, by column name"""
+        return {attr_name: EventAttr(**{attr_name: None, 'attr_type': attr_type})
+                for attr_name, attr_type in self.event_streams_attributes}
+
     def query(self, *args, **kwargs):
         """Wrapper for the SQLAlchemy query method."""
         return self.appliance.db.session.query(*args, **kwargs)
@@ -210,11 +216,13 @@ class Event(object):
         return "BaseEvent({})".format(params)
 
     def _populate_defaults(self):
-        for attr_name, attr_type in self._tool.event_streams_attributes:
-            self._default_attrs[attr_name] = EventAttr(**{attr_name: None, 'attr_type': attr_type})
+        # the defaults are only read, so all events share them
+        self._default_attrs = self._tool.default_event_attrs
 
     def _parse_raw_event(self, evt):
-        for attr in self._default_attrs:
+        # a query for some of the columns returns rows with just those columns
+        attrs = evt.keys() if hasattr(evt, 'keys') else self._default_attrs
+        for attr in attrs:
             default_type = self._default_attrs[attr].type
             evt_value = getattr(evt, attr)
             evt_type = type(evt_value)
@@ -229,7 +237,7 @@ class Event(object):
             self.add_attrs(EventAttr(**{attr: evt_value}))
 
     def _is_raw_event(self, evt):
-        return evt.__tablename__ == 'event_streams'
+        return hasattr(evt, 'keys') or getattr(evt, '__tablename__', None) == 'event_streams'
 
     def matches(self, evt):
         """
@@ -278,7 +286,8 @@ class Event(object):
 
     def build_from_raw_event(self, evt):
         """
-        helper method which takes raw event from event_streams and prepares event object
+        helper method which takes raw event from event_streams and prepares event object.
+        the raw event is either an event_streams object or a row with some of its columns
         """
         # checking is this param - raw event, populating fields by this data then
         if self._is_raw_event(evt):
@@ -290,29 +299,83 @@ class EventListener(Thread):
     """
      accepts "expected" events, listens to db events and compares showed up events with expected
      events. Runs callback function if expected events have it.
+
+     new events are picked up as soon as postgres notifies the listener about them (LISTEN/NOTIFY,
+     with a trigger on event_streams created by the listener and dropped again when it stops).
+     every listener has a trigger and a channel of its own, named after the backend pid of its
+     connection, so that the triggers of listeners which were killed can be told apart and dropped.
+     while no events come, the listener also polls, backing off from POLL_MIN to POLL_MAX seconds.
+
+     only the event_streams columns used by the expected events are queried, so the events passed
+     to the callbacks only have those attributes (and id, event_type, target_type and target_id).
+    """
+    #: prefix of the channel the event_streams trigger notifies about new events
+    NOTIFY_CHANNEL = 'cfme_tests_event_streams'
+    #: shortest and longest time between two polls, in seconds
+    POLL_MIN = 0.2
+    POLL_MAX = 3.0
+    #: attributes always queried, the expected events are indexed by the last two
+    BASE_ATTRS = ('id', 'target_id', 'event_type', 'target_type')
+
+    _NOTIFY_SQL = """
+        CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{channel}', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS {channel}_notify ON event_streams;
+        CREATE TRIGGER {channel}_notify AFTER INSERT ON event_streams
+            FOR EACH STATEMENT EXECUTE PROCEDURE {channel}_notify();
+        LISTEN {channel};
+    """
+    _UNNOTIFY_SQL = """
+        DROP TRIGGER IF EXISTS {channel}_notify ON event_streams;
+        DROP FUNCTION IF EXISTS {channel}_notify();
+    """
+    # drops the triggers of listeners whose connection is gone, the backend pid is in the name
+    _STALE_SQL = r"""
+        DO $$
+        DECLARE
+            stale record;
+        BEGIN
+            FOR stale IN
+                SELECT tgname FROM pg_trigger
+                WHERE tgrelid = 'event_streams'::regclass
+                    AND tgname ~ '^{prefix}_[0-9]+_notify$'
+                    AND substring(tgname from '_([0-9]+)_notify$')::int NOT IN (
+                        SELECT pid FROM pg_stat_activity)
+            LOOP
+                EXECUTE format('DROP TRIGGER IF EXISTS %I ON event_streams', stale.tgname);
+                EXECUTE format('DROP FUNCTION IF EXISTS %I()', stale.tgname);
+            END LOOP;
+        END $$;
     """
+
     def __init__(self, appliance):
         super(EventListener, self).__init__()
         self._appliance = appliance
         self._tool = EventTool(self._appliance)
 
         self._events_to_listen = []
+        # expected events by (event_type, target_type), None standing for any value
+        self._events_index = {}
+        self._columns = self.BASE_ATTRS
         # last_id is used to ignore already arrived messages the database
         # When database is "cleared" the id of the last event is placed here. That is then used
         # in queries to prevent events of this id and earlier to get in.
         self._last_processed_id = None
         self._stop_event = ThreadEvent()
+        # set by _listen, unique to the listener
+        self._channel = None
 
     def set_last_record(self, evt=None):
         if evt:
             self._last_processed_id = evt.event_attrs['id'].value
         else:
-            try:
-                self._last_processed_id = self._tool.query(
-                    func.max(self._tool.event_streams.id)).one()
-            except IndexError:
-                # No events yet, so do nothing
-                pass
+            # no events yet means every event is new
+            self._last_processed_id = self._tool.query(
+                func.max(self._tool.event_streams.id)).scalar() or 0
 
     def new_event(self, *attrs, **kwattrs):
         """
@@ -371,6 +434,39 @@ class EventListener(Thread):
                     raise ValueError("one of events doesn't belong to Event class")
         else:
             raise ValueError('incorrect is passed')
+        self._update_index()
+
+    @staticmethod
+    def _index_key(event, attr_name):
+        # an attribute compared by a function or not set can match any value
+        attr = event.event_attrs.get(attr_name)
+        if attr is None or attr.cmp_func or not attr.value:
+            return None
+        return attr.value
+
+    def _update_index(self):
+        """Indexes the expected events and works out the columns they need"""
+        index = defaultdict(list)
+        columns = set(self.BASE_ATTRS)
+        for position, exp_event in enumerate(self._events_to_listen):
+            event = exp_event['event']
+            key = (self._index_key(event, 'event_type'), self._index_key(event, 'target_type'))
+            index[key].append((position, exp_event))
+            columns.update(attr for attr in event.event_attrs if attr != 'target_name')
+        # the listener thread reads these, so they are replaced and never changed
+        self._events_index = dict(index)
+        self._columns = tuple(sorted(columns))
+
+    def _expected_events_for(self, got_event):
+        """Expected events which can match the event, in the order they were added"""
+        index = self._events_index
+        event_type = got_event.event_attrs['event_type'].value
+        target_type = got_event.event_attrs['target_type'].value
+        candidates = []
+        for key in {(event_type, target_type), (event_type, None), (None, target_type),
+                    (None, None)}:
+            candidates.extend(index.get(key, ()))
+        return [exp_event for position, exp_event in sorted(candidates)]
 
     def start(self):
         logger.info('Event Listener has been started')
@@ -389,31 +485,92 @@ class EventListener(Thread):
     def started(self):
         return super(EventListener, self).is_alive()
 
+    def _listen(self):
+        """Starts listening to notifications about new events
+
+        Returns:
+            A raw database connection getting the notifications, or ``None`` if notifications
+            can't be used (not a postgres database, or the trigger can't be created).
+        """
+        engine = self._appliance.db.engine
+        if engine.dialect.name != 'postgresql':
+            return None
+        connection = engine.raw_connection()
+        try:
+            # LISTEN only takes effect once committed, so the connection has to autocommit
+            connection.connection.set_isolation_level(0)
+            cursor = connection.cursor()
+            cursor.execute('SELECT pg_backend_pid()')
+            self._channel = '{}_{}'.format(self.NOTIFY_CHANNEL, cursor.fetchone()[0])
+            cursor.execute(self._STALE_SQL.format(prefix=self.NOTIFY_CHANNEL))
+            cursor.execute(self._NOTIFY_SQL.format(channel=self._channel))
+            cursor.close()
+        except Exception as e:
+            logger.warning('Not listening to event notifications, polling instead: %s', e)
+            # in case the trigger was created before the failure
+            self._unlisten(connection)
+            return None
+        return connection
+
+    def _wait_for_events(self, connection, timeout):
+        """Waits for a notification about new events, or until the timeout passes"""
+        if connection is None:
+            self._stop_event.wait(timeout)
+            return
+        if select([connection.connection], [], [], timeout)[0]:
+            connection.connection.poll()
+            del connection.connection.notifies[:]
+
     def process_events(self):
         """
         processes all new db events and compares them with expected events.
         processed events are ignored next time
         """
-        while not self._stop_event.is_set():
-            events = self.get_next_portion()
-            if len(events) == 0:
-                sleep(0.2)
+        connection = self._listen()
+        poll_interval = self.POLL_MIN
+        try:
+            while not self._stop_event.is_set():
+                events = self.get_next_portion()
+                if len(events) == 0:
+                    # a notification cuts the wait short, the backoff covers lost notifications
+                    self._wait_for_events(connection, poll_interval)
+                    poll_interval = min(poll_interval * 2, self.POLL_MAX)
+                    continue
+                poll_interval = self.POLL_MIN
+                for got_event in events:
+                    self.process_event(got_event)
+                    if self._stop_event.is_set():
+                        break
+        finally:
+            if connection is not None:
+                self._unlisten(connection)
+
+    def _unlisten(self, connection):
+        """Drops the trigger and function created by :py:meth:`_listen` from the appliance"""
+        try:
+            if self._channel is not None:
+                cursor = connection.cursor()
+                cursor.execute(self._UNNOTIFY_SQL.format(channel=self._channel))
+                cursor.close()
+        except Exception as e:
+            logger.warning('Could not drop the event_streams notification trigger: %s', e)
+        finally:
+            # autocommit and listening, so not fit to go back to the pool
+            connection.invalidate()
+
+    def process_event(self, raw_event):
+        """compares a db event with the expected events and records it as processed"""
+        logger.debug("processing event id {}".format(raw_event.id))
+        got_event = Event(event_tool=self._tool).build_from_raw_event(raw_event)
+        for exp_event in self._expected_events_for(got_event):
+            if exp_event['first_event'] and len(exp_event['matched_events']) > 0:
                 continue
-            for got_event in events:
-                logger.debug("processing event id {}".format(got_event.id))
-                got_event = Event(event_tool=self._tool).build_from_raw_event(got_event)
-                for exp_event in self._events_to_listen:
-                    if exp_event['first_event'] and len(exp_event['matched_events']) > 0:
-                        continue
-
-                    if exp_event['event'].matches(got_event):
-                        if exp_event['callback']:
-                            exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
-                        exp_event['matched_events'].append(got_event)
-                self.set_last_record(got_event)
-
-                if self._stop_event.is_set():
-                    break
+
+            if exp_event['event'].matches(got_event):
+                if exp_event['callback']:
+                    exp_event['callback'](exp_event=exp_event['event'], got_event=got_event)
+                exp_event['matched_events'].append(got_event)
+        self.set_last_record(got_event)
 
     @property
     def got_events(self):
@@ -430,12 +587,15 @@ class EventListener(Thread):
 
     def reset_events(self):
         self._events_to_listen = []
+        self._update_index()
 
     def get_next_portion(self):
         logger.debug("obtaining next portion of events")
-        return self._tool.query(self._tool.event_streams)\
-            .filter(self._tool.event_streams.id > self._last_processed_id)\
-            .order_by(self._tool.event_streams.id).yield_per(100).all()
+        event_streams = self._tool.event_streams
+        columns = [getattr(event_streams, column) for column in self._columns]
+        return self._tool.query(*columns)\
+            .filter(event_streams.id > self._last_processed_id)\
+            .order_by(event_streams.id).yield_per(100).all()
 
     def check_expected_events(self):
         return all([len(event['matched_events']) for event in self.got_events])
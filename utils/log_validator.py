@@ -1,9 +1,124 @@
 import re
+import sre_constants
+import sre_parse
+import threading
+
 import pytest
 
 from ssh import SSHTail
 from utils.log import logger
 
+# Patterns that can't be combined with others: inline flags apply to the whole combined
+# regex and numbered backreferences would point to the wrong group
+_UNCOMBINABLE_RE = re.compile(r'\(\?[iLmsux]+\)|\\[1-9]|\(\?P=')
+
+
+def required_literal(pattern):
+    """Longest literal string every match of a pattern contains, or None
+
+    Only literals at the top level of the pattern count, anything in a group, a repeat or
+    an alternation may not be part of the match.
+    """
+    if _UNCOMBINABLE_RE.search(pattern):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    best = current = ''
+    for op, arg in parsed:
+        if op == sre_constants.LITERAL:
+            current += chr(arg)
+        else:
+            best, current = max(best, current, key=len), ''
+    return max(best, current, key=len) or None
+
+
+def literals_regex(literals):
+    """Regex searching for any of the literals, with common prefixes factored out
+
+    The alternatives are nested like a trie, so the regex engine tries the literals
+    sharing a prefix only once the prefix matched, instead of trying each literal at
+    every position of the line.
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        return '(?:{}){}'.format('|'.join(branches), '?' if '' in node else '')
+
+    return build(trie)
+
+
+class PatternMatcher(object):
+    """Matches lines against categorized patterns, scanning each line once
+
+    All patterns are combined into one regex, each of them in a named group, in priority
+    order. As with ``re.match``, the first pattern matching a line wins, so the patterns
+    before it don't match and only the ones after it are checked one by one. Those lines
+    are rare, most lines match none of the patterns.
+
+    If every pattern contains a literal string (like ``ERROR`` in ``.*ERROR.*``), the lines
+    are first searched for those literals with :py:func:`literals_regex`, which is much
+    faster than matching the patterns.
+
+    Args:
+        categories: List of ``(category, patterns)`` tuples, in priority order
+        stop_on: Category which, once matched, stops checking the other patterns
+    """
+
+    def __init__(self, categories, stop_on=None):
+        self.stop_on = stop_on
+        self.patterns = [
+            (category, pattern, re.compile(pattern))
+            for category, patterns in categories for pattern in patterns]
+        self._combined = None
+        self._prefilter = None
+        if not self.patterns or any(
+                _UNCOMBINABLE_RE.search(pattern) for _, pattern, _ in self.patterns):
+            return
+        try:
+            self._combined = re.compile('|'.join(
+                '(?P<p{}>{})'.format(i, pattern)
+                for i, (_, pattern, _) in enumerate(self.patterns)))
+        except (re.error, AssertionError):
+            # e.g. the same group name in two patterns, or too many groups
+            return
+        literals = [required_literal(pattern) for _, pattern, _ in self.patterns]
+        if all(literals):
+            # a line containing 'ERROR x' contains 'ERROR', so 'ERROR' is enough
+            literals = set(literals)
+            self._prefilter = re.compile(literals_regex([
+                literal for literal in literals
+                if not any(other in literal for other in literals if other != literal)]))
+
+    def match(self, line):
+        """Returns ``(category, pattern)`` tuples of the patterns matching the line"""
+        if self._prefilter is not None and not self._prefilter.search(line):
+            return []
+        start = 0
+        if self._combined is not None:
+            match = self._combined.match(line)
+            if match is None:
+                return []
+            start = int(match.lastgroup[1:])
+        matched = []
+        for category, pattern, regex in self.patterns[start:]:
+            if regex.match(line):
+                matched.append((category, pattern))
+                if category == self.stop_on:
+                    break
+        return matched
+
 
 class LogValidator(object):
     """
@@ -22,57 +137,101 @@ class LogValidator(object):
     to be possible to skip particular ERROR log,
     but fail for wider range of other ERRORs.
 
+    With ``monitor_interval``, new lines are checked in a background thread
+    while the test runs, so the log doesn't pile up until validate_logs.
+    Failures found meanwhile are reported by validate_logs. The thread runs
+    until validate_logs or stop_monitor is called, so call stop_monitor
+    when the test may end without validating the logs.
+
     Args:
         remote_filename: path to the remote log file
         skip_patterns: array of skip regex patterns
         failure_patterns: array of failure regex patterns
         matched_patterns: array of expected regex patterns to be matched
+        monitor_interval: seconds between checks of new lines during the test
+        prefilter: ERE passed to :py:class:`utils.ssh.SSHTail`, only lines matching it
+            are checked, so it has to cover the failure and matched patterns
 
     Usage:
         .. code-block:: python
           evm_tail = LogValidator('/var/www/miq/vmdb/log/evm.log',
                                   skip_patterns=['PARTICULAR_ERROR'],
                                   failure_patterns=['.*ERROR.*'],
-                                  matched_patterns=['PARTICULAR_INFO'])
+                                  matched_patterns=['PARTICULAR_INFO'],
+                                  monitor_interval=10)
           evm_tail.fix_before_start()
-          evm_tail.validate_logs()
+          try:
+              # the test
+              evm_tail.validate_logs()
+          finally:
+              evm_tail.stop_monitor()
     """
 
     def __init__(self, remote_filename, **kwargs):
         self.skip_patterns = kwargs.pop('skip_patterns', [])
         self.failure_patterns = kwargs.pop('failure_patterns', [])
         self.matched_patterns = kwargs.pop('matched_patterns', [])
+        self.monitor_interval = kwargs.pop('monitor_interval', None)
 
         self._remote_file_tail = SSHTail(remote_filename, **kwargs)
+        self._matcher = None
         self.matches = {}
+        self.failures = []
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._monitor_stop = threading.Event()
 
     def fix_before_start(self):
         self._remote_file_tail.set_initial_file_end()
+        if self.monitor_interval:
+            self._monitor_stop.clear()
+            self._monitor = threading.Thread(target=self._monitor_logs)
+            self._monitor.daemon = True
+            self._monitor.start()
+
+    def stop_monitor(self):
+        """Stops checking new lines in the background, if it was started"""
+        if self._monitor is not None:
+            self._monitor_stop.set()
+            self._monitor.join()
+            self._monitor = None
 
     def validate_logs(self):
-        for line in self._remote_file_tail:
-            if self._check_skip_logs(line):
-                continue
-            self._check_fail_logs(line)
-            self._check_match_logs(line)
+        self.stop_monitor()
+        # the last check, so the line still being written is checked as well
+        self._check_new_lines(final=True)
+        if self.failures:
+            pytest.fail(self.failures[0])
         self._verify_match_logs()
 
-    def _check_skip_logs(self, line):
-        for pattern in self.skip_patterns:
-            if re.match(pattern, line):
-                logger.info('Skip pattern {} was matched on line {},\
-                            so skipping this line'.format(pattern, line))
-                return True
-        return False
+    def _monitor_logs(self):
+        while not self._monitor_stop.wait(self.monitor_interval):
+            try:
+                self._check_new_lines()
+            except Exception:
+                # the lines are checked again by validate_logs
+                logger.exception('Could not check new lines of the log')
 
-    def _check_fail_logs(self, line):
-        for pattern in self.failure_patterns:
-            if re.match(pattern, line):
-                pytest.fail('Failure pattern {} was matched on line {}'.format(pattern, line))
+    def _check_new_lines(self, final=False):
+        with self._lock:
+            if self._matcher is None:
+                self._matcher = PatternMatcher([
+                    ('skip', self.skip_patterns),
+                    ('failure', self.failure_patterns),
+                    ('matched', self.matched_patterns)], stop_on='skip')
+            for line in self._remote_file_tail.raw_lines(final=final):
+                self._check_line(line.rstrip())
 
-    def _check_match_logs(self, line):
-        for pattern in self.matched_patterns:
-            if re.match(pattern, line):
+    def _check_line(self, line):
+        for category, pattern in self._matcher.match(line):
+            if category == 'skip':
+                logger.info('Skip pattern {} was matched on line {},\
+                            so skipping this line'.format(pattern, line))
+            elif category == 'failure':
+                logger.error('Failure pattern {} was matched on line {}'.format(pattern, line))
+                self.failures.append(
+                    'Failure pattern {} was matched on line {}'.format(pattern, line))
+            else:
                 logger.info('Expected pattern {} was matched on line {}'.format(pattern, line))
                 self.matches[pattern] = True
 
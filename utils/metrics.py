@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Metrics of the framework itself, recorded in-process during a test run
+
+The framework's own latencies (navigation, SSH commands, REST calls) are recorded into a
+:py:class:`Registry` of counters and histograms, which can be exported while the run goes on:
+
+- :py:class:`LineFileExporter` appends a snapshot of all the series to a file every few seconds,
+  one line per series in the influx line format
+- :py:class:`PrometheusExporter` serves the current values in the Prometheus text format
+
+Recording is always on, it only costs a lock and a few additions. The exporters are started by
+:py:mod:`fixtures.metrics`, with ``--metrics-file`` and ``--metrics-port``.
+
+Usage:
+
+    from utils.metrics import metrics
+
+    with metrics.timer('cfme_provider_refresh_seconds', provider=provider.key):
+        provider.refresh_provider_relationships()
+    metrics.counter('cfme_vms_provisioned_total').inc()
+
+"""
+import BaseHTTPServer
+import bisect
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+from urlparse import urlparse
+
+from utils.log import logger
+
+#: Upper bounds of the histogram buckets, in seconds, unless a histogram is given its own
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value, chars='\\"'):
+    value = unicode(value) if not isinstance(value, basestring) else value
+    for char in chars:
+        value = value.replace(char, '\\' + char)
+    return value.replace('\n', '\\n')
+
+
+class Counter(object):
+    """A value that only goes up, eg. the number of SSH commands that failed"""
+    kind = 'counter'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def fields(self):
+        return [('value', self.value)]
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Histogram(object):
+    """Distribution of observed values, counted in buckets of their upper bounds"""
+    kind = 'histogram'
+
+    def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # The last one counts the values above the highest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        """Observes how long the block took, in seconds, also when it raises"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(time() - start)
+
+    def cumulative(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        buckets, running = [], 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            buckets.append((bound, running))
+        return buckets, total, count
+
+    def fields(self):
+        buckets, total, count = self.cumulative()
+        fields = [('count', count), ('sum', total)]
+        fields.extend(('le_{}'.format(format_value(bound)), value) for bound, value in buckets)
+        return fields
+
+    def samples(self):
+        buckets, total, count = self.cumulative()
+        samples = []
+        for bound, value in buckets:
+            labels = self.labels + (('le', format_value(bound)),)
+            samples.append(('{}_bucket'.format(self.name), labels, value))
+        samples.append(('{}_sum'.format(self.name), self.labels, total))
+        samples.append(('{}_count'.format(self.name), self.labels, count))
+        return samples
+
+
+class Registry(object):
+    """All the series recorded in the process
+
+    A series is a metric name and its labels, created the first time it is asked for. A name is
+    always of the same kind, asking for a counter of a histogram's name raises
+    :py:class:`ValueError`.
+    """
+    def __init__(self):
+        self._series = {}
+        self._kinds = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, labels, help=None, **kwargs):
+        key = (name, tuple(sorted((k, unicode(v)) for k, v in labels.items())))
+        try:
+            return self._series[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if self._kinds.setdefault(name, cls.kind) != cls.kind:
+                raise ValueError('{} is a {}, not a {}'.format(name, self._kinds[name], cls.kind))
+            if help is not None:
+                self._help[name] = help
+            if key not in self._series:
+                self._series[key] = cls(name, key[1], **kwargs)
+            return self._series[key]
+
+    def counter(self, name, help=None, **labels):
+        return self._get(Counter, name, labels, help=help)
+
+    def histogram(self, name, help=None, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, help=help, buckets=buckets)
+
+    def timer(self, name, help=None, **labels):
+        """Context manager observing the duration of the block in the histogram ``name``"""
+        return self.histogram(name, help=help, **labels).time()
+
+    def series(self):
+        """All the series, sorted by name and labels"""
+        with self._lock:
+            return [self._series[key] for key in sorted(self._series)]
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._kinds.clear()
+            self._help.clear()
+
+    def to_lines(self, timestamp=None):
+        """The series in the influx line format, eg.
+
+        ``cfme_ssh_command_seconds,status=ok count=3i,sum=0.42,le_0.01=0i,... 1500000000000000000``
+        """
+        timestamp = int((time() if timestamp is None else timestamp) * 1e9)
+        lines = []
+        for series in self.series():
+            name = escape(series.name, ', ')
+            tags = ''.join(
+                u',{}={}'.format(escape(k, ',= '), escape(v, ',= ')) for k, v in series.labels)
+            fields = ','.join(
+                u'{}={}'.format(k, '{}i'.format(v) if isinstance(v, (int, long)) else repr(v))
+                for k, v in series.fields())
+            lines.append(u'{}{} {} {}'.format(name, tags, fields, timestamp))
+        return lines
+
+    def to_prometheus(self):
+        """The series in the Prometheus text exposition format"""
+        lines = []
+        by_name = {}
+        for series in self.series():
+            by_name.setdefault(series.name, []).append(series)
+        for name in sorted(by_name):
+            if name in self._help:
+                lines.append(u'# HELP {} {}'.format(name, escape(self._help[name], '\\')))
+            lines.append(u'# TYPE {} {}'.format(name, self._kinds[name]))
+            for series in by_name[name]:
+                for sample_name, labels, value in series.samples():
+                    if labels:
+                        sample_name += u'{{{}}}'.format(','.join(
+                            u'{}="{}"'.format(k, escape(v)) for k, v in labels))
+                    lines.append(u'{} {}'.format(sample_name, format_value(value)))
+        return u'\n'.join(lines) + u'\n'
+
+
+def record_rest_response(response, *args, **kwargs):
+    """``requests`` response hook observing the time REST API calls took until the response came
+
+    The calls are labelled by method, collection (``/api/<collection>/...``) and status class.
+    """
+    path = urlparse(response.url).path.split('/api', 1)[-1].strip('/').split('/')
+    metrics.histogram(
+        'cfme_rest_request_seconds', help='Time taken by REST API calls until the response came',
+        method=response.request.method, collection=path[0] or 'entry_point',
+        status='{}xx'.format(response.status_code // 100)
+    ).observe(response.elapsed.total_seconds())
+
+
+class LineFileExporter(threading.Thread):
+    """Appends the series of the registry to a file every ``interval`` seconds, and at stop."""
+    def __init__(self, registry, path, interval=10):
+        super(LineFileExporter, self).__init__(name='LineFileExporter')
+        self.daemon = True
+        self.registry = registry
+        self.path = str(path)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def write(self):
+        lines = self.registry.to_lines()
+        if not lines:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, 'a') as f:
+            f.write(u'\n'.join(lines).encode('utf-8') + '\n')
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception('Could not export the metrics to %s', self.path)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.write()
+
+
+class PrometheusExporter(object):
+    """Serves the registry in the Prometheus text format on ``http://<host>:<port>/metrics``
+
+    Port 0 picks a free port, the one used is in :py:attr:`port`.
+    """
+    def __init__(self, registry, port, host='0.0.0.0'):
+        self.registry = registry
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self_):
+                if self_.path.split('?')[0] not in ('/', '/metrics'):
+                    self_.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self_.send_response(200)
+                self_.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self_.send_header('Content-Length', str(len(body)))
+                self_.end_headers()
+                self_.wfile.write(body)
+
+            def log_message(self_, format, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name='PrometheusExporter')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+#: The registry the framework records into
+metrics = Registry()
@@ -9,8 +9,10 @@ from utils.perf import generate_statistics
 from datetime import datetime
 import dateutil.parser as du_parser
 from datetime import timedelta
+from itertools import chain
 from time import time
 import csv
+import multiprocessing
 import numpy
 import os
 import pygal
@@ -58,85 +60,248 @@ miq_swap = re.compile(r'Swap:\s+([0-9]*)k\stotal,\s+([0-9]*)k\sused,\s+([0-9]*)k
 miq_top = re.compile(r'([0-9]+)\s+[0-9]+\s+[A-Za-z0-9]+\s+[0-9]+\s+[0-9\-]+\s+([0-9\.mg]+)\s+'
     r'([0-9\.mg]+)\s+([0-9\.mg]+)\s+[SRDZ]\s+([0-9\.]+)\s+([0-9\.]+)')
 
-
-def evm_to_messages(evm_file, filters):
-    test_start = ''
-    test_end = ''
+# Prefilters, lines are only matched with the regular expressions above when they pass these:
+# Lines about workers (evm_to_workers used to grep for them) and a literal string each contains
+miqwkr_line = re.compile(r'Interrupt|MIQ\([A-Za-z]*\) ID|"evm_worker_uptime_exceeded|'
+    r'"evm_worker_memory_exceeded|"evm_worker_stop|Worker exiting.')
+miqwkr_literals = ('Interrupt', ') ID', '"evm_worker_', 'Worker exiting')
+# Literal string every message line (MIQ(MiqQueue.put) etc.) contains
+miqmsg_literal = 'MIQ(MiqQueue.'
+# Size in bytes of the chunks of the evm log parsed by each process
+evm_chunk_size = 64 * 1024 * 1024
+
+
+def parse_evm_lines(lines):
+    """Parses evm log lines into records of the messages and workers they are about
+
+    Lines are first checked for literal strings, and only the few lines containing one of them
+    are matched with the regexes. The records are tuples starting with the record type:
+
+    * ``('start', timestamp)`` for the first MIQ line
+    * ``('put', msg_id, msg_cmd, pid, timestamp, msg_args, line_number)``
+    * ``('get', msg_id, pid, timestamp, deq_time, line_number)``
+    * ``('delivered', msg_id, timestamp, del_time, line_number)``
+    * ``('worker', worker_id, worker_type, pid, timestamp)``
+    * ``('terminated', worker_id, reason, timestamp)``
+    * ``('interrupt', timestamp)``
+    * ``('lines', msg_lines, wkr_lines)`` last, with the number of lines parsed for messages
+      and workers; the line numbers of the other records count from the first line parsed
+    """
     line_count = 0
-    messages = {}
-    msg_cmds = {}
-
+    wkr_line_count = 0
+    first_miq = True
     runningtime = time()
-    evmlogfile = open(evm_file, 'r')
-    evm_log_line = evmlogfile.readline()
-    while evm_log_line:
+    for evm_log_line in lines:
         line_count += 1
-        evm_log_line = evm_log_line.strip()
-
-        miqmsg_result = miqmsg.search(evm_log_line)
-        if miqmsg_result:
+        if (line_count % 100000) == 0:
+            timediff = time() - runningtime
+            runningtime = time()
+            logger.info('Count {} : Parsed 100000 lines in %s', line_count, timediff)
 
-            # Obtains the first timestamp in the log file
-            if test_start == '':
+        if first_miq and 'MIQ(' in evm_log_line:
+            evm_log_line = evm_log_line.strip()
+            if miqmsg.search(evm_log_line):
+                first_miq = False
                 ts, pid = get_msg_timestamp_pid(evm_log_line)
-                test_start = ts
+                yield 'start', ts
+
+        if miqmsg_literal in evm_log_line:
+            evm_log_line = evm_log_line.strip()
+            for record in _parse_msg_line(evm_log_line, line_count):
+                yield record
 
-            # A message was first put on the queue, this starts its queuing time
-            if (miqmsg_result.group(1) == 'MiqQueue.put'):
+        if any(literal in evm_log_line for literal in miqwkr_literals):
+            if miqwkr_line.search(evm_log_line):
+                wkr_line_count += 1
+                for record in _parse_wkr_line(evm_log_line):
+                    yield record
 
-                msg_cmd = get_msg_cmd(evm_log_line)
-                msg_id = get_msg_id(evm_log_line)
+    yield 'lines', line_count, wkr_line_count
+
+
+def _parse_msg_line(evm_log_line, line_count):
+    miqmsg_result = miqmsg.search(evm_log_line)
+    if not miqmsg_result:
+        return
+    # A message was first put on the queue, this starts its queuing time
+    if miqmsg_result.group(1) == 'MiqQueue.put':
+        ts, pid = get_msg_timestamp_pid(evm_log_line)
+        yield ('put', get_msg_id(evm_log_line), get_msg_cmd(evm_log_line), pid, ts,
+            get_msg_args(evm_log_line), line_count)
+    elif miqmsg_result.group(1) == 'MiqQueue.get_via_drb':
+        ts, pid = get_msg_timestamp_pid(evm_log_line)
+        yield 'get', get_msg_id(evm_log_line), pid, ts, get_msg_deq(evm_log_line), line_count
+    elif miqmsg_result.group(1) == 'MiqQueue.delivered':
+        ts, pid = get_msg_timestamp_pid(evm_log_line)
+        yield 'delivered', get_msg_id(evm_log_line), ts, get_msg_del(evm_log_line), line_count
+
+
+def _parse_wkr_line(evm_log_line):
+    ts, pid = get_msg_timestamp_pid(evm_log_line)
+    miqwkr_result = miqwkr.search(evm_log_line)
+    if miqwkr_result:
+        yield ('worker', int(miqwkr_result.group(2)), miqwkr_result.group(1),
+            miqwkr_result.group(3), ts)
+        return
+    for reason in ('evm_worker_uptime_exceeded', 'evm_worker_memory_exceeded', 'evm_worker_stop'):
+        if reason in evm_log_line:
+            miqwkr_id_result = miqwkr_id.search(evm_log_line)
+            if miqwkr_id_result:
+                yield 'terminated', int(miqwkr_id_result.group(1)), reason, ts
+            return
+    if 'Interrupt' in evm_log_line:
+        yield 'interrupt', ts
+    elif 'Worker exiting.' in evm_log_line:
+        miqwkr_id_2_result = miqwkr_id_2.search(evm_log_line)
+        if miqwkr_id_2_result:
+            yield 'terminated', int(miqwkr_id_2_result.group(1)), 'Worker Exited', ts
+
+
+def evm_chunks(evm_file, chunk_size=evm_chunk_size):
+    """Splits the evm log into ``(evm_file, start, end)`` byte ranges of about chunk_size"""
+    size = os.path.getsize(evm_file)
+    return [(evm_file, start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)]
+
+
+def parse_evm_chunk(chunk):
+    """Parses the lines starting in a byte range of the evm log, returns the records as a list
+
+    See :py:func:`parse_evm_lines`, this is the function processes run on their chunk.
+    """
+    evm_file, start, end = chunk
+
+    def chunk_lines(evmlogfile):
+        if start:
+            # The line going on at the start of the chunk belongs to the previous chunk
+            evmlogfile.seek(start - 1)
+            evmlogfile.readline()
+        position = evmlogfile.tell()
+        while position < end:
+            evm_log_line = evmlogfile.readline()
+            if not evm_log_line:
+                break
+            position += len(evm_log_line)
+            yield evm_log_line
+
+    with open(evm_file, 'r') as evmlogfile:
+        return list(parse_evm_lines(chunk_lines(evmlogfile)))
+
+
+def evm_to_messages_and_workers(evm_file, filters, processes=1, chunk_size=evm_chunk_size):
+    """Parses the messages and workers out of the evm log in one pass
+
+    Args:
+        evm_file: Path to the evm log
+        filters: Mapping of suffix to regex; messages whose args match a regex get the suffix
+            added to their command
+        processes: If more than one, chunks of the log are parsed by a pool of this many
+            processes, the records they return are processed in order
+        chunk_size: Size in bytes of the chunks parsed by each process
+
+    Returns:
+        ``(messages, msg_cmds, test_start, test_end, line_count)`` as
+        :py:func:`evm_to_messages` does and ``(workers, wkr_mem_exc, wkr_upt_exc, wkr_stp,
+        wkr_int, wkr_ext, wkr_line_count)`` as :py:func:`evm_to_workers` does
+    """
+    test_start = ''
+    test_end = ''
+    line_count = 0
+    wkr_line_count = 0
+    messages = {}
+    msg_cmds = {}
+    workers = {}
+    terminations = {reason: 0 for reason in ('evm_worker_memory_exceeded',
+        'evm_worker_uptime_exceeded', 'evm_worker_stop', 'Interrupted', 'Worker Exited')}
+
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        chunks = evm_chunks(evm_file, chunk_size)
+        logger.info('Parsing %s in %d chunks with %d processes', evm_file, len(chunks), processes)
+        records = chain.from_iterable(pool.imap(parse_evm_chunk, chunks))
+    else:
+        evmlogfile = open(evm_file, 'r')
+        records = parse_evm_lines(evmlogfile)
+
+    try:
+        for record in records:
+            kind = record[0]
+            if kind == 'put':
+                msg_id, msg_cmd, pid, ts, msg_args, line_number = record[1:]
                 if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
                     test_end = ts
                     messages[msg_id] = MiqMsgStat()
-                    messages[msg_id].msg_id = msg_id
                     messages[msg_id].msg_id = '\'' + msg_id + '\''
                     messages[msg_id].msg_cmd = msg_cmd
                     messages[msg_id].pid_put = pid
                     messages[msg_id].puttime = ts
-                    msg_args = get_msg_args(evm_log_line)
                     if msg_args is False:
-                        logger.debug('Could not obtain message args line #: %s', line_count)
+                        logger.debug('Could not obtain message args line #: %s',
+                            line_count + line_number)
                     else:
                         messages[msg_id].msg_args = msg_args
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-            elif (miqmsg_result.group(1) == 'MiqQueue.get_via_drb'):
-                msg_id = get_msg_id(evm_log_line)
+                    logger.error('Could not obtain message id, line #: %s',
+                        line_count + line_number)
+            elif kind == 'get':
+                msg_id, pid, ts, deq_time, line_number = record[1:]
                 if msg_id:
                     if msg_id in messages:
-                        ts, pid = get_msg_timestamp_pid(evm_log_line)
                         test_end = ts
                         messages[msg_id].pid_get = pid
                         messages[msg_id].gettime = ts
-                        messages[msg_id].deq_time = get_msg_deq(evm_log_line)
+                        messages[msg_id].deq_time = deq_time
                     else:
                         logger.error('Message ID not in dictionary: %s', msg_id)
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-            elif (miqmsg_result.group(1) == 'MiqQueue.delivered'):
-                msg_id = get_msg_id(evm_log_line)
+                    logger.error('Could not obtain message id, line #: %s',
+                        line_count + line_number)
+            elif kind == 'delivered':
+                msg_id, ts, del_time, line_number = record[1:]
                 if msg_id:
-                    ts, pid = get_msg_timestamp_pid(evm_log_line)
                     test_end = ts
                     if msg_id in messages:
-                        messages[msg_id].del_time = get_msg_del(evm_log_line)
-                        messages[msg_id].total_time = messages[msg_id].deq_time + \
-                            messages[msg_id].del_time
+                        messages[msg_id].del_time = del_time
+                        messages[msg_id].total_time = messages[msg_id].deq_time + del_time
                     else:
                         logger.error('Message ID not in dictionary: %s', msg_id)
                 else:
-                    logger.error('Could not obtain message id, line #: %s', line_count)
-
-        if (line_count % 100000) == 0:
-            timediff = time() - runningtime
-            runningtime = time()
-            logger.info('Count {} : Parsed 100000 lines in %s', line_count, timediff)
-
-        evm_log_line = evmlogfile.readline()
+                    logger.error('Could not obtain message id, line #: %s',
+                        line_count + line_number)
+            elif kind == 'worker':
+                workerid, worker_type, pid, ts = record[1:]
+                if workerid not in workers:
+                    workers[workerid] = MiqWorker()
+                    workers[workerid].worker_type = worker_type
+                    workers[workerid].pid = pid
+                    workers[workerid].worker_id = workerid
+                    workers[workerid].start_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
+            elif kind == 'terminated':
+                workerid, reason, ts = record[1:]
+                if workerid in workers and not workers[workerid].terminated:
+                    terminations[reason] += 1
+                    workers[workerid].terminated = reason
+                    workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
+            elif kind == 'interrupt':
+                for workerid in workers:
+                    if not workers[workerid].end_ts:
+                        terminations['Interrupted'] += 1
+                        workers[workerid].terminated = 'Interrupted'
+                        workers[workerid].end_ts = datetime.strptime(
+                            record[1], '%Y-%m-%d %H:%M:%S.%f')
+            elif kind == 'start':
+                # Obtains the first timestamp in the log file
+                if test_start == '':
+                    test_start = record[1]
+            elif kind == 'lines':
+                line_count += record[1]
+                wkr_line_count += record[2]
+    finally:
+        if pool is not None:
+            pool.terminate()
+        else:
+            evmlogfile.close()
 
     # I tried to avoid two loops but this reduced the complexity of filtering on messages.
     # By filtering over messages, we can better display what is occuring under the covers, as a
@@ -160,81 +325,18 @@ def evm_to_messages(evm_file, filters):
             msg_cmds[msg_cmd]['queue'].append(round(messages[msg].deq_time, 2))
             msg_cmds[msg_cmd]['execute'].append(round(messages[msg].del_time, 2))
 
-    return messages, msg_cmds, test_start, test_end, line_count
-
-
-def evm_to_workers(evm_file):
-    # Use grep to reduce # of lines to sort through
-    p = subprocess.Popen(['grep', 'Interrupt\\|MIQ([A-Za-z]*) ID\\|"evm_worker_uptime_exceeded\\|'
-            '"evm_worker_memory_exceeded\\|"evm_worker_stop\\|Worker exiting.', evm_file],
-            stdout=subprocess.PIPE)
-    greppedevmlog, err = p.communicate()
-    greppedevmlog = greppedevmlog.strip()
+    return ((messages, msg_cmds, test_start, test_end, line_count),
+            (workers, terminations['evm_worker_memory_exceeded'],
+             terminations['evm_worker_uptime_exceeded'], terminations['evm_worker_stop'],
+             terminations['Interrupted'], terminations['Worker Exited'], wkr_line_count))
 
-    evmlines = greppedevmlog.split('\n')
 
-    workers = {}
-    wkr_upt_exc = 0
-    wkr_mem_exc = 0
-    wkr_stp = 0
-    wkr_int = 0
-    wkr_ext = 0
-    for evm_log_line in evmlines:
-        ts, pid = get_msg_timestamp_pid(evm_log_line)
+def evm_to_messages(evm_file, filters):
+    return evm_to_messages_and_workers(evm_file, filters)[0]
 
-        miqwkr_result = miqwkr.search(evm_log_line)
-        if miqwkr_result:
-            workerid = int(miqwkr_result.group(2))
-            if workerid not in workers:
-                workers[workerid] = MiqWorker()
-                workers[workerid].worker_type = miqwkr_result.group(1)
-                workers[workerid].pid = miqwkr_result.group(3)
-                workers[workerid].worker_id = int(workerid)
-                workers[workerid].start_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_uptime_exceeded' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_upt_exc += 1
-                        workers[workerid].terminated = 'evm_worker_uptime_exceeded'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_memory_exceeded' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_mem_exc += 1
-                        workers[workerid].terminated = 'evm_worker_memory_exceeded'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'evm_worker_stop' in evm_log_line:
-            miqwkr_id_result = miqwkr_id.search(evm_log_line)
-            if miqwkr_id_result:
-                workerid = int(miqwkr_id_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_stp += 1
-                        workers[workerid].terminated = 'evm_worker_stop'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'Interrupt' in evm_log_line:
-            for workerid in workers:
-                if not workers[workerid].end_ts:
-                    wkr_int += 1
-                    workers[workerid].terminated = 'Interrupted'
-                    workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
-        elif 'Worker exiting.' in evm_log_line:
-            miqwkr_id_2_result = miqwkr_id_2.search(evm_log_line)
-            if miqwkr_id_2_result:
-                workerid = int(miqwkr_id_2_result.group(1))
-                if workerid in workers:
-                    if not workers[workerid].terminated:
-                        wkr_ext += 1
-                        workers[workerid].terminated = 'Worker Exited'
-                        workers[workerid].end_ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f')
 
-    return workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext, len(evmlines)
+def evm_to_workers(evm_file):
+    return evm_to_messages_and_workers(evm_file, {})[1]
 
 
 def split_appliance_charts(top_appliance, charts_dir):
@@ -795,7 +897,7 @@ def top_to_workers(workers, top_file):
     return top_workers, len(top_lines)
 
 
-def perf_process_evm(evm_file, top_file):
+def perf_process_evm(evm_file, top_file, processes=1):
     msg_filters = {
         '-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"'),
         '-daily': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"daily\"'),
@@ -808,22 +910,18 @@ def perf_process_evm(evm_file, top_file):
     starttime = time()
     initialtime = starttime
 
-    logger.info('----------- Parsing evm log file for messages -----------')
-    messages, msg_cmds, test_start, test_end, msg_lc = evm_to_messages(evm_file, msg_filters)
+    logger.info('----------- Parsing evm log file for messages and workers -----------')
+    msg_results, wkr_results = evm_to_messages_and_workers(evm_file, msg_filters, processes)
+    messages, msg_cmds, test_start, test_end, msg_lc = msg_results
+    workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext, wkr_lc = wkr_results
     timediff = time() - starttime
     logger.info('----------- Completed Parsing evm log file -----------')
-    logger.info('Parsed %s lines of evm log file for messages in %s', msg_lc, timediff)
+    logger.info('Parsed %s lines of evm log file in %s', msg_lc, timediff)
     logger.info('Total # of Messages: %d', len(messages))
     logger.info('Total # of Commands: %d', len(msg_cmds))
     logger.info('Start Time: %s', test_start)
     logger.info('End Time: %s', test_end)
-
-    logger.info('----------- Parsing evm log file for workers -----------')
-    starttime = time()
-    workers, wkr_mem_exc, wkr_upt_exc, wkr_stp, wkr_int, wkr_ext, wkr_lc = evm_to_workers(evm_file)
-    timediff = time() - starttime
-    logger.info('----------- Completed Parsing evm log for workers -----------')
-    logger.info('Parsed %s lines of evm log file for workers in %s', wkr_lc, timediff)
+    logger.info('%s lines of evm log file were about workers', wkr_lc)
     logger.info('Total # of Workers: %d', len(workers))
     logger.info('# Workers Memory Exceeded: %s', wkr_mem_exc)
     logger.info('# Workers Uptime Exceeded: %s', wkr_upt_exc)
@@ -1029,10 +1127,12 @@ def perf_process_evm(evm_file, top_file):
 
 
 class MiqMsgStat(object):
+    # There is one of these for every message of a perf run, keep them small
+    headers = ['msg_id', 'msg_cmd', 'msg_args', 'pid_put', 'pid_get', 'puttime', 'gettime',
+        'deq_time', 'del_time', 'total_time']
+    __slots__ = headers
 
     def __init__(self):
-        self.headers = ['msg_id', 'msg_cmd', 'msg_args', 'pid_put', 'pid_get', 'puttime', 'gettime',
-            'deq_time', 'del_time', 'total_time']
         self.msg_id = ''
         self.msg_cmd = ''
         self.msg_args = ''
@@ -1066,9 +1166,11 @@ class MiqMsgLists(object):
 
 
 class MiqMsgBucket(object):
+    headers = ['date', 'hour', 'total_put', 'total_get', 'sum_deq', 'min_deq', 'max_deq',
+        'avg_deq', 'sum_del', 'min_del', 'max_del', 'avg_del']
+    __slots__ = headers
+
     def __init__(self):
-        self.headers = ['date', 'hour', 'total_put', 'total_get', 'sum_deq', 'min_deq', 'max_deq',
-            'avg_deq', 'sum_del', 'min_del', 'max_del', 'avg_del']
         self.date = ''
         self.hour = ''
         self.total_put = 0
@@ -1094,9 +1196,10 @@ class MiqMsgBucket(object):
 
 
 class MiqWorker(object):
+    headers = ['worker_id', 'worker_type', 'pid', 'start_ts', 'end_ts', 'terminated']
+    __slots__ = headers
 
     def __init__(self):
-        self.headers = ['worker_id', 'worker_type', 'pid', 'start_ts', 'end_ts', 'terminated']
         self.worker_id = 0
         self.worker_type = ''
         self.pid = ''
@@ -7,10 +7,15 @@ The rest of the functions, such as get_mgmt, get_crud, get_provider_keys etc ign
 dict and will provide you with whatever you ask for with no limitations.
 
 The main clue to know what is limited by the filters and what isn't is the 'filters' parameter.
+
+The filtering itself does not need the provider CRUD objects: the filters are run on the entries of
+a :py:class:`ProviderIndex`, built once from ``providers_data``, and their results are memoized,
+so that test generation, which lists the providers for every test function, only builds the CRUD
+objects of the providers that matched.
 """
 import operator
 import six
-from collections import Mapping, OrderedDict
+from collections import Mapping, OrderedDict, defaultdict
 from copy import copy
 
 from cfme.common.provider import all_types
@@ -22,6 +27,8 @@ from utils.log import logger
 providers_data = conf.cfme_data.get("management_systems", {})
 # Dict of active provider filters {name: ProviderFilter}
 global_filters = {}
+# The ProviderIndex of providers_data, see provider_index()
+_provider_index = None
 
 
 def load_setuptools_entrypoints():
@@ -218,6 +225,163 @@ class ProviderFilter(object):
     def copy(self):
         return copy(self)
 
+    def cache_key(self):
+        """ Hashable normalization of the filter's parameters, `None` if they are not hashable
+
+        Two filters with the same key let the same providers through, as long as the test flags
+        in ``cfme_data`` and the appliance version (for ``restrict_version``) are the same.
+        """
+        if type(self) is not ProviderFilter:
+            # Subclasses may filter on more than the parameters
+            return None
+        try:
+            key = (
+                _normalize(self.keys, as_set=True),
+                _normalize(self.classes, as_set=True),
+                None if self.required_fields is None else tuple(
+                    ('value',) + _normalize(field) if isinstance(field, tuple) else
+                    ('field', _normalize(field)) for field in self.required_fields),
+                _normalize(self.required_tags, as_set=True),
+                None if self.required_flags is None else frozenset(
+                    flag.strip() for flag in self.required_flags),
+                bool(self.restrict_version), bool(self.inverted), bool(self.conjunctive))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+def _normalize(value, as_set=False):
+    """ Makes a hashable value of a filter parameter out of lists and dicts """
+    if value is None or isinstance(value, six.string_types):
+        return value
+    if isinstance(value, Mapping):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = [_normalize(v) for v in value]
+        return frozenset(values) if as_set else tuple(values)
+    return value
+
+
+class ProviderEntry(object):
+    """ What the filters need of a provider, without building its CRUD object
+
+    Has the ``key``, ``name``, ``data`` and ``one_of`` of the CRUD object.
+    """
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+        self.name = data.get('name')
+        self.type = data.get('type')
+        self.provider_class = get_class_from_type(self.type)
+
+    def one_of(self, *classes):
+        return issubclass(self.provider_class, classes)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.key)
+
+
+class ProviderIndex(object):
+    """ Providers of ``providers_data`` indexed by class, tag, yaml field and excluded test flag
+
+    :py:meth:`matching` narrows the providers a filter has to be run on down with the indexes,
+    and memoizes the keys that passed by the filter's :py:meth:`ProviderFilter.cache_key`.
+
+    Args:
+        data: The ``management_systems`` from ``cfme_data``
+    """
+    def __init__(self, data):
+        self.data = data
+        self.entries = OrderedDict(
+            (key, ProviderEntry(key, prov_data)) for key, prov_data in data.items())
+        self.by_class = defaultdict(set)
+        self.by_tag = defaultdict(set)
+        self.by_field = defaultdict(set)
+        self.by_excluded_flag = defaultdict(set)
+        self.version_restricted = False
+        for key, entry in self.entries.items():
+            for cls in entry.provider_class.__mro__:
+                self.by_class[cls].add(key)
+            for tag in entry.data.get('tags', []):
+                self.by_tag[tag].add(key)
+            for field in entry.data:
+                self.by_field[field].add(key)
+            for flag in entry.data.get('excluded_test_flags', '').split(','):
+                self.by_excluded_flag[flag.strip()].add(key)
+            if entry.data.get('since_version') or entry.data.get('restricted_version'):
+                self.version_restricted = True
+        self.memo = {}
+
+    def memo_key(self, prov_filter):
+        """ The key the result of the filter is memoized by, `None` if it can't be """
+        key = prov_filter.cache_key()
+        if key is None:
+            return None
+        if prov_filter.required_flags:
+            key += (conf.cfme_data.get('test_flags', ''),)
+        if prov_filter.restrict_version and self.version_restricted:
+            try:
+                key += (str(version.current_version()),)
+            except Exception:
+                return None
+        return key
+
+    def candidates(self, prov_filter):
+        """ Keys of the providers that can pass the filter, as far as the indexes tell """
+        keys = set(self.entries)
+        if not prov_filter.conjunctive or prov_filter.inverted:
+            # Any single check passing lets a provider through
+            return keys
+        if prov_filter.keys is not None and not isinstance(prov_filter.keys, six.string_types):
+            keys = {key for key in keys if key in prov_filter.keys}
+        if prov_filter.classes is not None:
+            keys &= set().union(*[self.by_class[cls] for cls in prov_filter.classes])
+        if prov_filter.required_tags is not None:
+            keys &= set().union(*[self.by_tag[tag] for tag in prov_filter.required_tags])
+        for field in prov_filter.required_fields or []:
+            field_ident = field[0] if isinstance(field, tuple) else field
+            if isinstance(field_ident, six.string_types):
+                keys &= self.by_field[field_ident]
+        if prov_filter.required_flags:
+            test_flags = set(flag.strip() for flag in prov_filter.required_flags)
+            excluded = set().union(*[self.by_excluded_flag[flag] for flag in test_flags]) & keys
+            if excluded:
+                logger.info("Filtering providers %s out because they exclude the test flags %s",
+                            sorted(excluded), sorted(test_flags))
+                keys -= excluded
+        return keys
+
+    def matching(self, prov_filter):
+        """ Keys of the providers the filter lets through """
+        memo_key = self.memo_key(prov_filter)
+        try:
+            return self.memo[memo_key]
+        except KeyError:
+            pass
+        keys = frozenset(
+            key for key in self.candidates(prov_filter) if prov_filter(self.entries[key]))
+        if memo_key is not None:
+            self.memo[memo_key] = keys
+        return keys
+
+    def filter_keys(self, filters):
+        """ Keys of the providers all the filters let through, in the order of the yamls """
+        keys = set(self.entries)
+        for prov_filter in filters:
+            if not keys:
+                break
+            keys &= self.matching(prov_filter)
+        return [key for key in self.entries if key in keys]
+
+
+def provider_index():
+    """ The :py:class:`ProviderIndex` of ``providers_data``, built the first time it is needed """
+    global _provider_index
+    if _provider_index is None or _provider_index.data is not providers_data:
+        _provider_index = ProviderIndex(providers_data)
+    return _provider_index
+
 
 # Only providers without the 'disabled' tag
 global_filters['enabled_only'] = ProviderFilter(required_tags=['disabled'], inverted=True)
@@ -245,9 +409,13 @@ def list_providers(filters=None, use_global_filters=True, appliance=None):
     filters = filters or []
     if use_global_filters:
         filters = filters + global_filters.values()
-    providers = [get_crud(prov_key, appliance=appliance) for prov_key in providers_data]
+    indexed_filters = [f for f in filters if type(f) is ProviderFilter]
+    providers = [get_crud(prov_key, appliance=appliance)
+                 for prov_key in provider_index().filter_keys(indexed_filters)]
+    # Anything else is applied on the CRUD objects
     for prov_filter in filters:
-        providers = filter(prov_filter, providers)
+        if type(prov_filter) is not ProviderFilter:
+            providers = filter(prov_filter, providers)
     return providers
 
 
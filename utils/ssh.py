@@ -2,11 +2,15 @@
 import fauxfactory
 import iso8601
 import re
+import select
 import socket
 import sys
+import threading
 from collections import namedtuple
+from concurrent import futures
 from os import path as os_path
 from subprocess import check_call
+from time import time
 from urlparse import urlparse
 
 import paramiko
@@ -15,6 +19,7 @@ import diaper
 
 from utils import conf, ports, version
 from utils.log import logger
+from utils.metrics import metrics
 from utils.net import net_check
 from fixtures.pytest_store import store
 from utils.path import project_path
@@ -26,6 +31,15 @@ from utils.timeutil import parsetime
 # in seconds (float)
 RUNCMD_TIMEOUT = 1200.0
 
+# Size of the chunks read from a command's stdout/stderr, in bytes
+RECV_CHUNK_SIZE = 32768
+
+# Size of the chunks SSHTail reads from the followed file, in bytes
+TAIL_CHUNK_SIZE = 1024 * 1024
+
+# Return code of the results of commands that didn't run to completion in run_command_many
+RC_NOT_COMPLETED = -1
+
 
 class SSHResult(namedtuple("SSHResult", ["rc", "output"])):
     """Allows rich comparison for more convenient testing.
@@ -90,6 +104,61 @@ _ssh_pubkey_file = project_path.join('.generated_ssh_key.pub')
 _client_session = []
 
 
+class TransportPool(object):
+    """Shares connected paramiko transports between :py:class:`SSHClient` instances
+
+    SSH multiplexes channels over one transport, so every client connected to the same host and
+    port as the same user can run its commands over the same connection. The container (or pod)
+    a client targets is only part of the commands it runs, so it doesn't need its own connection.
+
+    A transport is closed when the last client using it is closed.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (transport, ids of the clients using it)
+        self._transports = {}
+
+    @staticmethod
+    def key(connect_kwargs):
+        return (connect_kwargs.get('hostname'), connect_kwargs.get('port', 22),
+                connect_kwargs.get('username'))
+
+    def acquire(self, key, client):
+        """Get the active transport for ``key`` and register ``client`` as its user, if any"""
+        with self._lock:
+            transport, users = self._transports.get(key, (None, None))
+            if transport is None or not transport.is_active():
+                self._transports.pop(key, None)
+                return None
+            users.add(id(client))
+            return transport
+
+    def add(self, key, transport, client):
+        """Make a transport ``client`` just connected available to other clients"""
+        with self._lock:
+            self._transports[key] = (transport, {id(client)})
+
+    def release(self, client, transport):
+        """Unregister ``client`` as a user of ``transport``
+
+        Returns ``True`` if other clients still use the transport, so it must stay open.
+
+        """
+        with self._lock:
+            for key, (pooled, users) in self._transports.items():
+                if pooled is transport:
+                    users.discard(id(client))
+                    if users:
+                        return True
+                    del self._transports[key]
+                    return False
+            return False
+
+
+_transport_pool = TransportPool()
+
+
 class SSHClient(paramiko.SSHClient):
     """paramiko.SSHClient wrapper
 
@@ -103,6 +172,8 @@ class SSHClient(paramiko.SSHClient):
             app and ``container`` then specifies the name of the pod to interact with.
         stdout: If specified, overrides the system stdout file for streaming output.
         stderr: If specified, overrides the system stderr file for streaming output.
+        share_transport: If True (the default), the connection is shared with the other clients
+            connected to the same host as the same user, see :py:class:`TransportPool`.
     """
     def __init__(self, stream_output=False, **connect_kwargs):
         super(SSHClient, self).__init__()
@@ -115,6 +186,7 @@ class SSHClient(paramiko.SSHClient):
 
         self.f_stdout = connect_kwargs.pop('stdout', sys.stdout)
         self.f_stderr = connect_kwargs.pop('stderr', sys.stderr)
+        self._share_transport = connect_kwargs.pop('share_transport', True)
 
         # load the defaults for ssh
         default_connect_kwargs = {
@@ -186,8 +258,21 @@ class SSHClient(paramiko.SSHClient):
     def close(self):
         with diaper:
             _client_session.remove(self)
+        if self._transport is not None and _transport_pool.release(self, self._transport):
+            # other clients still use the connection, only let go of it
+            self._transport = None
         super(SSHClient, self).close()
 
+    def close_transport(self):
+        """Closes the connection, even if other clients share it, and the client
+
+        The commands running over the connection end with an error instead of waiting for their
+        timeout. The next command connects again.
+        """
+        if self._transport is not None:
+            self._transport.close()
+        self.close()
+
     @property
     def connected(self):
         return self._transport and self._transport.active
@@ -200,9 +285,18 @@ class SSHClient(paramiko.SSHClient):
 
         if not self.connected:
             self._connect_kwargs.update(kwargs)
+            if self._share_transport:
+                pool_key = TransportPool.key(self._connect_kwargs)
+                transport = _transport_pool.acquire(pool_key, self)
+                if transport is not None:
+                    self._transport = transport
+                    return
             self._check_port()
             # Only install ssh keys if they aren't installed (or currently being installed)
-            return super(SSHClient, self).connect(**self._connect_kwargs)
+            result = super(SSHClient, self).connect(**self._connect_kwargs)
+            if self._share_transport:
+                _transport_pool.add(pool_key, self._transport, self)
+            return result
 
     def open_sftp(self, *args, **kwargs):
         if self.is_container:
@@ -257,6 +351,9 @@ class SSHClient(paramiko.SSHClient):
         command += '\n'
 
         output = []
+        start = time()
+        status = 'error'
+        session = None
         try:
             session = self.get_transport().open_session()
             if uses_sudo:
@@ -265,24 +362,9 @@ class SSHClient(paramiko.SSHClient):
             if timeout:
                 session.settimeout(float(timeout))
             session.exec_command(command)
-            stdout = session.makefile()
-            stderr = session.makefile_stderr()
-            while True:
-                if session.recv_ready:
-                    for line in stdout:
-                        output.append(line)
-                        if self._streaming:
-                            self.f_stdout.write(line)
-
-                if session.recv_stderr_ready:
-                    for line in stderr:
-                        output.append(line)
-                        if self._streaming:
-                            self.f_stderr.write(line)
-
-                if session.exit_status_ready():
-                    break
+            self._read_output(session, output, timeout)
             exit_status = session.recv_exit_status()
+            status = 'ok' if exit_status == 0 else 'failed'
             return SSHResult(exit_status, ''.join(output))
         except paramiko.SSHException:
             if reraise:
@@ -290,16 +372,51 @@ class SSHClient(paramiko.SSHClient):
             else:
                 logger.exception('Exception happened during SSH call')
         except socket.timeout:
+            status = 'timeout'
             logger.exception(
                 "Command %r timed out. Output before it failed was:\n%r",
                 command,
                 ''.join(output))
             raise
+        finally:
+            # The transport is kept for the next commands, its channels have to be given back
+            if session is not None:
+                session.close()
+            metrics.histogram(
+                'cfme_ssh_command_seconds', help='Time taken by SSHClient.run_command, by outcome',
+                status=status).observe(time() - start)
 
         # Returning two things so tuple unpacking the return works even if the ssh client fails
         # Return whatever we have in the output
         return SSHResult(1, ''.join(output))
 
+    def _read_output(self, session, output, timeout=None):
+        """Collect a command's stdout and stderr into ``output`` as they arrive
+
+        Waits on the channel with ``select`` between reads, so waiting for a slow command doesn't
+        use any CPU. Raises :py:class:`socket.timeout` if nothing happens on the channel for
+        ``timeout`` seconds.
+
+        """
+        while True:
+            if session.recv_ready():
+                chunk = session.recv(RECV_CHUNK_SIZE)
+                output.append(chunk)
+                if self._streaming:
+                    self.f_stdout.write(chunk)
+            elif session.recv_stderr_ready():
+                chunk = session.recv_stderr(RECV_CHUNK_SIZE)
+                output.append(chunk)
+                if self._streaming:
+                    self.f_stderr.write(chunk)
+            elif session.exit_status_ready() and (session.eof_received or session.closed):
+                return
+            else:
+                # the channel's fileno becomes readable on new data and when the channel closes
+                ready, _, _ = select.select([session], [], [], timeout or None)
+                if not ready:
+                    raise socket.timeout()
+
     def cpu_spike(self, seconds=60, cpus=2, **kwargs):
         """Creates a CPU spike of specific length and processes.
 
@@ -573,28 +690,110 @@ class SSHClient(paramiko.SSHClient):
 
 
 class SSHTail(SSHClient):
+    """Follows a remote file, yielding the lines added since the last iteration
+
+    The first iteration (or :py:meth:`set_initial_file_end`) only records where the file ends.
+    New lines are read in large chunks over SFTP; a line still being written is left for the next
+    iteration, unless it is the last one (see :py:meth:`raw_lines`). If the file's inode changes
+    or it shrinks (log rotation or truncation), the new file is read from its start.
+
+    Args:
+        remote_filename: Path of the file to follow
+        prefilter: If set, only lines matching this (POSIX extended) regular expression are
+            sent over from the remote host, which filters them with ``awk``
+        **connect_kwargs: See :py:class:`SSHClient`
+    """
 
-    def __init__(self, remote_filename, **connect_kwargs):
+    def __init__(self, remote_filename, prefilter=None, **connect_kwargs):
         super(SSHTail, self).__init__(stream_output=False, **connect_kwargs)
         self._remote_filename = remote_filename
+        self._prefilter = prefilter
         self._sftp_client = None
         self._remote_file_size = None
+        self._remote_file_inode = None
 
     def __iter__(self):
         for line in self.raw_lines():
             yield line.rstrip()
 
-    def raw_lines(self):
+    def _stat(self):
+        result = self.run_command(
+            'stat -c "%i %s" {}'.format(quote(self._remote_filename)), ensure_host=True)
+        if not result:
+            raise IOError('Could not stat {}: {}'.format(self._remote_filename, result.output))
+        inode, size = result.output.split()
+        return inode, int(size)
+
+    def raw_lines(self, final=False):
+        """Yields the lines added since the last iteration, with their line ends
+
+        Args:
+            final: Whether this is the last iteration, which also yields the unterminated line
+                at the end of the file instead of waiting for the rest of it
+        """
         with self as sshtail:
-            fstat = sshtail._sftp_client.stat(self._remote_filename)
+            inode, size = sshtail._stat()
             if self._remote_file_size is not None:
-                if self._remote_file_size < fstat.st_size:
-                    remote_file = self._sftp_client.open(self._remote_filename, 'r')
-                    remote_file.seek(self._remote_file_size, 0)
-                    while (remote_file.tell() < fstat.st_size):
-                        line = remote_file.readline()  # Note the  missing rstrip() here!
-                        yield line
-            self._remote_file_size = fstat.st_size
+                if inode != self._remote_file_inode or size < self._remote_file_size:
+                    logger.info('%s was rotated or truncated, reading it from the start',
+                        self._remote_filename)
+                    self._remote_file_size = 0
+                if self._remote_file_size < size:
+                    if self._prefilter:
+                        lines = sshtail._filtered_lines(size, final)
+                    else:
+                        lines = sshtail._chunked_lines(size, final)
+                    for line in lines:
+                        yield line  # Note the  missing rstrip() here!
+            else:
+                self._remote_file_size = size
+            self._remote_file_inode = inode
+
+    def _chunked_lines(self, size, final=False):
+        remote_file = self._sftp_client.open(self._remote_filename, 'r')
+        try:
+            remote_file.seek(self._remote_file_size, 0)
+            remote_file.prefetch(size)
+            remaining = size - self._remote_file_size
+            partial = ''
+            while remaining > 0:
+                chunk = remote_file.read(min(TAIL_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                lines = (partial + chunk).split('\n')
+                # the last piece is a line still being written (or empty), keep it for later
+                partial = lines.pop()
+                for line in lines:
+                    self._remote_file_size += len(line) + 1
+                    yield line + '\n'
+            if final and partial:
+                self._remote_file_size += len(partial)
+                yield partial
+        finally:
+            remote_file.close()
+
+    def _filtered_lines(self, size, final=False):
+        # A newline is appended to the new data, so the last line awk sees is the one still
+        # being written (or an empty one); awk filters every line before it and prints how many
+        # bytes they took up, leaving the unfinished line for the next iteration (unless final)
+        command = (
+            '{{ tail -c +{start} {filename} | head -c {length}; echo; }} | '
+            'LC_ALL=C PATTERN={pattern} FINAL={final} awk \'NR > 1 {{ n += length(prev) + 1; '
+            'if (prev ~ ENVIRON["PATTERN"]) print prev }} {{ prev = $0 }} '
+            'END {{ if (ENVIRON["FINAL"] && prev != "") {{ n += length(prev); '
+            'if (prev ~ ENVIRON["PATTERN"]) print prev }} print n + 0 }}\''
+            .format(
+                start=self._remote_file_size + 1, filename=quote(self._remote_filename),
+                length=size - self._remote_file_size, pattern=quote(self._prefilter),
+                final='1' if final else "''"))
+        result = self.run_command(command, ensure_host=True)
+        if not result:
+            raise IOError('Could not read {}: {}'.format(self._remote_filename, result.output))
+        lines = result.output.splitlines(True)
+        consumed = int(lines.pop())
+        self._remote_file_size += consumed
+        return lines
 
     def raw_string(self):
         return ''.join(self)
@@ -608,15 +807,76 @@ class SSHTail(SSHClient):
         self._sftp_client.close()
 
     def set_initial_file_end(self):
-        with self as sshtail:
-            fstat = sshtail._sftp_client.stat(self._remote_filename)
-            self._remote_file_size = fstat.st_size  # Seed initial size of file
+        self._remote_file_inode, self._remote_file_size = self._stat()  # Seed initial file end
 
     def lines_as_list(self):
         """Return lines as list"""
         return list(self)
 
 
+def run_command_many(targets, command, timeout=RUNCMD_TIMEOUT, deadline=None, max_workers=10,
+                     **kwargs):
+    """Run the same command on many hosts at once
+
+    The command runs in a bounded pool of threads, one host per thread.
+
+    Args:
+        targets: :py:class:`SSHClient` instances, or objects with an ``ssh_client`` attribute
+            (like :py:class:`utils.appliance.IPAppliance`), which is resolved in the worker thread
+        command: The command, see :py:meth:`SSHClient.run_command`
+        timeout: Per-host timeout, in seconds
+        deadline: Time, in seconds, after which hosts that haven't finished are given up on.
+            Their connections are closed, which ends the commands still running on them, but
+            nothing can stop a thread still connecting to its host. The threads are waited for
+            when the python process exits, so the deadline does not bound how long that takes.
+        max_workers: Maximum number of hosts to run the command on at the same time
+        **kwargs: Passed to :py:meth:`SSHClient.run_command`
+
+    Yields:
+        ``(target, result)`` tuples as the hosts finish, ``result`` being a
+        :py:class:`SSHResult`. If the command could not run to completion on a host (an error,
+        the timeout or the deadline), its result has ``rc`` set to ``RC_NOT_COMPLETED`` and the
+        reason as the output.
+
+    Usage:
+
+        for appliance, result in run_command_many(appliances, 'systemctl restart evmserverd'):
+            assert result, '{} failed to restart evm'.format(appliance.hostname)
+
+    """
+    # clients of the targets by target id, once resolved
+    clients = {}
+
+    def run(target):
+        client = target if isinstance(target, SSHClient) else target.ssh_client
+        clients[id(target)] = client
+        return client.run_command(command, timeout=timeout, reraise=True, **kwargs)
+
+    targets = list(targets)
+    executor = futures.ThreadPoolExecutor(max_workers=max(min(max_workers, len(targets)), 1))
+    pending = {executor.submit(run, target): target for target in targets}
+    try:
+        for future in futures.as_completed(pending, timeout=deadline):
+            target = pending.pop(future)
+            try:
+                yield target, future.result()
+            except Exception as e:
+                logger.exception('Command %r failed on %r', command, target)
+                yield target, SSHResult(RC_NOT_COMPLETED, '{}: {}'.format(type(e).__name__, e))
+    except futures.TimeoutError:
+        logger.error('Command %r did not finish on %d hosts in %s seconds',
+            command, len(pending), deadline)
+        for future, target in pending.items():
+            if not future.cancel() and id(target) in clients:
+                # the command is still running, its thread would wait for the per-host timeout
+                with diaper:
+                    clients[id(target)].close_transport()
+            yield target, SSHResult(RC_NOT_COMPLETED, 'deadline of {} seconds exceeded'.format(
+                deadline))
+    finally:
+        executor.shutdown(wait=False)
+
+
 def keygen():
     """Generate temporary ssh keypair for appliance SSH auth
 
@@ -90,9 +90,10 @@ from cfme.common.provider import BaseProvider
 from cfme.infrastructure.config_management import get_config_manager_from_config
 from cfme.infrastructure.pxe import get_pxe_server_from_config
 from cfme.roles import group_data
+from fixtures.pytest_store import store
 from utils.conf import cfme_data
 from utils.log import logger
-from utils.providers import ProviderFilter, list_providers
+from utils.providers import ProviderFilter, get_crud, list_providers
 
 
 def _param_check(metafunc, argnames, argvalues):
@@ -260,7 +261,20 @@ def providers(metafunc, filters=None):
         flags_filter = ProviderFilter(required_flags=test_flags)
         filters = filters + [flags_filter]
 
-    for provider in list_providers(filters):
+    collection_cache = store.collection_cache
+    if collection_cache is not None:
+        cache_key = collection_cache.function_key(metafunc)
+        if collection_cache.hit and cache_key not in collection_cache.providers:
+            collection_cache.invalidate('no providers stored for {}'.format(cache_key))
+        if collection_cache.hit:
+            provs = [get_crud(prov_key) for prov_key in collection_cache.providers[cache_key]]
+        else:
+            provs = list_providers(filters)
+            collection_cache.providers[cache_key] = [provider.key for provider in provs]
+    else:
+        provs = list_providers(filters)
+
+    for provider in provs:
         argvalues.append([provider])
         # Use the provider key for idlist, helps with readable parametrized test output
         idlist.append(provider.key)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from threading import Event
+
+import pytest
+from riggerlib import RiggerClient
+
+from artifactor import ArtifactorClient, AsyncArtifactorClient
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeServer(object):
+    """Stands for the server behind ``RiggerClient.fire_hook``, holds the hooks until opened."""
+
+    def __init__(self):
+        self.hooks = []
+        self.busy = Event()
+        self.open = Event()
+        self.open.set()
+
+    def fire_hook(self, client, hook_name, grab_result=False, wait_for_task=False, **kwargs):
+        self.busy.set()
+        self.open.wait()
+        self.hooks.append((hook_name, kwargs))
+        return len(self.hooks)
+
+    def hold(self, client, hook_name='held'):
+        """Closes the server and fires a hook, which keeps the sender busy until it is opened."""
+        self.open.clear()
+        self.busy.clear()
+        client.fire_hook(hook_name)
+        assert self.busy.wait(5)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(
+        ArtifactorClient, 'fire_hook',
+        lambda client, *args, **kwargs: server.fire_hook(client, *args, **kwargs))
+    yield server
+    server.open.set()
+
+
+def names(server):
+    return [hook_name for hook_name, kwargs in server.hooks]
+
+
+def test_unknown_full_policy():
+    with pytest.raises(ValueError):
+        AsyncArtifactorClient('127.0.0.1', 21212, full_policy='wait')
+
+
+def test_drop_when_full(server):
+    client = AsyncArtifactorClient('127.0.0.1', 21212, queue_size=2, full_policy='drop')
+    server.hold(client)
+    for hook_name in ['first', 'second', 'third', 'fourth']:
+        client.fire_hook(hook_name)
+    assert client.dropped == 2
+    server.open.set()
+    assert client.flush(5)
+    assert names(server) == ['held', 'first', 'second']
+
+
+def test_build_report_coalesced(server):
+    client = AsyncArtifactorClient('127.0.0.1', 21212)
+    server.hold(client)
+    client.fire_hook('build_report')
+    client.fire_hook('finish_test', test_name='test_a')
+    client.fire_hook('build_report')
+    client.fire_hook('build_report', only_failed=True)
+    client.fire_hook('build_report')
+    server.open.set()
+    assert client.flush(5)
+    assert server.hooks == [
+        ('held', {}),
+        ('finish_test', {'test_name': 'test_a'}),
+        ('build_report', {'only_failed': True}),
+        ('build_report', {}),
+    ]
+    assert client.coalesced == 2
+
+
+def test_grab_result_after_queued_hooks(server):
+    client = AsyncArtifactorClient('127.0.0.1', 21212)
+    client.fire_hook('first')
+    client.fire_hook('second')
+    assert client.fire_hook('result', grab_result=True) == 3
+    assert names(server) == ['first', 'second', 'result']
+
+
+def test_flush_timeout(server):
+    client = AsyncArtifactorClient('127.0.0.1', 21212)
+    assert client.flush(0)
+    server.hold(client)
+    client.fire_hook('queued')
+    assert not client.flush(0.1)
+    assert client.unsent == 2
+    server.open.set()
+    assert client.flush(5)
+    assert client.unsent == 0
+    assert names(server) == ['held', 'queued']
+
+
+def test_server_gone(monkeypatch):
+    requests = []
+
+    def request(client, data):
+        requests.append(data)
+        raise RuntimeError('No result from polling')
+
+    def fire_hook(client, hook_name, grab_result=False, wait_for_task=False, **kwargs):
+        # Like RiggerClient.fire_hook, that returns None whatever goes wrong
+        try:
+            return client._request({'hook_name': hook_name})
+        except Exception:
+            return None
+
+    monkeypatch.setattr(RiggerClient, '_request', request)
+    monkeypatch.setattr(ArtifactorClient, 'fire_hook', fire_hook)
+    client = AsyncArtifactorClient('127.0.0.1', 21212, flush_timeout=5)
+    for hook_name in ['first', 'second', 'third']:
+        client.fire_hook(hook_name)
+    assert not client.flush()
+    assert client.server_gone
+    assert requests == [{'hook_name': 'first'}]
+    assert client.unsent == 3
+    assert client.fire_hook('result', grab_result=True) is None
+    assert client.unsent == 4
+    assert requests == [{'hook_name': 'first'}]
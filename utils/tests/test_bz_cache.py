@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import threading
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+import pytest
+
+from utils.bz import BugCache, Bugzilla
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+def bug(id, blocks=(), clone_of=None, **fields):
+    if clone_of is None:
+        comment = 'Description of problem:'
+    else:
+        comment = '+++ This bug was initially created as a clone of Bug #{} +++'.format(clone_of)
+    data = {
+        'id': id, 'status': 'NEW', 'resolution': '', 'blocks': list(blocks), 'depends_on': [],
+        'version': ['5.8.0'], 'target_release': ['5.8.1'], 'cf_fixed_in': '',
+        'flags': [{'name': 'cfme-5.8.z', 'status': '+', 'setter': 'pm@example.com'}],
+        'product': 'CloudForms Management Engine', 'component': 'UI',
+        'summary': 'Bug {}'.format(id), 'cf_qa_whiteboard': '', 'keywords': [],
+        'assigned_to': 'dev@example.com', 'cf_internal_whiteboard': 'internal',
+        'comments': [{'text': comment}, {'text': 'More'}]}
+    data.update(fields)
+    return data
+
+
+# 4 is a duplicate of 1, which has the copy 2, which has the copy 3. 1 also blocks the tracker 5,
+# which is not a copy, so 6 is not one of the variants.
+BUGS = [
+    bug(1, blocks=[2, 5]),
+    bug(2, blocks=[3], clone_of=1),
+    bug(3, clone_of=2),
+    bug(4, status='CLOSED', resolution='DUPLICATE', dupe_of=1),
+    bug(5, blocks=[6]),
+    bug(6),
+    bug(7),
+]
+
+
+class FakeBugzilla(object):
+    """The XML-RPC calls python-bugzilla makes, with the ``Bug.get`` calls counted"""
+    def __init__(self, bugs):
+        self.bugs = {data['id']: data for data in bugs}
+        self.fetched = []
+
+    def _dispatch(self, method, params):
+        if method == 'Bugzilla.version':
+            return {'version': '5.0'}
+        elif method == 'Bugzilla.extensions':
+            return {'extensions': {'RedHat': {'version': '0.1'}}}
+        elif method == 'Bug.get':
+            ids = params[0]['ids']
+            self.fetched.append(ids)
+            if not params[0].get('permissive') and set(ids) - set(self.bugs):
+                raise xmlrpclib.Fault(101, 'Bug does not exist')
+            return {'bugs': [self.bugs[id] for id in ids if id in self.bugs], 'faults': []}
+        raise xmlrpclib.Fault(-32601, 'No method {}'.format(method))
+
+
+@pytest.yield_fixture
+def fake_bugzilla():
+    class Handler(SimpleXMLRPCRequestHandler):
+        rpc_paths = ('/xmlrpc.cgi',)
+
+    fake = FakeBugzilla(BUGS)
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), Handler, logRequests=False)
+    server.register_instance(fake)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    fake.url = 'http://127.0.0.1:{}/xmlrpc.cgi'.format(server.server_address[1])
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+def make_bugzilla(fake_bugzilla, tmpdir, ttl=3600):
+    return Bugzilla(
+        url=fake_bugzilla.url, user=None, password=None, cookiefile=None, tokenfile=None,
+        cache_file=tmpdir.join('bugzilla_cache.json').strpath, cache_ttl=ttl)
+
+
+def test_prefetch_batches_the_bug_graph(fake_bugzilla, tmpdir):
+    bugzilla = make_bugzilla(fake_bugzilla, tmpdir)
+    # The blockers, the duplicate's original, its possible copies, the copy's possible copies
+    assert bugzilla.prefetch([4, 7]) == 4
+    assert len(fake_bugzilla.fetched) == 4
+    assert 6 not in sum(fake_bugzilla.fetched, [])
+
+    variants = bugzilla.get_bug_variants(4)
+    assert sorted(variant.id for variant in variants) == [1, 2, 3]
+    assert bugzilla.get_bug(2).copy_of == 1
+    assert bugzilla.get_bug(2).release_flag == '5.8'
+    assert len(fake_bugzilla.fetched) == 4
+
+
+def test_cache_is_shared(fake_bugzilla, tmpdir):
+    make_bugzilla(fake_bugzilla, tmpdir).prefetch([4, 7])
+    fetched = len(fake_bugzilla.fetched)
+
+    bugzilla = make_bugzilla(fake_bugzilla, tmpdir)
+    assert bugzilla.prefetch([4, 7]) == 0
+    assert len(bugzilla.get_bug_variants(4)) == 3
+    assert len(fake_bugzilla.fetched) == fetched
+    # A bug nobody fetched yet is fetched alone and cached too, the file is written later
+    bugzilla.get_bug(6)
+    assert fake_bugzilla.fetched[-1] == [6]
+    assert bugzilla.cache.dirty
+    bugzilla.cache.flush()
+    assert make_bugzilla(fake_bugzilla, tmpdir).prefetch([6]) == 0
+
+
+def test_cache_writes_are_batched(fake_bugzilla, tmpdir, monkeypatch):
+    saves = []
+    save = BugCache.save
+
+    def counted_save(cache):
+        saves.append(cache.path)
+        save(cache)
+    monkeypatch.setattr(BugCache, 'save', counted_save)
+
+    bugzilla = make_bugzilla(fake_bugzilla, tmpdir)
+    bugzilla.prefetch([4, 7])
+    assert len(saves) == 1
+    # Nothing new, nothing written
+    bugzilla.prefetch([4, 7])
+    bugzilla.fetch_bugs([1, 2])
+    assert len(saves) == 1
+    # The single misses wait for the next batch
+    bugzilla.get_bug(5)
+    bugzilla.get_bug(6)
+    assert len(saves) == 1
+    bugzilla.fetch_bugs([5, 6])
+    assert len(saves) == 2
+    assert not bugzilla.cache.dirty
+
+
+def test_single_miss_saved_after_interval(fake_bugzilla, tmpdir):
+    bugzilla = make_bugzilla(fake_bugzilla, tmpdir)
+    bugzilla.cache.save_interval = 0
+    bugzilla.get_bug(6)
+    assert not bugzilla.cache.dirty
+    assert make_bugzilla(fake_bugzilla, tmpdir).prefetch([6]) == 0
+
+
+def test_cache_expires(fake_bugzilla, tmpdir):
+    make_bugzilla(fake_bugzilla, tmpdir).prefetch([7])
+    assert make_bugzilla(fake_bugzilla, tmpdir, ttl=0).prefetch([7]) == 1
+
+
+def test_uncached_field_fetches_bug(fake_bugzilla, tmpdir):
+    bugzilla = make_bugzilla(fake_bugzilla, tmpdir)
+    bugzilla.prefetch([7])
+    assert bugzilla.get_bug(7).internal_whiteboard == 'internal'
+    assert fake_bugzilla.fetched[-1] == [7]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fixtures.collection_cache import CollectionCache
+from utils import testgen
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeProvider(object):
+    def __init__(self, key):
+        self.key = key
+
+
+class FakeConfig(object):
+    def getoption(self, name):
+        return False
+
+
+class FakeMetafunc(object):
+    module = None
+    cls = None
+    fixturenames = []
+    config = FakeConfig()
+
+    def __init__(self, name):
+        self.function = lambda: None
+        self.function.__name__ = name
+
+
+class FakeStore(object):
+    def __init__(self, collection_cache):
+        self.collection_cache = collection_cache
+
+
+@pytest.fixture
+def collection_cache(monkeypatch):
+    collection_cache = CollectionCache(FakeConfig())
+    monkeypatch.setattr(testgen, 'store', FakeStore(collection_cache))
+    monkeypatch.setattr(
+        testgen, 'list_providers', lambda filters: [FakeProvider('listed')])
+    monkeypatch.setattr(testgen, 'get_crud', lambda key: FakeProvider(key))
+    return collection_cache
+
+
+def provider_keys(metafunc_name):
+    argnames, argvalues, idlist = testgen.providers(FakeMetafunc(metafunc_name))
+    return idlist
+
+
+def test_miss(collection_cache):
+    assert provider_keys('test_a') == ['listed']
+    assert collection_cache.providers == {'test_a#0': ['listed']}
+
+
+def test_hit(collection_cache):
+    collection_cache.hit = True
+    collection_cache.providers = {'test_a#0': ['stored']}
+    collection_cache.node_ids = {'test_a[stored]'}
+    assert provider_keys('test_a') == ['stored']
+    assert collection_cache.hit
+
+
+def test_hit_without_stored_function(collection_cache):
+    collection_cache.hit = True
+    collection_cache.providers = {'test_a#0': ['stored']}
+    collection_cache.node_ids = {'test_a[stored]'}
+    assert provider_keys('test_b') == ['listed']
+    assert collection_cache.providers == {'test_a#0': ['stored'], 'test_b#0': ['listed']}
+    # The stored collection is not this one, so nothing is uncollected by it and it is stored again
+    assert not collection_cache.hit
+    assert collection_cache.node_ids is None
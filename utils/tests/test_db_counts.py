@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+from sqlalchemy import create_engine
+
+from cfme.infrastructure.provider import InfraProvider
+from utils.db import Db, ems_count
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+STATEMENTS = [
+    'CREATE TABLE ext_management_systems (id INTEGER PRIMARY KEY, name TEXT)',
+    'CREATE TABLE vms (id INTEGER PRIMARY KEY, ems_id INTEGER, template BOOLEAN)',
+    'CREATE TABLE hosts (id INTEGER PRIMARY KEY, ems_id INTEGER)',
+    "INSERT INTO ext_management_systems VALUES (1, 'vSphere'), (2, 'RHEV'), (3, 'O''Brien')",
+    'INSERT INTO vms VALUES (1, 1, 1), (2, 1, 0), (3, 1, 0), (4, 2, 0), (5, 3, 1)',
+    'INSERT INTO hosts VALUES (1, 1), (2, 1), (3, 3)',
+]
+
+COUNTS = {
+    'num_template': ems_count('vms', 'vms.template = true'),
+    'num_vm': ems_count('vms', 'vms.template = false'),
+    'num_host': ems_count('hosts'),
+}
+
+
+@pytest.fixture
+def db():
+    db = Db(hostname='localhost', credentials={'username': 'root', 'password': 'smartvm'})
+    db.engine = create_engine('sqlite://')
+    for statement in STATEMENTS:
+        db.engine.execute(statement)
+    return db
+
+
+def test_count_by_ems(db):
+    assert db.count_by_ems(['vSphere', 'RHEV', "O'Brien", 'Missing'], COUNTS) == {
+        'vSphere': {'num_template': 1, 'num_vm': 2, 'num_host': 2},
+        'RHEV': {'num_template': 0, 'num_vm': 1, 'num_host': 0},
+        "O'Brien": {'num_template': 1, 'num_vm': 0, 'num_host': 1},
+    }
+
+
+def test_count_by_ems_of_nothing(db):
+    assert db.count_by_ems([], COUNTS) == {}
+    assert db.count_by_ems(['RHEV'], {}) == {'RHEV': {}}
+
+
+@pytest.mark.parametrize('stat, counted', [
+    ('num_vm', True),
+    ('num_datastore', True),
+    # Counted over REST by default
+    ('num_host', False),
+    ('num_cluster', False),
+])
+def test_counts_in_db(stat, counted):
+    assert InfraProvider.counts_in_db(stat) is counted
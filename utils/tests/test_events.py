@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from utils.events import Event, EventAttr, EventListener
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+COLUMNS = ('id', 'target_id', 'event_type', 'target_type', 'message', 'timestamp', 'vm_name')
+
+
+class FakeEventTool(object):
+    """Stands for :py:class:`utils.events.EventTool`, with the event_streams columns only"""
+    default_event_attrs = {column: EventAttr(**{column: None}) for column in COLUMNS}
+
+
+@pytest.fixture
+def listener():
+    listener = EventListener(appliance=None)
+    listener._tool = FakeEventTool()
+    return listener
+
+
+def got_event(event_type, target_type):
+    return Event(FakeEventTool(),
+                 EventAttr(event_type=event_type), EventAttr(target_type=target_type))
+
+
+def test_index_and_columns(listener):
+    assert listener._columns == EventListener.BASE_ATTRS
+    create = listener.new_event(event_type='vm_create', target_type='VmOrTemplate')
+    any_type = listener.new_event(target_type='VmOrTemplate', message='started')
+    compared = listener.new_event(
+        {'event_type': 'vm_', 'cmp_func': lambda exp, got: got.startswith(exp)},
+        target_name='my_vm')
+    listener.listen_to(create, any_type, compared)
+
+    assert sorted(listener._events_index) == [
+        (None, None), (None, 'VmOrTemplate'), ('vm_create', 'VmOrTemplate')]
+    # target_name is not a column, it is resolved to target_id
+    assert listener._columns == ('event_type', 'id', 'message', 'target_id', 'target_type')
+
+    listener.reset_events()
+    assert listener._events_index == {}
+    assert listener._columns == tuple(sorted(EventListener.BASE_ATTRS))
+
+
+def test_expected_events_for(listener):
+    create = listener.new_event(event_type='vm_create', target_type='VmOrTemplate')
+    any_type = listener.new_event(target_type='VmOrTemplate')
+    host = listener.new_event(event_type='vm_create', target_type='Host')
+    anything = listener.new_event()
+    listener.listen_to(anything, create, host, any_type)
+
+    def expected(event_type, target_type):
+        return [exp_event['event']
+                for exp_event in listener._expected_events_for(got_event(event_type, target_type))]
+
+    # in the order they were added
+    assert expected('vm_create', 'VmOrTemplate') == [anything, create, any_type]
+    assert expected('vm_delete', 'VmOrTemplate') == [anything, any_type]
+    assert expected('vm_create', 'Host') == [anything, host]
+    assert expected('vm_create', 'Service') == [anything]
+
+
+def test_backoff_while_no_notifications(listener, monkeypatch):
+    connection = object()
+    waits = []
+
+    def wait_for_events(conn, timeout):
+        assert conn is connection
+        waits.append(timeout)
+        if len(waits) == 6:
+            listener.stop()
+
+    monkeypatch.setattr(listener, '_listen', lambda: connection)
+    monkeypatch.setattr(listener, '_unlisten', lambda conn: None)
+    monkeypatch.setattr(listener, '_wait_for_events', wait_for_events)
+    monkeypatch.setattr(listener, 'get_next_portion', lambda: [])
+    listener.process_events()
+    assert waits == [0.2, 0.4, 0.8, 1.6, 3.0, 3.0]
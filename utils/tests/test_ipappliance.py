@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from collections import namedtuple
 from urlparse import urlparse
 import pytest
 
@@ -34,6 +35,21 @@ def test_ipappliance_managed_providers(infra_provider):
     assert infra_provider in ip_a.managed_known_providers
 
 
+def test_existing_providers_in_one_query(monkeypatch):
+    Named = namedtuple('Named', ['name'])
+    ip_a = IPAppliance.from_url('http://127.0.0.2/')
+    queries = []
+
+    def list_ems():
+        queries.append(None)
+        return [Named('unknown'), Named('b'), Named('c')]
+    monkeypatch.setattr(ip_a, '_list_ems', list_ems)
+
+    providers = [Named('a'), Named('c'), Named('b')]
+    assert ip_a.existing_providers(providers) == [Named('c'), Named('b')]
+    assert len(queries) == 1
+
+
 def test_context_hack(monkeypatch):
 
     ip_a = IPAppliance.from_url('http://127.0.0.2/')
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+
+import pytest
+
+from utils import log_validator
+from utils.log_validator import LogValidator, PatternMatcher, required_literal
+from utils.ssh import SSHTail
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+@pytest.mark.parametrize(('pattern', 'literal'), [
+    ('.*ERROR.*', 'ERROR'),
+    ('.*ERROR.*API.*MIQ\\(Api::ApiController.api_error\\).*', 'MIQ(Api::ApiController'),
+    ('.*(ERROR|WARN).*', None),
+    ('(?i).*error.*', None),
+])
+def test_required_literal(pattern, literal):
+    assert required_literal(pattern) == literal
+
+
+def test_pattern_matcher_priority():
+    matcher = PatternMatcher([
+        ('skip', ['.*ERROR.*API.*']),
+        ('failure', ['.*ERROR.*']),
+        ('matched', ['.*ERROR x.*', '.*to true.*'])], stop_on='skip')
+    assert matcher.match('ERROR in API x') == [('skip', '.*ERROR.*API.*')]
+    assert matcher.match('ERROR x to true') == [
+        ('failure', '.*ERROR.*'), ('matched', '.*ERROR x.*'), ('matched', '.*to true.*')]
+    assert matcher.match('sso_enabled to true') == [('matched', '.*to true.*')]
+    assert matcher.match('INFO nothing to see') == []
+
+
+def test_pattern_matcher_uncombinable_patterns():
+    # the same group name twice and a backreference can't be put in one regex
+    matcher = PatternMatcher([('failure', ['(?P<a>x)']), ('matched', ['(?P<a>y)', '(a)\\1'])])
+    assert matcher.match('aa') == [('matched', '(a)\\1')]
+    assert matcher.match('y') == [('matched', '(?P<a>y)')]
+
+
+class FakeTail(object):
+    """Stands for :py:class:`utils.ssh.SSHTail`, the lines are added to ``lines``"""
+    def __init__(self, remote_filename, **kwargs):
+        self.lines = []
+        self.partial = ''
+
+    def set_initial_file_end(self):
+        pass
+
+    def raw_lines(self, final=False):
+        lines, self.lines = self.lines, []
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = ''
+        return lines
+
+
+@pytest.fixture
+def validator(monkeypatch):
+    monkeypatch.setattr(log_validator, 'SSHTail', FakeTail)
+    return LogValidator(
+        'evm.log', failure_patterns=['.*ERROR.*'], matched_patterns=['.*done.*'],
+        monitor_interval=0.01)
+
+
+def test_stop_monitor(validator):
+    validator.fix_before_start()
+    monitor = validator._monitor
+    assert monitor.is_alive()
+    validator.stop_monitor()
+    assert not monitor.is_alive()
+    validator.stop_monitor()
+    validator._remote_file_tail.lines.append('ERROR after the monitor stopped\n')
+    with pytest.raises(pytest.fail.Exception):
+        validator.validate_logs()
+
+
+def test_validate_logs_checks_partial_line(validator):
+    validator.fix_before_start()
+    validator._remote_file_tail.lines.append('all done\n')
+    validator._remote_file_tail.partial = 'ERROR still being written'
+    with pytest.raises(pytest.fail.Exception) as exc_info:
+        validator.validate_logs()
+    assert 'ERROR still being written' in str(exc_info.value)
+    assert validator._monitor is None
+
+
+class FakeRemoteFile(StringIO):
+    def prefetch(self, size):
+        pass
+
+
+class FakeSFTPClient(object):
+    def __init__(self, content):
+        self.content = content
+
+    def open(self, filename, mode):
+        return FakeRemoteFile(self.content)
+
+
+@pytest.mark.parametrize('final', [False, True])
+def test_tail_partial_line(monkeypatch, final):
+    monkeypatch.setattr('utils.ssh.TAIL_CHUNK_SIZE', 4)
+    content = 'old\nfirst\nsecond\nunterminated'
+    tail = SSHTail.__new__(SSHTail)
+    tail._remote_filename = 'evm.log'
+    tail._sftp_client = FakeSFTPClient(content)
+    tail._remote_file_size = 4
+    lines = list(tail._chunked_lines(len(content), final=final))
+    if final:
+        assert lines == ['first\n', 'second\n', 'unterminated']
+        assert tail._remote_file_size == len(content)
+    else:
+        assert lines == ['first\n', 'second\n']
+        assert tail._remote_file_size == len('old\nfirst\nsecond\n')
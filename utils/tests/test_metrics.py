@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import urllib2
+
+import pytest
+
+from utils.metrics import LineFileExporter, PrometheusExporter, Registry
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    registry.counter('cfme_things_total', help='Things', kind='a').inc()
+    registry.counter('cfme_things_total', kind='a').inc(2)
+    histogram = registry.histogram('cfme_wait_seconds', buckets=(0.1, 1), step='All')
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    return registry
+
+
+def test_histogram_buckets(registry):
+    histogram = registry.histogram('cfme_wait_seconds', step='All')
+    assert histogram.cumulative() == ([(0.1, 2), (1, 3), (float('inf'), 4)], 3.65, 4)
+    with registry.timer('cfme_wait_seconds', step='All'):
+        pass
+    assert histogram.count == 5
+
+
+def test_kind_of_a_name_is_fixed(registry):
+    with pytest.raises(ValueError):
+        registry.histogram('cfme_things_total', kind='b')
+
+
+def test_to_lines(registry):
+    assert registry.to_lines(timestamp=1) == [
+        u'cfme_things_total,kind=a value=3i 1000000000',
+        u'cfme_wait_seconds,step=All count=4i,sum=3.65,le_0.1=2i,le_1=3i,le_+Inf=4i 1000000000',
+    ]
+
+
+def test_to_prometheus(registry):
+    assert registry.to_prometheus().splitlines() == [
+        u'# HELP cfme_things_total Things',
+        u'# TYPE cfme_things_total counter',
+        u'cfme_things_total{kind="a"} 3',
+        u'# TYPE cfme_wait_seconds histogram',
+        u'cfme_wait_seconds_bucket{step="All",le="0.1"} 2',
+        u'cfme_wait_seconds_bucket{step="All",le="1"} 3',
+        u'cfme_wait_seconds_bucket{step="All",le="+Inf"} 4',
+        u'cfme_wait_seconds_sum{step="All"} 3.65',
+        u'cfme_wait_seconds_count{step="All"} 4',
+    ]
+
+
+def test_exporters(registry, tmpdir):
+    exporter = LineFileExporter(registry, tmpdir.join('metrics.txt'), interval=60)
+    exporter.start()
+    exporter.stop()
+    assert len(tmpdir.join('metrics.txt').readlines()) == 2
+
+    exporter = PrometheusExporter(registry, 0, host='127.0.0.1')
+    exporter.start()
+    try:
+        response = urllib2.urlopen('http://127.0.0.1:{}/metrics'.format(exporter.port))
+        assert response.read().decode('utf-8') == registry.to_prometheus()
+    finally:
+        exporter.stop()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fixtures.parallelizer.scheduler import DurationScheduler, DurationStore
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+def provider_of(group):
+    for prov in ('rhevm', 'vsphere'):
+        if any(prov in nodeid for nodeid in group):
+            return prov
+
+
+def test_duration_scheduler_balances_longest_first():
+    durations = {'a': 100, 'b': 60, 'c': 50, 'd': 10}
+    scheduler = DurationScheduler(
+        [['a'], ['b'], ['c'], ['d']], ['slave00', 'slave01'], durations, provider_of)
+    assert scheduler.get('slave00') == ['a']
+    assert scheduler.get('slave01') == ['b']
+    assert scheduler.get('slave01') == ['c']
+    assert scheduler.get('slave01') == ['d']
+    assert scheduler.get('slave01') == []
+
+
+def test_duration_scheduler_steals_from_busiest_slave():
+    durations = {'a': 100, 'b': 10, 'c': 10}
+    scheduler = DurationScheduler(
+        [['a'], ['b'], ['c']], ['slave00', 'slave01'], durations, provider_of)
+    # slave00 still has its long group queued, slave01 steals it after running its own groups
+    assert scheduler.get('slave01') == ['b']
+    assert scheduler.get('slave01') == ['c']
+    assert scheduler.get('slave01') == ['a']
+    assert scheduler.get('slave00') == []
+
+
+def test_duration_scheduler_provider_affinity_is_a_cost():
+    durations = {'t[rhevm]': 100, 't[vsphere]': 90, 't2[rhevm]': 30}
+    groups = [['t[rhevm]'], ['t[vsphere]'], ['t2[rhevm]']]
+    # switching providers is expensive, so the second rhevm group stays with the first
+    scheduler = DurationScheduler(
+        groups, ['slave00', 'slave01'], durations, provider_of, provider_cost=100)
+    assert list(map(provider_of, scheduler.queues['slave00'])) == ['rhevm', 'rhevm']
+    # switching providers is free, so the load is balanced instead
+    scheduler = DurationScheduler(
+        groups, ['slave00', 'slave01'], durations, provider_of, provider_cost=0)
+    assert list(map(provider_of, scheduler.queues['slave01'])) == ['vsphere', 'rhevm']
+
+
+def test_duration_store_records_all_phases():
+    class Cache(dict):
+        def set(self, key, value):
+            self[key] = value
+
+    class Report(object):
+        def __init__(self, nodeid, duration):
+            self.nodeid, self.duration = nodeid, duration
+
+    store = DurationStore(Cache())
+    assert store.default_duration() > 0
+    for duration in (1, 2, 3):
+        store.record(Report('a', duration))
+    store.save()
+    assert DurationStore(store.cache).durations == {'a': 6}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import re
+from datetime import datetime
+
+import pytest
+
+from utils import perf_message_stats
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+CMD = 'ManageIQ::Providers::Vmware::InfraManager::Vm.perf_capture_realtime'
+HOURLY = '"2017-03-01T09:00:00Z", "hourly"'
+FILTERS = {'-hourly': re.compile(r'\"[0-9\-]*T[0-9\:]*Z\",\s\"hourly\"')}
+
+
+def line(time, pid, text):
+    return '[----] I, [2017-03-01T{} #{}:10ded733e8]  INFO -- : {}\n'.format(time, pid, text)
+
+
+EVM_LOG = ''.join([
+    line('00:00:00.000001', 8599, 'MIQ(MiqServer#start) Server starting'),
+    line('00:00:00.000012', 3926, 'MIQ(MiqGenericWorker) ID [284], PID [5284], Zone [default]'),
+    line('00:00:00.000013', 3927, 'MIQ(MiqPriorityWorker) ID [130], PID [5130], Zone [default]'),
+    line('00:00:00.000014', 3928, 'MIQ(MiqGenericWorker) ID [111], PID [5111], Zone [default]'),
+    line('00:00:00.000055', 8404,
+         'MIQ(MiqQueue.put) Message id: [1],  id: [], Command: [{}], Args: [[{}]]'.format(
+             CMD, HOURLY)),
+    line('00:00:00.000066', 4044,
+         'MIQ(MiqQueue.put) Message id: [2],  id: [], Command: [{}], Args: [[]]'.format(CMD)),
+    line('00:00:00.000082', 9531,
+         'MIQ(MiqQueue.get_via_drb) Message id: [1], Command: [{}], Args: [[{}]], '
+         'Dequeued in: [1.5] seconds'.format(CMD, HOURLY)),
+    line('00:00:00.000083', 4402,
+         'MIQ(MiqQueue.get_via_drb) Message id: [2], Command: [{}], Args: [[]], '
+         'Dequeued in: [0.25] seconds'.format(CMD)),
+    line('00:00:01.000100', 2637,
+         'MIQ(MiqQueue.delivered) Message id: [1], State: [ok], Delivered in [2.25] seconds'),
+    line('00:00:02.000018', 3612,
+         'MIQ(MiqServer#validate_worker) Worker [MiqGenericWorker] with ID: [284], PID: [5284] '
+         'uptime has reached the interval of 7200 seconds, raising "evm_worker_uptime_exceeded"'),
+    line('00:00:02.000026', 3187, 'MIQ(MiqGenericWorker::Runner) ID [111] PID [5111] '
+         'Worker exiting.'),
+    line('00:00:03.000100', 2638,
+         'MIQ(MiqQueue.delivered) Message id: [2], State: [ok], Delivered in [0.5] seconds'),
+    line('00:00:04.000000', 8599, 'MIQ(EvmApplication.stop) Interrupt signal received'),
+])
+
+# What evm_to_messages and evm_to_workers made of EVM_LOG before they parsed the log in one pass
+MESSAGES = {
+    '1': {
+        'msg_id': "'1'", 'msg_cmd': CMD + '-hourly', 'msg_args': '[{}]'.format(HOURLY),
+        'pid_put': '8404', 'pid_get': '9531', 'puttime': '2017-03-01 00:00:00.000055',
+        'gettime': '2017-03-01 00:00:00.000082', 'deq_time': 1.5, 'del_time': 2.25,
+        'total_time': 3.75},
+    '2': {
+        'msg_id': "'2'", 'msg_cmd': CMD, 'msg_args': '[]', 'pid_put': '4044', 'pid_get': '4402',
+        'puttime': '2017-03-01 00:00:00.000066', 'gettime': '2017-03-01 00:00:00.000083',
+        'deq_time': 0.25, 'del_time': 0.5, 'total_time': 0.75},
+}
+MSG_CMDS = {
+    CMD: {'queue': [0.25], 'execute': [0.5], 'total': [0.75]},
+    CMD + '-hourly': {'queue': [1.5], 'execute': [2.25], 'total': [3.75]},
+}
+WORKERS = {
+    111: {'worker_id': 111, 'worker_type': 'MiqGenericWorker', 'pid': '5111',
+          'start_ts': datetime(2017, 3, 1, 0, 0, 0, 14),
+          'end_ts': datetime(2017, 3, 1, 0, 0, 2, 26), 'terminated': 'Worker Exited'},
+    130: {'worker_id': 130, 'worker_type': 'MiqPriorityWorker', 'pid': '5130',
+          'start_ts': datetime(2017, 3, 1, 0, 0, 0, 13),
+          'end_ts': datetime(2017, 3, 1, 0, 0, 4), 'terminated': 'Interrupted'},
+    284: {'worker_id': 284, 'worker_type': 'MiqGenericWorker', 'pid': '5284',
+          'start_ts': datetime(2017, 3, 1, 0, 0, 0, 12),
+          'end_ts': datetime(2017, 3, 1, 0, 0, 2, 18), 'terminated': 'evm_worker_uptime_exceeded'},
+}
+
+
+@pytest.fixture
+def evm_file(tmpdir):
+    evm_file = tmpdir.join('evm.log')
+    evm_file.write(EVM_LOG)
+    return evm_file.strpath
+
+
+def test_parse_evm_lines():
+    records = list(perf_message_stats.parse_evm_lines(EVM_LOG.splitlines(True)))
+    assert records[0] == ('start', '2017-03-01 00:00:00.000012')
+    assert [record[0] for record in records[1:]] == [
+        'worker', 'worker', 'worker', 'put', 'put', 'get', 'get', 'delivered', 'terminated',
+        'terminated', 'delivered', 'interrupt', 'lines']
+    assert records[4] == ('put', '1', CMD, '8404', '2017-03-01 00:00:00.000055',
+                          '[{}]'.format(HOURLY), 5)
+    assert records[-1] == ('lines', 13, 6)
+
+
+def test_chunks_split_records(evm_file):
+    chunks = perf_message_stats.evm_chunks(evm_file, chunk_size=100)
+    assert len(chunks) > len(EVM_LOG.splitlines())
+    records = []
+    for chunk in chunks:
+        records.extend(perf_message_stats.parse_evm_chunk(chunk))
+    # Every line is parsed once, by the chunk it starts in
+    assert sum(record[1] for record in records if record[0] == 'lines') == 13
+    assert [record[0] for record in records if record[0] not in {'start', 'lines'}] == [
+        'worker', 'worker', 'worker', 'put', 'put', 'get', 'get', 'delivered', 'terminated',
+        'terminated', 'delivered', 'interrupt']
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_evm_to_messages_and_workers(evm_file, processes):
+    messages, workers = perf_message_stats.evm_to_messages_and_workers(
+        evm_file, FILTERS, processes=processes, chunk_size=100)
+    assert {msg_id: dict(msg) for msg_id, msg in messages[0].items()} == MESSAGES
+    assert messages[1:] == (
+        MSG_CMDS, '2017-03-01 00:00:00.000012', '2017-03-01 00:00:03.000100', 13)
+    assert {worker_id: dict(worker) for worker_id, worker in workers[0].items()} == WORKERS
+    # memory exceeded, uptime exceeded, stopped, interrupted, exited, worker lines
+    assert workers[1:] == (0, 1, 0, 1, 1, 6)
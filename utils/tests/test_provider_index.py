@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.cloud.provider import CloudProvider
+from cfme.cloud.provider.ec2 import EC2Provider
+from cfme.common.provider import BaseProvider
+from cfme.infrastructure.provider import InfraProvider
+from cfme.infrastructure.provider.rhevm import RHEVMProvider
+from utils import conf
+from utils.providers import ProviderFilter, ProviderIndex
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+PROVIDERS = {
+    'vsphere': {'type': 'virtualcenter', 'name': 'vSphere', 'tags': ['default'],
+                'provisioning': {'template': 'rhel'}, 'large': True},
+    'rhevm': {'type': 'rhevm', 'name': 'RHEV', 'tags': ['default', 'disabled'],
+              'excluded_test_flags': 'retire, provision'},
+    'ec2': {'type': 'ec2', 'name': 'EC2', 'tags': ['cloud'], 'do_not_prefer': True,
+            'provisioning': {'template': 'ami'}},
+    'scvmm': {'type': 'scvmm', 'name': 'SCVMM', 'excluded_test_flags': 'events'},
+}
+
+FILTERS = [
+    ProviderFilter(classes=[InfraProvider]),
+    ProviderFilter(classes=[BaseProvider], required_fields=['provisioning']),
+    ProviderFilter(classes=[CloudProvider, RHEVMProvider], inverted=True),
+    ProviderFilter(required_fields=[('do_not_prefer', True)], inverted=True),
+    ProviderFilter(required_fields=[['provisioning', 'template']]),
+    ProviderFilter(required_fields=[(['provisioning', 'template'], 'rhel')]),
+    ProviderFilter(required_tags=['disabled'], inverted=True),
+    ProviderFilter(keys=['default', 'ec2'], required_tags=['default', 'ec2'], conjunctive=False),
+    ProviderFilter(keys=['ec2', 'scvmm'], classes=[EC2Provider]),
+    ProviderFilter(classes=[InfraProvider], required_flags=['retire']),
+    ProviderFilter(required_flags=['events', 'not_a_flag']),
+]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setitem(conf.cfme_data, 'test_flags', 'retire, provision, events')
+    return ProviderIndex(PROVIDERS)
+
+
+@pytest.mark.parametrize('prov_filter', FILTERS)
+def test_index_matches_filter(index, prov_filter):
+    expected = {key for key, entry in index.entries.items() if prov_filter(entry)}
+    assert index.matching(prov_filter) == expected
+
+
+def test_matching_is_memoized(index):
+    assert index.matching(FILTERS[0]) == {'vsphere', 'rhevm', 'scvmm'}
+    same_filter = ProviderFilter(classes=[InfraProvider])
+    assert same_filter.cache_key() == FILTERS[0].cache_key()
+    index.entries.clear()
+    assert index.matching(same_filter) == {'vsphere', 'rhevm', 'scvmm'}
+
+
+def test_filter_keys_keeps_yaml_order(index):
+    assert index.filter_keys(FILTERS[:1]) == [
+        key for key in PROVIDERS if key in {'vsphere', 'rhevm', 'scvmm'}]
+    assert index.filter_keys(FILTERS[:2]) == ['vsphere']
+
+
+def test_unhashable_filter_is_not_memoized(index):
+    prov_filter = ProviderFilter(required_fields=[('provisioning', {'template': ['rhel']})])
+    assert prov_filter.cache_key() is not None
+    prov_filter.keys = [bytearray('vsphere')]
+    assert prov_filter.cache_key() is None
+    assert index.matching(prov_filter) == set()
+    assert not index.memo
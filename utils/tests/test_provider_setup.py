@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+import pytest
+
+from fixtures import provider as provider_fixtures
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class Skipped(Exception):
+    pass
+
+
+class FakeProvider(object):
+    def __init__(self, key, fails_to_create=False, refreshes=True):
+        self.key = key
+        self.fails_to_create = fails_to_create
+        self.refreshes = refreshes
+        self.created = False
+
+    def create(self, **kwargs):
+        if self.fails_to_create:
+            raise RuntimeError('{} cannot be added'.format(self.key))
+        self.created = True
+
+    def __repr__(self):
+        return self.key
+
+
+class FakeAppliance(object):
+    def __init__(self):
+        self.deleted = []
+
+    def existing_providers(self, providers):
+        return [p for p in providers if p.created]
+
+    def delete_providers(self, providers):
+        self.deleted.extend(providers)
+
+
+class FakeTerminalReporter(object):
+    def write_line(self, *args, **kwargs):
+        pass
+
+
+class FakeStore(object):
+    terminalreporter = FakeTerminalReporter()
+
+
+class FakeRequest(object):
+    class config(object):
+        class option(object):
+            provider_limit = 0
+
+
+@pytest.fixture
+def setup_failures(monkeypatch):
+    setup_failures = defaultdict(lambda: 0)
+    monkeypatch.setattr(provider_fixtures, '_setup_failures', setup_failures)
+    monkeypatch.setattr(provider_fixtures, '_problematic_providers', set())
+    monkeypatch.setattr(provider_fixtures, 'store', FakeStore())
+
+    def wait_for_refresh(pending):
+        pending[:] = [p for p in pending if not p.refreshes]
+        if pending:
+            raise RuntimeError('providers did not refresh')
+    monkeypatch.setattr(provider_fixtures, '_wait_for_refresh', wait_for_refresh)
+
+    def skip(request, providers, skip_msg):
+        raise Skipped(skip_msg)
+    monkeypatch.setattr(provider_fixtures, '_artifactor_skip_providers', skip)
+    return setup_failures
+
+
+def test_setup_all(setup_failures):
+    providers = [FakeProvider('a'), FakeProvider('b')]
+    appliance = FakeAppliance()
+    assert provider_fixtures.setup_all_or_skip(FakeRequest(), providers, appliance) == providers
+    assert all(p.created for p in providers)
+    assert not setup_failures
+
+
+def test_setup_all_create_failed(setup_failures):
+    a, b, c = FakeProvider('a'), FakeProvider('b', fails_to_create=True), FakeProvider('c')
+    appliance = FakeAppliance()
+    with pytest.raises(Skipped):
+        provider_fixtures.setup_all_or_skip(FakeRequest(), [a, b, c], appliance)
+    assert dict(setup_failures) == {b: 1}
+    assert appliance.deleted == []
+
+
+def test_setup_all_refresh_failed(setup_failures):
+    a, b, c = FakeProvider('a'), FakeProvider('b', refreshes=False), FakeProvider('c')
+    appliance = FakeAppliance()
+    with pytest.raises(Skipped):
+        provider_fixtures.setup_all_or_skip(FakeRequest(), [a, b, c], appliance)
+    assert dict(setup_failures) == {b: 1}
+    assert appliance.deleted == [b]
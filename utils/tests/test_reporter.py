@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from artifactor.plugins import reporter
+from artifactor.plugins.reporter import ReporterBase, ReportIndex
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+def finished_test(**kwargs):
+    test = {
+        'statuses': {'setup': ['passed', False], 'call': ['passed', False]},
+        'start_time': 10,
+        'finish_time': 20,
+        'slaveid': 'gw0',
+        'files': [{'os_filename': '/tmp/log/traceback.txt', 'file_type': 'traceback',
+                   'group_id': 'pytest'}],
+    }
+    test.update(kwargs)
+    return test
+
+
+def report_test(name, overall='passed', key='key'):
+    return {'name': name, 'key': key, 'outcomes': {'overall': overall}}
+
+
+class Reporter(ReporterBase):
+    def __init__(self, only_failed=False):
+        self.only_failed = only_failed
+        self._template_env = Environment(loader=DictLoader({
+            'test_report_page.html': '{% for test in tests %}{{ test.name }} {% endfor %}'}))
+
+
+def test_key_of_running_test():
+    assert reporter.test_key(finished_test(finish_time=None)) is None
+
+
+def test_key_same_artifacts():
+    test = finished_test(skipped={'type': 'blocker', 'reason': ['BZ#1', 'BZ#2']})
+    again = finished_test(skipped={'reason': ['BZ#1', 'BZ#2'], 'type': 'blocker'})
+    again['statuses'] = dict(reversed(test['statuses'].items()))
+    assert reporter.test_key(test) == reporter.test_key(again)
+
+
+@pytest.mark.parametrize('changes', [
+    {'finish_time': 21},
+    {'statuses': {'setup': ['passed', False], 'call': ['failed', False]}},
+    {'files': []},
+    {'old': True},
+])
+def test_key_changed_artifacts(changes):
+    assert reporter.test_key(finished_test()) != reporter.test_key(finished_test(**changes))
+
+
+def test_index_reload(tmpdir):
+    filename = tmpdir.join('report_index.jsonl').strpath
+    index = ReportIndex(filename)
+    index.set('test_a', 'a1', {'name': 'test_a'})
+    index.set('test_b', 'b1', {'name': 'test_b'})
+    index.set('test_running', None, {'name': 'test_running'})
+    assert index.get('test_a', 'a1') == {'name': 'test_a'}
+    assert index.get('test_a', 'a2') is None
+    assert index.get('test_running', None) is None
+
+    index = ReportIndex(filename)
+    assert index.entries.keys() == ['test_a', 'test_b']
+    assert index.get('test_b', 'b1') == {'name': 'test_b'}
+
+
+def test_index_reload_truncated(tmpdir):
+    filename = tmpdir.join('report_index.jsonl').strpath
+    index = ReportIndex(filename)
+    index.set('test_a', 'a1', {'name': 'test_a'})
+    index.set('test_b', 'b1', {'name': 'test_b'})
+    with open(filename, 'r+') as f:
+        f.truncate(os.path.getsize(filename) - 10)
+
+    index = ReportIndex(filename)
+    assert index.entries.keys() == ['test_a']
+    # The line cut short is gone, so the next line does not end up glued to it
+    index.set('test_b', 'b2', {'name': 'test_b'})
+    assert ReportIndex(filename).get('test_b', 'b2') == {'name': 'test_b'}
+
+
+def test_index_compacted(tmpdir):
+    filename = tmpdir.join('report_index.jsonl').strpath
+    index = ReportIndex(filename)
+    for run in range(5):
+        index.set('test_a', 'a{}'.format(run), {'run': run})
+        index.set('test_b', 'b{}'.format(run), {'run': run})
+
+    index = ReportIndex(filename)
+    with open(filename) as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['ident'], line['key']) for line in lines] == [('test_a', 'a4'), ('test_b', 'b4')]
+    assert index.get('test_a', 'a4') == {'run': 4}
+    assert not os.path.exists('{}.tmp'.format(filename))
+
+
+def test_render_pages(tmpdir, monkeypatch):
+    monkeypatch.setattr(reporter, 'PAGE_SIZE', 2)
+    log_dir = tmpdir.strpath
+    tests = [report_test('test_{}'.format(n)) for n in range(5)]
+    pages = Reporter().render_pages(tests, log_dir)
+    assert len(pages) == 3
+    assert len(set(pages)) == 3
+    assert tmpdir.join('report_pages', 'page-3.js').read() == (
+        'report_page_loaded(3, "test_4 ");\n')
+
+    reporter_ = Reporter()
+    assert reporter_.render_pages(tests, log_dir) == pages
+    for number in (1, 2, 3):
+        tmpdir.join('report_pages', 'page-{}.js'.format(number)).write('unchanged')
+    tests[2] = report_test('test_2', key='changed')
+    changed = reporter_.render_pages(tests, log_dir)
+    assert changed[0] == pages[0]
+    assert changed[1] != pages[1]
+    assert changed[2] == pages[2]
+    assert tmpdir.join('report_pages', 'page-1.js').read() == 'unchanged'
+    assert tmpdir.join('report_pages', 'page-2.js').read() == (
+        'report_page_loaded(2, "test_2 test_3 ");\n')
+    assert tmpdir.join('report_pages', 'page-3.js').read() == 'unchanged'
+
+
+def test_render_pages_running_test(tmpdir):
+    tests = [dict(report_test('test_a', key=None), duration=1)]
+    pages = Reporter().render_pages(tests, tmpdir.strpath)
+    tests[0]['duration'] = 2
+    assert Reporter().render_pages(tests, tmpdir.strpath) != pages
+
+
+def test_only_failed_pages(tmpdir, monkeypatch):
+    monkeypatch.setattr(reporter, 'PAGE_SIZE', 2)
+    tests = [
+        report_test('test_a'),
+        report_test('test_b', 'failed'),
+        report_test('test_c'),
+        report_test('test_d', 'error'),
+        report_test('test_e', 'failed'),
+    ]
+    reports = {}
+    only_failed = Reporter(only_failed=True)
+    monkeypatch.setattr(only_failed, 'process_data', lambda *args: {'tests': tests})
+    monkeypatch.setattr(
+        only_failed, 'tree_data', lambda tests, test_pages: (len(tests), test_pages))
+    monkeypatch.setattr(
+        only_failed, 'render_report', lambda data, *args: reports.update(data))
+    only_failed._run_report({}, tmpdir.strpath)
+
+    # The whole tree, but only the failed tests are on the pages
+    assert reports['tree'] == (5, {'test_b': 1, 'test_d': 1, 'test_e': 2})
+    assert len(reports['pages']) == 2
+    assert json.loads(reports['pages_json']) == reports['pages']
+    assert tmpdir.join('report_pages', 'page-2.js').read() == (
+        'report_page_loaded(2, "test_e ");\n')
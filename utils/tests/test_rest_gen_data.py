@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cfme.rest import gen_data
+from utils.wait import TimedOutError
+
+pytestmark = [
+    pytest.mark.nondestructive,
+    pytest.mark.skip_selenium,
+]
+
+
+class FakeEntity(object):
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return 'FakeEntity({})'.format(self.id)
+
+
+class FakeAction(object):
+    def __init__(self, collection):
+        self.collection = collection
+
+    def delete(self, *entities):
+        self.collection.deleted.append(list(entities))
+
+
+class FakeResult(object):
+    def __init__(self, resources):
+        self.resources = resources
+        self.subcount = len(resources)
+
+
+class FakeCollection(object):
+    """Stands for a REST collection, the entities matching a query are the ones in ``found``"""
+    name = 'vms'
+
+    def __init__(self, *found):
+        # the entities found by each request, the last ones by all the following requests
+        self.found = list(found)
+        self.requests = []
+        self.deleted = []
+        self.action = FakeAction(self)
+
+    def _request(self, params):
+        self.requests.append(params)
+        found = self.found.pop(0) if len(self.found) > 1 else self.found[0]
+        return FakeResult(found)
+
+    def filter(self, query):
+        return self._request({'filter[]': query.as_filters})
+
+    def query_string(self, **params):
+        return self._request(params)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gen_data, 'time', clock)
+    return clock
+
+
+def entities(*ids):
+    return [FakeEntity(id) for id in ids]
+
+
+def test_any_of():
+    assert gen_data._any_of('id', [1, 2, 3]).as_filters == ['id = 1', 'or id = 2', 'or id = 3']
+    assert gen_data._any_of('name', ['a', 'b']).as_filters == ['name = "a"', 'or name = "b"']
+
+
+def test_find_all():
+    found = entities(1, 2)
+    collection = FakeCollection(found)
+    assert gen_data._find_all(collection, gen_data._any_of('id', [1, 2])) == found
+    # all of them by one request
+    assert collection.requests == [
+        {'filter[]': ['id = 1', 'or id = 2'], 'expand': 'resources'}]
+
+
+def test_wait_for_entities(clock):
+    collection = FakeCollection([], entities(1), entities(1, 2), entities(1, 2, 3))
+    gen_data._wait_for_entities(collection, gen_data._any_of('id', [1, 2, 3]), 3)
+    assert len(collection.requests) == 4
+    assert clock.sleeps == [0.25, 0.5, 1.0]
+
+
+def test_wait_for_entities_backoff_timeout(clock):
+    collection = FakeCollection(entities(1))
+    with pytest.raises(TimedOutError) as exc_info:
+        gen_data._wait_for_entities(
+            collection, gen_data._any_of('id', [1, 2]), 2, num_sec=10, max_delay=2)
+    assert 'Only 1 of 2 vms found after 10 seconds' in str(exc_info.value)
+    # doubled up to max_delay, until the next try would come after the timeout
+    assert clock.sleeps == [0.25, 0.5, 1, 2, 2, 2, 2]
+    assert len(collection.requests) == 8
+
+
+def test_delete_entities():
+    remaining = entities(2, 3)
+    collection = FakeCollection(remaining)
+    gen_data._delete_entities(collection, gen_data._any_of('id', [1, 2, 3]))
+    assert collection.requests == [{'filter[]': ['id = 1', 'or id = 2', 'or id = 3']}]
+    assert collection.deleted == [remaining]
+
+
+def test_delete_entities_none_left():
+    collection = FakeCollection([])
+    gen_data._delete_entities(collection, gen_data._any_of('id', [1]))
+    assert collection.deleted == []
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 import pytest
+import socket
+from threading import Event
+
+from utils.ssh import RC_NOT_COMPLETED, SSHClient, SSHResult, run_command_many
 
 pytestmark = [
     pytest.mark.nondestructive,
@@ -26,3 +30,91 @@ def test_scp_client_can_put_a_file(appliance, tmpdir):
     assert "content" in tmpfile.read()
     # Clean up the server
     appliance.ssh_client.run_command("rm -f /tmp/{}".format(tmpfile.basename))
+
+
+class _FakeTarget(object):
+    """Stands in for an appliance, its ``ssh_client`` waits instead of running commands"""
+    def __init__(self, delay):
+        self.delay = delay
+        self.closed = Event()
+        self.finished = Event()
+
+    @property
+    def ssh_client(self):
+        return self
+
+    def run_command(self, command, **kwargs):
+        try:
+            if self.closed.wait(max(self.delay, 0)):
+                raise EOFError('Connection closed')
+            if self.delay < 0:
+                raise Exception('Connection refused')
+            return SSHResult(0, command)
+        finally:
+            self.finished.set()
+
+    def close_transport(self):
+        self.closed.set()
+
+
+def test_run_command_many_results_as_completed():
+    fast, slow, broken = _FakeTarget(0), _FakeTarget(0.5), _FakeTarget(-1)
+    results = list(run_command_many([slow, fast, broken], 'echo Testing!'))
+    assert [target for target, _ in results][-1] is slow
+    results = dict(results)
+    assert results[fast] == 'echo Testing!'
+    assert results[broken].rc == RC_NOT_COMPLETED
+    assert 'Connection refused' in results[broken]
+
+
+def test_run_command_many_deadline():
+    fast, stuck = _FakeTarget(0), _FakeTarget(30)
+    results = dict(run_command_many([fast, stuck], 'echo Testing!', deadline=0.5))
+    assert results[fast]
+    assert results[stuck].rc == RC_NOT_COMPLETED
+    # The connection of the stuck host was closed, so its thread did not wait for the command
+    assert stuck.closed.is_set()
+    assert stuck.finished.wait(5)
+    assert not fast.closed.is_set()
+
+
+class _FakeSession(object):
+    """Stands in for a paramiko channel, whose command never sends anything"""
+    closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeTransport(object):
+    def __init__(self, session):
+        self.session = session
+
+    def open_session(self):
+        return self.session
+
+
+def test_run_command_timeout_closes_session(monkeypatch):
+    session = _FakeSession()
+    # Not connected anywhere, only what run_command looks at is set
+    client = SSHClient.__new__(SSHClient)
+    client._connect_kwargs = {'username': 'root'}
+    client._container = None
+    client._transport = None
+    client.is_pod = False
+    monkeypatch.setattr(client, 'get_transport', lambda: _FakeTransport(session))
+
+    def read_output(session, output, timeout):
+        output.append('partial')
+        raise socket.timeout()
+    monkeypatch.setattr(client, '_read_output', read_output)
+
+    with pytest.raises(socket.timeout):
+        client.run_command('sleep 1000', timeout=1)
+    assert session.closed
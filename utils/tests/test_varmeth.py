@@ -76,3 +76,9 @@ def test_default_withparam(o):
     ids=["a", "b", "c"])
 def test_variants_withparam(o, v, params, returns):
     assert o.meth2(*params, method=v) == returns
+
+
+def test_is_default():
+    assert _TestClass.can_reach_secret.is_default("foobar")
+    assert not _TestClass.meth1.is_default("a")
+    assert not _TestClass.meth1.is_default("I'm not here!")
@@ -33,6 +33,7 @@
     s.mymethod(method="baz")  # => AttributeError
     s.myfoo()  # => foo!
     s.myfoo(method="foo")  # => foo!
+    SomeClass.myfoo.is_default("foo")  # => True
 
 Original idea:
     Pete Savage
@@ -71,6 +72,9 @@ class variable(object):
         return self
 
     def __get__(self, obj, objtype):
+        if obj is None:
+            return self
+
         def caller(*args, **kwargs):
             method = kwargs.pop("method", _default)
             if not method:
@@ -84,6 +88,10 @@ class variable(object):
             return method(obj, *args, **kwargs)
         return caller
 
+    def is_default(self, name):
+        """Whether the variant of that name is the default one, as it is for its alias."""
+        return name in self._mapping and self._mapping[name] is self._mapping.get(_default)
+
     def variant(self, *names):
         """Register a new variant of a method under a name."""
         def g(f):